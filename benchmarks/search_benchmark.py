@@ -0,0 +1,161 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the latency of SearchIndex.search on synthetic chats and directories,
+# e.g. by running from the root of the repository:
+#
+#   python -m benchmarks.search_benchmark --chats 50000 --directories 2000
+
+import argparse
+import random
+import statistics
+import time
+
+from tgib.data.search import SearchIndex
+
+# Words of the kind found in the titles of the indexed groups, which are
+# then mixed with random ones to get a realistically sized vocabulary
+common_words = [
+    "gruppo", "corso", "laurea", "magistrale", "triennale", "informatica", "ingegneria", "matematica",
+    "fisica", "economia", "lettere", "filosofia", "medicina", "chimica", "biologia", "statistica",
+    "analisi", "geometria", "algebra", "programmazione", "algoritmi", "basi", "dati", "reti", "sistemi",
+    "operativi", "calcolatori", "architettura", "sicurezza", "fondamenti", "canale", "anno", "primo",
+    "secondo", "terzo", "esami", "appunti", "studenti", "sapienza", "roma"
+]
+
+syllables = [consonant + vowel for consonant in ["", "b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "z",
+                                                 "ch", "gl", "gn", "pr", "st", "tr"] for vowel in "aeiou"]
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+
+def random_title(rng: random.Random, vocabulary: list, words: int) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(words)).title()
+
+
+def build_index(rng: random.Random, vocabulary: list, chats: int, directories: int) -> list:
+    SearchIndex.documents.clear()
+    SearchIndex.trigrams_index.clear()
+
+    titles = []
+
+    for directory_id in range(1, directories + 1):
+        SearchIndex.add_document(
+            ("directory", directory_id),
+            [random_title(rng, vocabulary, rng.randint(1, 3)), random_title(rng, vocabulary, rng.randint(1, 3))],
+            {"id": directory_id, "parent_id": None, "hidden_by": None}
+        )
+
+    for i in range(chats):
+        chat_id = -1001000000000 - i
+
+        title = random_title(rng, vocabulary, rng.randint(2, 6))
+
+        custom_title = random_title(rng, vocabulary, rng.randint(2, 4)) if rng.random() < 0.1 else None
+
+        SearchIndex.add_document(("chat", chat_id), [custom_title, title],
+                                 {"chat_id": chat_id, "title": title, "custom_title": custom_title})
+
+        titles.append(title)
+
+    return titles
+
+
+def random_query(rng: random.Random, titles: list) -> str:
+    words = rng.choice(titles).lower().split()
+
+    kind = rng.random()
+
+    # A word prefix (as typed in inline mode), a couple of whole words or a word with a typo
+    if kind < 0.4:
+        word = rng.choice(words)
+
+        return word[:rng.randint(min(3, len(word)), len(word))]
+
+    if kind < 0.8:
+        return " ".join(rng.sample(words, min(len(words), 2)))
+
+    word = list(rng.choice(words))
+
+    word[rng.randrange(len(word))] = rng.choice("aeiou")
+
+    return "".join(word)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def run_scenario(name: str, vocabulary: list, args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+
+    started_at = time.perf_counter()
+
+    titles = build_index(rng, vocabulary, args.chats, args.directories)
+
+    build_time = time.perf_counter() - started_at
+
+    queries = [random_query(rng, titles) for _ in range(args.queries)]
+
+    for query in queries[:args.warmup]:
+        SearchIndex.search(query, "chat", 10)
+
+    latencies = []
+
+    for query in queries:
+        started_at = time.perf_counter()
+
+        SearchIndex.search(query, "chat", 10)
+
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+    latencies.sort()
+
+    print(f"{name}: {args.chats} chats, {args.directories} directories, {len(vocabulary)} words, "
+          f"index built in {build_time:.1f}s")
+
+    print(f"  {len(latencies)} queries: p50 {percentile(latencies, 50):.2f} ms, p99 {percentile(latencies, 99):.2f} ms, "
+          f"max {latencies[-1]:.2f} ms, mean {statistics.mean(latencies):.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SearchIndex query latency on synthetic chats")
+    parser.add_argument("--chats", type=int, default=50000)
+    parser.add_argument("--directories", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--vocabulary", type=int, default=5000,
+                        help="number of distinct words of the realistic scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    vocabulary = common_words + list({random_word(rng) for _ in range(args.vocabulary)})[:max(0, args.vocabulary - len(common_words))]
+
+    run_scenario("realistic vocabulary", sorted(vocabulary), args)
+
+    # Worst case: every title is made of the same few words, so every query matches most chats
+    run_scenario("worst case", common_words, args)
+
+
+if __name__ == "__main__":
+    main()
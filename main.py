@@ -22,18 +22,23 @@
 from os import getenv as os_getenv
 
 import pytz
-from telegram import __version__ as tg_ver
+from telegram import __version__ as tg_ver, Update
 from telegram.constants import ParseMode
-from telegram.ext import Application, CallbackQueryHandler, Defaults, MessageHandler, filters, ChatMemberHandler
+from telegram.ext import Application, CallbackQueryHandler, Defaults, MessageHandler, filters, ChatMemberHandler, \
+    InlineQueryHandler
 
-from tgib.data.database import Database, SessionTable, AccountTable, ChatTable
+from tgib.data.database import Database, SessionTable, AccountTable, ChatTable, DirectoryTable
 from tgib.global_vars import GlobalVariables
+from tgib.handlers.inlinequeries import InlineQueries
 from tgib.handlers.messages import Messages
 from tgib.handlers.statuschanges import StatusChanges
 from tgib.handlers.commands import Commands
 from tgib.handlers.queries import Queries
 from tgib.i18n.locales import Locale
 from tgib.logs import Logger
+from tgib.ratelimiter import TokenBucket
+from tgib.ui.callbacks import CallbackDataCodec, CallbackQueriesRegistry
+from tgib.updates import ChatOrderedUpdateProcessor
 from tgib.urlooking.github import GitHubMonitor
 
 try:
@@ -42,9 +47,9 @@ try:
 except ImportError:
     __version_info__ = (0, 0, 0, 0, 0)  # type: ignore[assignment]
 
-if __version_info__ < (20, 0, 0, "alpha", 1):
+if __version_info__ < (20, 4, 0, "final", 0):
     raise RuntimeError(
-        f"This code is not compatible with your current PTB version {tg_ver}. It requires a version later than v20.0."
+        f"This code is not compatible with your current PTB version {tg_ver}. It requires v20.4 or later."
     )
 
 
@@ -59,8 +64,13 @@ def add_application_handlers(application: Application):
 
         CallbackQueryHandler(callback=Queries.callback_queries_handler),
 
+        InlineQueryHandler(callback=InlineQueries.inline_queries_handler),
+
         ChatMemberHandler(callback=StatusChanges.my_chat_member_handler,
-                          chat_member_types=ChatMemberHandler.MY_CHAT_MEMBER)
+                          chat_member_types=ChatMemberHandler.MY_CHAT_MEMBER),
+
+        ChatMemberHandler(callback=StatusChanges.chat_member_handler,
+                          chat_member_types=ChatMemberHandler.CHAT_MEMBER)
     ])
 
 
@@ -71,19 +81,77 @@ def main() -> None:
 
     Database.init_db()
 
-    Queries.register_fixed_queries()
+    ChatTable.init_indexes()
+
+    DirectoryTable.init_search_index()
+
+    CallbackQueriesRegistry.register_fixed_queries()
 
     defaults = Defaults(parse_mode=ParseMode.HTML, tzinfo=pytz.timezone('Europe/Rome'), disable_web_page_preview=True)
 
-    application = Application.builder().token(os_getenv("TOKEN")).defaults(defaults).build()
+    update_workers = os_getenv("UPDATE_WORKERS")
+
+    update_processor = ChatOrderedUpdateProcessor(
+        workers=int(update_workers) if update_workers else ChatOrderedUpdateProcessor.default_workers
+    )
+
+    update_processor.update_filters.append(Queries.filter_duplicate_clicks)
+
+    application = Application.builder().token(os_getenv("TOKEN")).defaults(defaults) \
+        .concurrent_updates(update_processor).build()
     application: Application
 
     application.job_queue.run_once(callback=SessionTable.expire_old_sessions, when=0)
 
+    application.job_queue.run_repeating(
+        callback=SessionTable.expire_inactive_sessions,
+        interval=SessionTable.expire_inactive_sessions_interval,
+        first=SessionTable.expire_inactive_sessions_interval
+    )
+
     add_application_handlers(application)
 
+    refresh_workers = os_getenv("REFRESH_WORKERS")
+
+    if refresh_workers:
+        ChatTable.fetch_chats_workers = int(refresh_workers)
+
+    refresh_api_rate = os_getenv("REFRESH_API_RATE")
+
+    if refresh_api_rate:
+        ChatTable.api_rate_limiter = TokenBucket(rate=float(refresh_api_rate))
+
     application.job_queue.run_once(callback=ChatTable.fetch_chats, when=0, data=application.bot)
 
+    refresh_sla_hours = os_getenv("REFRESH_SLA_HOURS")
+
+    if refresh_sla_hours:
+        ChatTable.stale_chats_refresh_sla = float(refresh_sla_hours) * 60 * 60
+
+    application.job_queue.run_repeating(
+        callback=ChatTable.refresh_stale_chats,
+        interval=ChatTable.stale_chats_refresh_interval,
+        first=ChatTable.stale_chats_refresh_interval,
+        data=application.bot
+    )
+
+    callback_data_secret = os_getenv("CALLBACK_DATA_SECRET")
+
+    if callback_data_secret:
+        CallbackDataCodec.secret = callback_data_secret.encode()
+
+    else:
+        CallbackDataCodec.secret = CallbackDataCodec.derive_secret(os_getenv("TOKEN"))
+
+    if os_getenv("PERSIST_CALLBACK_QUERIES", "").lower() in ("1", "true", "yes"):
+        CallbackQueriesRegistry.persist_registered_queries = True
+
+    application.job_queue.run_repeating(
+        callback=Queries.save_registered_queries,
+        interval=Queries.save_registered_queries_interval,
+        first=Queries.save_registered_queries_interval
+    )
+
     GitHubMonitor.init(application.bot)
 
     GlobalVariables.set_accounts_count(AccountTable.get_account_records_count())
@@ -105,7 +173,9 @@ def main() -> None:
         first=1
     )
 
-    application.run_polling()
+    # chat_member updates, used to keep the admins of the indexed groups up to date,
+    # are only sent by Telegram when explicitly requested
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+
+from tgib.data import caches
+from tgib.data.caches import TTLCache
+
+
+class TTLCachePeekTest(unittest.TestCase):
+    def test_peek_does_not_evict(self):
+        evicted = {}
+
+        cache = TTLCache(maxsize=10, ttl=60, on_evict=evicted.__setitem__)
+
+        cache.set(1, "menu")
+
+        self.assertEqual(cache.peek(1), "menu")
+
+        with mock.patch.object(caches, "monotonic", return_value=caches.monotonic() + 120):
+            self.assertIsNone(cache.peek(1))
+
+            self.assertEqual(cache.keys(), [1])
+
+            self.assertEqual(evicted, {})
+
+            cache.expire()
+
+        self.assertEqual(evicted, {1: "menu"})
+
+    def test_peek_does_not_refresh_recency(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+
+        cache.set(1, "a")
+        cache.set(2, "b")
+
+        cache.peek(1)
+
+        cache.set(3, "c")
+
+        self.assertEqual(cache.keys(), [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import unittest
+from unittest import mock
+
+from tgib.data.database import DirectoryTable
+from tgib.handlers.queries import Queries
+from tgib.ui.callbacks import CallbackDataCodec
+
+
+class CallbackDataCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.secret = CallbackDataCodec.secret
+
+        CallbackDataCodec.secret = CallbackDataCodec.derive_secret("123456:TEST")
+
+    def tearDown(self):
+        CallbackDataCodec.secret = self.secret
+
+    def test_signed_round_trip(self):
+        encoded_data = CallbackDataCodec.encode("index", [-1001234567890, 5, 0, 0])
+
+        self.assertEqual(CallbackDataCodec.decode(encoded_data), ("index", [-1001234567890, 5, 0, 0]))
+
+    def test_forged_data_is_rejected(self):
+        encoded_data = CallbackDataCodec.encode("index", [-1001234567890, 5, 0, 0])
+
+        encoded_payload = encoded_data[len(CallbackDataCodec.prefix):]
+
+        payload = base64.urlsafe_b64decode(encoded_payload + "=" * (-len(encoded_payload) % 4))
+
+        # The same signature with another directory id, and the same arguments without a signature
+        tampered_payload = payload[:-CallbackDataCodec.signature_length - 3] + bytes([12]) + payload[-CallbackDataCodec.signature_length - 2:]
+
+        unsigned_payload = payload[:-CallbackDataCodec.signature_length]
+
+        for forged_payload in (tampered_payload, unsigned_payload):
+            forged_data = CallbackDataCodec.prefix + base64.urlsafe_b64encode(forged_payload).rstrip(b"=").decode()
+
+            self.assertIsNone(CallbackDataCodec.decode(forged_data))
+
+    def test_nothing_is_packed_without_secret(self):
+        encoded_data = CallbackDataCodec.encode("index", [-1001234567890, 5, 0, 0])
+
+        CallbackDataCodec.secret = None
+
+        self.assertIsNone(CallbackDataCodec.encode("index", [-1001234567890, 5, 0, 0]))
+
+        self.assertIsNone(CallbackDataCodec.decode(encoded_data))
+
+
+class DirectoryAccessTest(unittest.TestCase):
+    def setUp(self):
+        directories = {1: {"id": 1, "parent_id": None, "hidden_by": None},
+                       2: {"id": 2, "parent_id": 1, "hidden_by": 42},
+                       3: {"id": 3, "parent_id": 2, "hidden_by": None}}
+
+        patcher = mock.patch.object(DirectoryTable, "get_directory_data",
+                                    side_effect=lambda directory_id: (directories.get(directory_id), directory_id in directories))
+        patcher.start()
+
+        self.addCleanup(patcher.stop)
+
+    def test_hidden_directories_are_only_accessible_to_admins(self):
+        user_data, admin_data = {"is_admin": False}, {"is_admin": True}
+
+        self.assertTrue(Queries.user_can_access_directory(user_data, 1))
+
+        for directory_id in (2, 3):
+            self.assertFalse(Queries.user_can_access_directory(user_data, directory_id))
+
+            self.assertTrue(Queries.user_can_access_directory(admin_data, directory_id))
+
+    def test_missing_directories_are_not_accessible(self):
+        self.assertFalse(Queries.user_can_access_directory({"is_admin": True}, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
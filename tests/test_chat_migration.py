@@ -0,0 +1,153 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+
+import telegram
+
+from tgib.data.caches import TTLCache
+from tgib.data.database import ChatTable, Database
+from tgib.data.lookups import TelegramLookups
+from tgib.data.search import SearchIndex
+from tgib.logs import Logger
+
+
+class FetchMigratedChatTest(unittest.IsolatedAsyncioTestCase):
+    old_chat_id = -1001
+
+    new_chat_id = -1002
+
+    admin_id = 42
+
+    def setUp(self):
+        # The indexes are class-level state, so each test works on empty ones which are then restored
+        for patcher in (mock.patch.object(ChatTable, "cached_admin_chat_ids", {}),
+                        mock.patch.object(ChatTable, "cached_chat_admins", {}),
+                        mock.patch.object(ChatTable, "cached_chat_index_states", {}),
+                        mock.patch.object(ChatTable, "chat_admins_updated_at", TTLCache()),
+                        mock.patch.object(ChatTable, "last_refresh_times", {}),
+                        mock.patch.object(SearchIndex, "documents", {}),
+                        mock.patch.object(SearchIndex, "trigrams_index", {}),
+                        mock.patch.object(TelegramLookups, "caches", {method_name: TTLCache() for method_name in TelegramLookups.caches})):
+            patcher.start()
+
+            self.addCleanup(patcher.stop)
+
+        ChatTable.update_admins_index(self.old_chat_id, [self.admin_id])
+        ChatTable.update_search_index(self.old_chat_id, title="Old group")
+
+        self.old_chat_data = {"chat_id": self.old_chat_id, "title": "Old group", "invite_link": None,
+                              "chat_admins": [self.admin_id], "chat_owner_id": None,
+                              "missing_permissions": False, "directory_id": None}
+
+        bot_member = mock.Mock(spec=telegram.ChatMemberAdministrator, can_invite_users=True)
+
+        chat = mock.Mock(title="New supergroup", invite_link="https://t.me/+new")
+
+        admin = mock.Mock(spec=telegram.ChatMemberOwner, user=mock.Mock(id=self.admin_id))
+
+        self.chat_info = (bot_member, chat, [admin])
+
+        self.get_telegram_chat_info = mock.AsyncMock(side_effect=[telegram.error.ChatMigrated(self.new_chat_id), self.chat_info])
+
+        self.unpatched_migrate_chat_id = ChatTable.migrate_chat_id
+
+        def migrate_chat_id(old_chat_id, new_chat_id):
+            ChatTable.update_index_state(new_chat_id)
+
+            ChatTable.remove_from_admins_index(old_chat_id)
+
+            SearchIndex.remove_document(("chat", old_chat_id))
+
+            return True
+
+        for patcher in (mock.patch.object(ChatTable, "get_telegram_chat_info", self.get_telegram_chat_info),
+                        mock.patch.object(ChatTable, "migrate_chat_id", side_effect=migrate_chat_id),
+                        mock.patch.object(Database, "connection", mock.Mock()),
+                        mock.patch.object(Logger, "log"),
+                        mock.patch("psycopg2.extras.execute_values", return_value=[(self.new_chat_id,)])):
+            patcher.start()
+
+            self.addCleanup(patcher.stop)
+
+        self.cursor = mock.Mock()
+
+    def assert_only_new_chat_indexed(self):
+        self.assertNotIn(self.old_chat_id, ChatTable.cached_chat_admins)
+        self.assertNotIn(("chat", self.old_chat_id), SearchIndex.documents)
+
+        self.assertEqual(ChatTable.cached_chat_admins[self.new_chat_id], {self.admin_id})
+        self.assertEqual(ChatTable.cached_admin_chat_ids[self.admin_id], {self.new_chat_id})
+
+        self.assertEqual(SearchIndex.get_document_data(("chat", self.new_chat_id))["title"], "New supergroup")
+
+    async def test_migrated_chat_update(self):
+        _, new_chat_data, fetched = await ChatTable.fetch_chat(mock.Mock(), self.old_chat_id, self.old_chat_data, self.cursor)
+
+        self.assertTrue(fetched)
+        self.assertEqual(new_chat_data["chat_id"], self.new_chat_id)
+
+        self.assert_only_new_chat_indexed()
+
+    def test_migrated_chat_batched_update(self):
+        # Chats migrated during refresh runs are queued along with the data saved under their previous chat_id
+        ChatTable.remove_from_admins_index(self.old_chat_id)
+
+        SearchIndex.remove_document(("chat", self.old_chat_id))
+
+        new_chat_data = {"chat_id": self.new_chat_id, "title": "New supergroup", "invite_link": "https://t.me/+new",
+                         "chat_admins": [self.admin_id], "chat_owner_id": self.admin_id, "missing_permissions": False}
+
+        new_chat_data["changed_columns"] = ChatTable.get_changed_columns(self.old_chat_data, new_chat_data)
+
+        self.assertTrue(ChatTable.write_chat_updates([(self.old_chat_data, new_chat_data)], self.cursor))
+
+        self.assert_only_new_chat_indexed()
+
+    def test_migration_without_new_chat_record(self):
+        self.cursor.rowcount = 0
+
+        with mock.patch.object(Database, "get_cursor", return_value=(self.cursor, True)), \
+                mock.patch.object(ChatTable, "get_chat_data", return_value=(dict(self.old_chat_data, custom_title=None, custom_link=None, hidden_by=None), True)), \
+                mock.patch.object(ChatTable, "remove_chat") as remove_chat:
+            self.assertFalse(self.unpatched_migrate_chat_id(self.old_chat_id, self.new_chat_id))
+
+        remove_chat.assert_not_called()
+
+        self.assertNotIn(self.new_chat_id, ChatTable.cached_chat_index_states)
+        self.assertNotIn(("chat", self.new_chat_id), SearchIndex.documents)
+
+        self.assertIn(("chat", self.old_chat_id), SearchIndex.documents)
+
+    async def test_update_of_removed_chat(self):
+        self.cursor.rowcount = 0
+
+        self.get_telegram_chat_info.side_effect = [self.chat_info]
+
+        _, new_chat_data, fetched = await ChatTable.fetch_chat(mock.Mock(), self.old_chat_id, self.old_chat_data, self.cursor)
+
+        self.assertTrue(fetched)
+        self.assertIsNone(new_chat_data)
+
+        self.assertEqual(SearchIndex.get_document_data(("chat", self.old_chat_id))["title"], "Old group")
+
+
+if __name__ == "__main__":
+    unittest.main()
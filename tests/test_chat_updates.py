@@ -0,0 +1,95 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+from unittest import mock
+
+from tgib.data.caches import TTLCache
+from tgib.data.database import ChatTable, Database
+
+
+class WriteChatUpdatesTest(unittest.TestCase):
+    chat_id = -1001
+
+    def setUp(self):
+        self.execute_values = mock.Mock(return_value=[(self.chat_id,)])
+
+        for patcher in (mock.patch.object(ChatTable, "cached_admin_chat_ids", {}),
+                        mock.patch.object(ChatTable, "cached_chat_admins", {}),
+                        mock.patch.object(ChatTable, "chat_admins_updated_at", TTLCache()),
+                        mock.patch.object(Database, "connection", mock.Mock()),
+                        mock.patch.object(ChatTable, "update_search_index"),
+                        mock.patch("psycopg2.extras.execute_values", self.execute_values)):
+            patcher.start()
+
+            self.addCleanup(patcher.stop)
+
+        ChatTable.update_admins_index(self.chat_id, [1, 2])
+
+    def queue_chat_update(self, fetched_at: float) -> tuple:
+        chat_data = {"chat_id": self.chat_id, "title": "Group", "invite_link": None, "chat_admins": [1, 2],
+                     "chat_owner_id": 1, "missing_permissions": False, "directory_id": None}
+
+        new_chat_data = {"chat_id": self.chat_id, "title": "Renamed group", "invite_link": None, "chat_admins": [1],
+                         "chat_owner_id": 1, "missing_permissions": False, "fetched_at": fetched_at}
+
+        new_chat_data["changed_columns"] = ChatTable.get_changed_columns(chat_data, new_chat_data)
+
+        return chat_data, new_chat_data
+
+    def test_only_changed_columns_are_written(self):
+        chat_update = self.queue_chat_update(time.monotonic())
+
+        self.assertTrue(ChatTable.write_chat_updates([chat_update], mock.Mock()))
+
+        values = self.execute_values.call_args.args[2]
+
+        self.assertEqual(values[0][-1], ["title", "chat_admins"])
+
+        self.assertEqual(ChatTable.cached_chat_admins[self.chat_id], {1})
+
+    def test_admins_changed_after_fetch_are_kept(self):
+        chat_update = self.queue_chat_update(time.monotonic())
+
+        # A chat_member update promoting user 3 is handled before the batch is written
+        ChatTable.chat_admins_updated_at.set(self.chat_id, time.monotonic() + 1)
+
+        ChatTable.update_admins_index(self.chat_id, [1, 2, 3])
+
+        self.assertTrue(ChatTable.write_chat_updates([chat_update], mock.Mock()))
+
+        values = self.execute_values.call_args.args[2]
+
+        self.assertEqual(values[0][-1], ["title"])
+
+        self.assertEqual(ChatTable.cached_chat_admins[self.chat_id], {1, 2, 3})
+
+    def test_removed_chats_changes_are_not_applied(self):
+        chat_update = self.queue_chat_update(time.monotonic())
+
+        self.execute_values.return_value = []
+
+        self.assertTrue(ChatTable.write_chat_updates([chat_update], mock.Mock()))
+
+        self.assertEqual(ChatTable.cached_chat_admins[self.chat_id], {1, 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+
+from tgib.data.caches import TTLCache
+from tgib.ui.texts import ChunkedMessages, TextBuffer
+
+
+class ChunkedMessagesResumeTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ChunkedMessages, "leading_message_ids", TTLCache(maxsize=10, ttl=60))
+        patcher.start()
+
+        self.addCleanup(patcher.stop)
+
+        self.text = "\n".join(str(i) * 3000 for i in range(3))
+
+        self.chunks = TextBuffer.split_text(self.text)
+
+        self.bot = mock.AsyncMock()
+
+        self.bot.edit_message_text.return_value = mock.Mock(message_id=10)
+
+    async def test_resume_only_sends_undelivered_chunks(self):
+        self.bot.send_message.side_effect = [Exception("Flood control exceeded"), mock.Mock(message_id=11), mock.Mock(message_id=12)]
+
+        with self.assertRaises(Exception):
+            await ChunkedMessages.send(self.bot, 1, self.text, edit_message_id=10)
+
+        self.assertTrue(ChunkedMessages.has_leading_messages(1))
+
+        new_message = await ChunkedMessages.send(self.bot, 1, self.text, resume=True)
+
+        self.assertEqual(new_message.message_id, 12)
+
+        self.bot.edit_message_text.assert_awaited_once()
+
+        self.assertEqual([call.kwargs["text"] for call in self.bot.send_message.await_args_list], self.chunks[1:2] + self.chunks[1:])
+
+        self.assertEqual(ChunkedMessages.leading_message_ids.get(1), [10, 11])
+
+    async def test_resume_sends_every_chunk_if_the_edit_failed(self):
+        self.bot.edit_message_text.side_effect = Exception("Message to edit not found")
+
+        self.bot.send_message.side_effect = [mock.Mock(message_id=message_id) for message_id in (11, 12, 13)]
+
+        with self.assertRaises(Exception):
+            await ChunkedMessages.send(self.bot, 1, self.text, edit_message_id=10)
+
+        self.assertFalse(ChunkedMessages.has_leading_messages(1))
+
+        new_message = await ChunkedMessages.send(self.bot, 1, self.text, resume=True)
+
+        self.assertEqual(new_message.message_id, 13)
+
+        self.assertEqual([call.kwargs["text"] for call in self.bot.send_message.await_args_list], self.chunks)
+
+
+if __name__ == "__main__":
+    unittest.main()
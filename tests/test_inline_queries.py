@@ -0,0 +1,46 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+
+from tgib.data.database import DirectoryTable
+from tgib.handlers.inlinequeries import InlineQueries
+from tgib.handlers.queries import Queries
+
+
+class InlineResultsTest(unittest.TestCase):
+    def test_titles_and_categories_are_escaped(self):
+        chat_data = {"custom_title": None, "title": "Q&A <2023>", "custom_link": None,
+                     "invite_link": "https://t.me/+abc", "directory_id": 5}
+
+        locale = mock.Mock(lang_code="en")
+
+        with mock.patch.object(Queries, "search_chats", return_value=[(("q&a", -1001), chat_data)]), \
+                mock.patch.object(DirectoryTable, "get_full_category_name", return_value="Maths & Physics"):
+            results = InlineQueries.get_results(locale, "q&a", "bot")
+
+        self.assertEqual(results[0].input_message_content.message_text,
+                         "👥 <b>Q&amp;A &lt;2023&gt;</b>\n📂 <i>Maths &amp; Physics</i>")
+
+        self.assertEqual(results[0].title, "Q&A <2023>")
+
+
+if __name__ == "__main__":
+    unittest.main()
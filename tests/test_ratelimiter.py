@@ -0,0 +1,49 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import unittest
+
+from tgib.ratelimiter import TokenBucket
+
+
+class TokenBucketPriorityTest(unittest.IsolatedAsyncioTestCase):
+    async def test_priority_acquire_skips_the_queue(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+
+        await bucket.acquire()
+
+        await asyncio.wait_for(bucket.acquire(priority=True), timeout=0.1)
+
+        self.assertLess(bucket.tokens, 0)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(bucket.acquire(), timeout=0.1)
+
+    async def test_priority_acquire_waits_for_pauses(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+
+        bucket.retry_after(1)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(bucket.acquire(priority=True), timeout=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+from unittest import mock
+
+from tgib.data.database import ChatTable, Database, PersistentVarsTable
+
+
+class FetchChatsCheckpointTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.saved_checkpoints = []
+
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [(chat_id,) for chat_id in range(1, 7)]
+
+        status = dict(ChatTable.fetch_chats_status, running=False)
+
+        for patcher in (mock.patch.object(ChatTable, "fetch_chats_status", status),
+                        mock.patch.object(ChatTable, "get_fetch_chats_checkpoint", return_value=None),
+                        mock.patch.object(Database, "get_cursor", return_value=(cursor, True)),
+                        mock.patch.object(PersistentVarsTable, "set_value",
+                                          side_effect=lambda key, value: self.saved_checkpoints.append(json.loads(value))),
+                        mock.patch("tgib.data.database.Logger.log")):
+            patcher.start()
+
+            self.addCleanup(patcher.stop)
+
+    async def test_checkpoint_only_counts_the_saved_prefix(self):
+        async def refresh_chats(bot_instance, chat_ids, status, log_author, on_chat_processed, on_updates_written):
+            # Workers complete 1, 3 and 4 before 2, so only chat 1 can be checkpointed at first
+            for chat_id, outcome in ((1, "changed"), (3, "failed"), (4, "changed")):
+                if outcome is not None:
+                    status[outcome] += 1
+
+                status["processed"] += 1
+
+                on_chat_processed(chat_id, outcome)
+
+            on_updates_written()
+
+            status["processed"] += 1
+
+            on_chat_processed(2, None)
+
+            # The batch with the changes of chats 1 and 4 then fails to be written
+            status["changed"] -= 2
+            status["failed"] += 2
+
+            on_chat_processed(1, "failed")
+            on_chat_processed(4, "failed")
+
+            on_updates_written()
+
+            raise RuntimeError("interrupted")
+
+        with mock.patch.object(ChatTable, "refresh_chats", side_effect=refresh_chats):
+            with self.assertRaises(RuntimeError):
+                await ChatTable.fetch_chats(mock.Mock())
+
+        first_checkpoint, last_checkpoint = self.saved_checkpoints[1], self.saved_checkpoints[-1]
+
+        self.assertEqual((first_checkpoint["last_chat_id"], first_checkpoint["processed"],
+                          first_checkpoint["failed"], first_checkpoint["changed"]), (1, 1, 0, 1))
+
+        self.assertEqual((last_checkpoint["last_chat_id"], last_checkpoint["processed"],
+                          last_checkpoint["failed"], last_checkpoint["changed"]), (4, 4, 3, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+from unittest import mock
+
+from tgib.data.database import ChatTable
+from tgib.data.search import SearchIndex
+
+
+class StaleChatIdsTest(unittest.TestCase):
+    def setUp(self):
+        now = time.time()
+
+        # Chats 0-99 were refreshed an hour apart from each other, the odd ones lack permissions
+        last_refresh_times = {chat_id: now - (100 - chat_id) * 60 * 60 for chat_id in range(100)}
+
+        for patcher in (mock.patch.object(SearchIndex, "documents", {}),
+                        mock.patch.object(SearchIndex, "trigrams_index", {}),
+                        mock.patch.object(ChatTable, "last_refresh_times", last_refresh_times),
+                        mock.patch.object(ChatTable, "stale_chats_refresh_interval", 60 * 60),
+                        mock.patch.object(ChatTable, "stale_chats_refresh_sla", 10 * 60 * 60),
+                        mock.patch.object(ChatTable, "missing_permissions_refresh_interval", 60 * 60)):
+            patcher.start()
+
+            self.addCleanup(patcher.stop)
+
+        for chat_id in range(100):
+            SearchIndex.add_document(("chat", chat_id), [str(chat_id)], {"missing_permissions": chat_id % 2 == 1})
+
+    def test_budget_is_shared(self):
+        stale_chat_ids = ChatTable.get_stale_chat_ids()
+
+        self.assertEqual(len(stale_chat_ids), 10)
+
+        self.assertEqual(stale_chat_ids, [1, 3, 5, 7, 9, 11, 13, 15, 17, 19])
+
+    def test_stalest_chats_fill_the_budget(self):
+        for chat_id in range(100):
+            SearchIndex.update_document_data(("chat", chat_id), missing_permissions=chat_id in (3, 50, 60))
+
+        self.assertEqual(ChatTable.get_stale_chat_ids(), [3, 50, 60, 0, 1, 2, 4, 5, 6, 7])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    # Least recently used entries are evicted first once maxsize is reached,
+    # while entries older than ttl seconds are treated as missing and dropped
+    # when they are next looked up (or by expire())
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, count=False) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key, count=False)
+
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self.set(key, value)
+
+    def evict(self, key) -> None:
+        _, value = self.entries.pop(key)
+
+        self.evictions += 1
+
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None, count: bool = True):
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            expires_at, value = entry
+
+            if expires_at > monotonic():
+                self.entries.move_to_end(key)
+
+                if count:
+                    self.hits += 1
+
+                return value
+
+            self.evict(key)
+
+        if count:
+            self.misses += 1
+
+        return default
+
+    def peek(self, key, default=None):
+        # Unlike get(), it neither evicts expired entries nor refreshes their recency
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[0] > monotonic():
+            return entry[1]
+
+        return default
+
+    def set(self, key, value, ttl: float = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+        self.entries[key] = (monotonic() + ttl, value)
+
+        while len(self.entries) > self.maxsize:
+            self.evict(next(iter(self.entries)))
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            return default
+
+        return entry[1]
+
+    def keys(self) -> list:
+        return list(self.entries)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def expire(self) -> int:
+        now = monotonic()
+
+        expired_keys = [key for key, (expires_at, _) in self.entries.items() if expires_at <= now]
+
+        for key in expired_keys:
+            self.evict(key)
+
+        return len(expired_keys)
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_ratio": (self.hits / lookups) if lookups else 0.0}
@@ -17,20 +17,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import hashlib
+import heapq
+import json
 import random
 import time
+from math import ceil
 from os import getenv as os_getenv
 from urllib.parse import urlparse as urllib_parse_urlparse
+from uuid import uuid4
 
 import psycopg2
+import psycopg2.extras
 import telegram
-from telegram import ChatMemberAdministrator, ChatMemberOwner
+from telegram import ChatMemberAdministrator, ChatMemberOwner, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
+from tgib.data.caches import TTLCache
+from tgib.data.lookups import TelegramLookups
+from tgib.data.search import SearchIndex
 from tgib.global_vars import GlobalVariables
 from tgib.i18n.locales import Locale
 from tgib.ui.menus import Menus
+from tgib.ui.texts import ChunkedMessages
 from tgib.logs import Logger
+from tgib.ratelimiter import TokenBucket
 
 
 class Database:
@@ -283,6 +295,17 @@ class Database:
                     """
                 )
 
+                # callback_query
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS callback_query (
+                        hash TEXT PRIMARY KEY,
+                        query_data TEXT NOT NULL,
+                        saved_at TIMESTAMP DEFAULT now()
+                    );
+                    """
+                )
+
                 connection.commit()
             except (Exception, psycopg2.DatabaseError) as ex:
                 Logger.log("exception", "Database.create_tables",
@@ -536,6 +559,61 @@ class DirectoryTable:
 
     cached_chat_counts = {}
 
+    @classmethod
+    def init_search_index(cls) -> bool:
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            cursor: psycopg2._psycopg.cursor
+
+            try:
+                cursor.execute("SELECT * FROM directory")
+
+                column_names = [desc[0] for desc in cursor.description]
+                records = cursor.fetchall()
+
+                for directory_data in Database.records_to_dict(column_names, records).values():
+                    cls.update_search_index(directory_data)
+
+                return True
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "DirectoryTable.init_search_index",
+                           f"An exception occurred while trying to build the directories search index", ex)
+
+                Database.connection.rollback()
+
+                return False
+
+        else:
+            Logger.log("error", "DirectoryTable.init_search_index",
+                       f"Couldn't get cursor required to build the directories search index")
+
+            return False
+
+    @classmethod
+    def update_search_index(cls, directory_data: dict) -> None:
+        SearchIndex.add_document(
+            ("directory", directory_data["id"]),
+            [directory_data["i18n_en_name"], directory_data["i18n_it_name"]],
+            {"id": directory_data["id"], "parent_id": directory_data["parent_id"], "hidden_by": directory_data["hidden_by"]}
+        )
+
+    @classmethod
+    def is_directory_visible(cls, directory_id: int) -> bool:
+        curr_directory_data, is_curr_directory_data = cls.get_directory_data(directory_id)
+
+        while is_curr_directory_data:
+            if curr_directory_data["hidden_by"] is not None:
+                return False
+
+            if curr_directory_data["parent_id"] is None:
+                return True
+
+            curr_directory_data, is_curr_directory_data = cls.get_directory_data(curr_directory_data["parent_id"])
+
+        return False
+
     @classmethod
     def create_directory(cls, i18n_en_name: str, i18n_it_name: str = None, directory_id: int = None, parent_directory_id: int = None) -> (int | None, bool):
         cursor, iscursor = Database.get_cursor()
@@ -576,6 +654,9 @@ class DirectoryTable:
                         "hidden_by": None
                     }
 
+                cls.update_search_index({"id": inserted_id, "i18n_en_name": i18n_en_name, "i18n_it_name": i18n_it_name,
+                                         "parent_id": parent_directory_id, "hidden_by": None})
+
                 return inserted_id, True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -618,6 +699,8 @@ class DirectoryTable:
                     cls.cached_directory_records[directory_id] = {}
                     cls.cached_directory_records.pop(directory_id)
 
+                SearchIndex.remove_document(("directory", directory_id))
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -664,7 +747,7 @@ class DirectoryTable:
             hidden_by_info = f'[<code>{hidden_by_user_id}</code>]'
 
             try:
-                hidden_by_user = await GlobalVariables.bot_instance.get_chat(hidden_by_user_id)
+                hidden_by_user = await TelegramLookups.get_chat(GlobalVariables.bot_instance, hidden_by_user_id)
                 hidden_by_user: telegram.Chat
 
                 if hidden_by_user:
@@ -730,6 +813,8 @@ class DirectoryTable:
                 if directory_id in cls.cached_directory_records:
                     cls.cached_directory_records[directory_id]["parent_id"] = new_parent_directory_id
 
+                SearchIndex.update_document_data(("directory", directory_id), parent_id=new_parent_directory_id)
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -771,6 +856,11 @@ class DirectoryTable:
                     cls.cached_directory_records[directory_id]["i18n_en_name"] = new_i18n_en_name
                     cls.cached_directory_records[directory_id]["i18n_it_name"] = new_i18n_it_name
 
+                directory_search_data = SearchIndex.get_document_data(("directory", directory_id))
+
+                if directory_search_data is not None:
+                    cls.update_search_index(dict(directory_search_data, i18n_en_name=new_i18n_en_name, i18n_it_name=new_i18n_it_name))
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -810,6 +900,8 @@ class DirectoryTable:
                 if directory_id in cls.cached_directory_records:
                     cls.cached_directory_records[directory_id]["hidden_by"] = hidden_by
 
+                SearchIndex.update_document_data(("directory", directory_id), hidden_by=hidden_by)
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -1016,6 +1108,169 @@ class DirectoryTable:
 
 
 class ChatTable:
+    admins_index_initialized = False
+
+    cached_admin_chat_ids = {}
+
+    cached_chat_admins = {}
+
+    cached_chat_index_states = {}
+
+    # Bot API requests made to refresh chats share this bucket, sized to stay below Telegram's
+    # global limit of about 30 requests per second
+    api_rate_limiter = TokenBucket(rate=25, capacity=25)
+
+    # Number of chats refreshed concurrently by fetch_chats
+    fetch_chats_workers = 4
+
+    fetch_chats_log_interval = 50
+
+    fetch_chats_status = {"running": False, "run_id": None, "started_at": None, "finished_at": None,
+                          "resumed_at": None, "resumed_processed": 0, "last_chat_id": None,
+                          "checkpoint_processed": 0, "checkpoint_failed": 0, "checkpoint_changed": 0,
+                          "total": 0, "processed": 0, "failed": 0, "changed": 0,
+                          "api_calls": {}, "retries": 0, "wait_time": 0.0, "removed": 0, "migrated": 0}
+
+    # persistent_vars key under which the progress of full refreshes is saved, to resume them after restarts
+    fetch_chats_checkpoint_key = "fetch_chats_checkpoint"
+
+    # persistent_vars key under which the report of the latest finished full refresh is saved
+    fetch_chats_report_key = "fetch_chats_report"
+
+    # Counters of the Bot API usage of refresh runs (calls made by method, RetryAfter errors, seconds spent
+    # waiting for the rate limiter) and of the chats they removed or migrated, kept in their status
+    refresh_telemetry_keys = ("api_calls", "retries", "wait_time", "removed", "migrated")
+
+    # Number of changed chats written to the database at once by refresh runs
+    chat_updates_batch_size = 100
+
+    # Columns of the chat table whose values are fetched from Telegram by fetch_chat
+    refreshed_columns = ("title", "invite_link", "chat_admins", "chat_owner_id", "missing_permissions")
+
+    # When the admins of each chat were last changed by a chat_member update, so that refreshes
+    # fetched before then (and written later in a batch) don't overwrite them with stale ones
+    chat_admins_updated_at = TTLCache(maxsize=10000, ttl=60 * 60)
+
+    # Epoch of the latest refresh of each chat, initially estimated from its updated_at value
+    last_refresh_times = {}
+
+    # Seconds within which every chat gets refreshed by refresh_stale_chats (see get_stale_chat_ids)
+    stale_chats_refresh_sla = 24 * 60 * 60
+
+    stale_chats_refresh_interval = 60
+
+    missing_permissions_refresh_interval = 30 * 60
+
+    stale_chats_refresh_status = {"running": False, "started_at": None, "finished_at": None,
+                                  "total": 0, "processed": 0, "failed": 0, "changed": 0,
+                                  "api_calls": {}, "retries": 0, "wait_time": 0.0, "removed": 0, "migrated": 0,
+                                  "ticks": 0, "refreshed": 0, "total_failed": 0, "total_changed": 0}
+
+    @classmethod
+    def init_indexes(cls) -> bool:
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            cursor: psycopg2._psycopg.cursor
+
+            try:
+                cursor.execute("SELECT *, EXTRACT(EPOCH FROM now() - updated_at) AS seconds_since_update FROM chat")
+
+                column_names = [desc[0] for desc in cursor.description]
+                records = cursor.fetchall()
+
+                cls.cached_admin_chat_ids = {}
+                cls.cached_chat_admins = {}
+                cls.cached_chat_index_states = {}
+
+                current_time = time.time()
+
+                for chat_id, chat_data in Database.records_to_dict(column_names, records).items():
+                    cls.update_admins_index(chat_id, chat_data["chat_admins"])
+                    cls.update_index_state(chat_id, chat_data["directory_id"], chat_data["hidden_by"])
+                    cls.update_search_index(**chat_data)
+
+                    seconds_since_update = chat_data["seconds_since_update"]
+
+                    cls.last_refresh_times[chat_id] = current_time - float(seconds_since_update if seconds_since_update else 0)
+
+                cls.admins_index_initialized = True
+
+                return True
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "ChatTable.init_indexes",
+                           f"An exception occurred while trying to build the chat indexes", ex)
+
+                Database.connection.rollback()
+
+                return False
+
+        else:
+            Logger.log("error", "ChatTable.init_indexes",
+                       f"Couldn't get cursor required to build the chat indexes")
+
+            return False
+
+    @classmethod
+    def update_search_index(cls, chat_id: int, **changes) -> None:
+        search_fields = ("title", "custom_title", "invite_link", "custom_link",
+                         "directory_id", "hidden_by", "missing_permissions")
+
+        chat_search_data = SearchIndex.get_document_data(("chat", chat_id))
+
+        if chat_search_data is None:
+            chat_search_data = {"chat_id": chat_id}
+
+            for search_field in search_fields:
+                chat_search_data[search_field] = None
+
+        else:
+            chat_search_data = dict(chat_search_data)
+
+        for search_field in search_fields:
+            if search_field in changes:
+                chat_search_data[search_field] = changes[search_field]
+
+        SearchIndex.add_document(("chat", chat_id), [chat_search_data["custom_title"], chat_search_data["title"]], chat_search_data)
+
+    @classmethod
+    def update_admins_index(cls, chat_id: int, chat_admins: list | None) -> None:
+        new_chat_admins = set(chat_admins) if chat_admins else set()
+
+        old_chat_admins = cls.cached_chat_admins.get(chat_id, set())
+
+        for admin_id in old_chat_admins - new_chat_admins:
+            admin_chat_ids = cls.cached_admin_chat_ids.get(admin_id)
+
+            if admin_chat_ids is not None:
+                admin_chat_ids.discard(chat_id)
+
+                if not admin_chat_ids:
+                    cls.cached_admin_chat_ids.pop(admin_id)
+
+        for admin_id in new_chat_admins - old_chat_admins:
+            cls.cached_admin_chat_ids.setdefault(admin_id, set()).add(chat_id)
+
+        if new_chat_admins:
+            cls.cached_chat_admins[chat_id] = new_chat_admins
+        else:
+            cls.cached_chat_admins.pop(chat_id, None)
+
+    @classmethod
+    def update_index_state(cls, chat_id: int, directory_id: int | None = None, hidden_by: int | None = None) -> None:
+        cls.cached_chat_index_states[chat_id] = (directory_id, hidden_by)
+
+    @classmethod
+    def remove_from_admins_index(cls, chat_id: int) -> None:
+        cls.update_admins_index(chat_id, None)
+
+        cls.cached_chat_index_states.pop(chat_id, None)
+
+    @classmethod
+    def get_ids_of_chats_user_is_admin_of(cls, chat_id: int) -> set:
+        return cls.cached_admin_chat_ids.get(chat_id, set())
+
     @classmethod
     def get_directory_indexed_chats(cls, directory_id: int, skip_missing_permissions_chats: bool = True, skip_hidden_chats: bool = True, user_id: int = None) -> (dict | None, bool):
         cursor, iscursor = Database.get_cursor()
@@ -1039,9 +1294,14 @@ class ChatTable:
 
                     where_string += "hidden_by IS NULL"
 
-                where_string += ") OR %s = ANY(chat_admins))"
+                if cls.admins_index_initialized:
+                    where_string += ") OR chat_id = ANY(%s))"
+
+                    query_vars.append(list(cls.get_ids_of_chats_user_is_admin_of(user_id)))
+                else:
+                    where_string += ") OR %s = ANY(chat_admins))"
 
-                query_vars.append(user_id)
+                    query_vars.append(user_id)
 
             query_vars = tuple(query_vars)
 
@@ -1063,6 +1323,22 @@ class ChatTable:
 
     @classmethod
     def get_total_chats_user_is_admin_of(cls, chat_id: int, count_only_indexed_chats: bool = False) -> (int | None, bool):
+        if cls.admins_index_initialized:
+            admin_chat_ids = cls.get_ids_of_chats_user_is_admin_of(chat_id)
+
+            if not count_only_indexed_chats:
+                return len(admin_chat_ids), True
+
+            total_chats = 0
+
+            for admin_chat_id in admin_chat_ids:
+                directory_id, hidden_by = cls.cached_chat_index_states.get(admin_chat_id, (None, None))
+
+                if directory_id is not None and hidden_by is None:
+                    total_chats += 1
+
+            return total_chats, True
+
         cursor, iscursor = Database.get_cursor()
 
         if iscursor:
@@ -1100,25 +1376,79 @@ class ChatTable:
             return None, False
 
     @classmethod
-    def get_chats_user_is_admin_of(cls, chat_id: int, offset: int, limit: int = 8) -> (dict | None, bool):
+    def get_chats_user_is_admin_of(cls, chat_id: int, anchor_chat_id: int = 0, limit: int = 8) -> (dict | None, int | None, int | None, bool):
+        if cls.admins_index_initialized:
+            admin_chat_ids = cls.get_ids_of_chats_user_is_admin_of(chat_id)
+
+            if not admin_chat_ids:
+                return {}, None, None, True
+
+            admin_chats_where = "chat_id = ANY(%s)"
+            admin_chats_var = list(admin_chat_ids)
+        else:
+            admin_chats_where = "%s = ANY(chat_admins)"
+            admin_chats_var = chat_id
+
         cursor, iscursor = Database.get_cursor()
 
         if iscursor:
             cursor: psycopg2._psycopg.cursor
 
             try:
-                cursor.execute("""
-                    SELECT *
-                    FROM chat
-                    WHERE %s = ANY(chat_admins)
-                    ORDER BY title ASC
-                    OFFSET %s LIMIT %s
-                """, (chat_id, offset * limit, limit))
+                # Keyset pagination: a page is identified by the chat it starts from (anchor_chat_id), and
+                # the same round trip also fetches the first chat of the next page (through the extra row
+                # of the first part) and the chats of the previous page (through the second part), so that
+                # every page costs the same no matter how deep it is
+                cursor.execute(f"""
+                    WITH anchor AS (
+                        SELECT COALESCE(title, '') AS sort_title, chat_id
+                        FROM chat
+                        WHERE chat_id = %s
+                    )
+                    (
+                        SELECT *, FALSE AS previous_page
+                        FROM chat
+                        WHERE {admin_chats_where}
+                            AND (NOT EXISTS (SELECT 1 FROM anchor)
+                                 OR (COALESCE(title, ''), chat_id) >= (SELECT sort_title, chat_id FROM anchor))
+                        ORDER BY COALESCE(title, '') ASC, chat_id ASC
+                        LIMIT %s
+                    )
+                    UNION ALL
+                    (
+                        SELECT *, TRUE AS previous_page
+                        FROM chat
+                        WHERE {admin_chats_where}
+                            AND (COALESCE(title, ''), chat_id) < (SELECT sort_title, chat_id FROM anchor)
+                        ORDER BY COALESCE(title, '') DESC, chat_id DESC
+                        LIMIT %s
+                    )
+                """, (anchor_chat_id, admin_chats_var, limit + 1, admin_chats_var, limit))
 
                 column_names = [desc[0] for desc in cursor.description]
                 records = cursor.fetchall()
 
-                return Database.records_to_dict(column_names, records), True
+                page_records, previous_page_records = [], []
+
+                for record in records:
+                    if record[-1]:
+                        previous_page_records.append(record[:-1])
+                    else:
+                        page_records.append(record[:-1])
+
+                next_anchor_chat_id = None
+
+                if len(page_records) > limit:
+                    next_anchor_chat_id = page_records.pop()[0]
+
+                previous_anchor_chat_id = None
+
+                if previous_page_records:
+                    previous_anchor_chat_id = previous_page_records[-1][0]
+
+                chats = Database.records_to_dict(column_names[:-1], page_records)
+
+                return chats, previous_anchor_chat_id, next_anchor_chat_id, True
 
             except (Exception, psycopg2.DatabaseError) as ex:
                 Logger.log("exception", "ChatTable.get_chat_user_is_admin_of",
@@ -1127,12 +1457,12 @@ class ChatTable:
 
                 Database.connection.rollback()
 
-                return None, False
+                return None, None, None, False
         else:
             Logger.log("error", "ChatTable.get_chat_user_is_admin_of",
                        f"Couldn't get cursor required to get chats user having chat_id '{chat_id}' is admin of")
 
-            return None, False
+            return None, None, None, False
 
     @classmethod
     def update_chat_visibility(cls, chat_id: int, hidden_by: int = None) -> bool:
@@ -1154,6 +1484,13 @@ class ChatTable:
 
                 connection.commit()
 
+                if chat_id in cls.cached_chat_index_states:
+                    directory_id, _ = cls.cached_chat_index_states[chat_id]
+
+                    cls.update_index_state(chat_id, directory_id, hidden_by)
+
+                SearchIndex.update_document_data(("chat", chat_id), hidden_by=hidden_by)
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -1190,6 +1527,13 @@ class ChatTable:
 
                 connection.commit()
 
+                if chat_id in cls.cached_chat_index_states:
+                    _, hidden_by = cls.cached_chat_index_states[chat_id]
+
+                    cls.update_index_state(chat_id, new_directory_id, hidden_by)
+
+                SearchIndex.update_document_data(("chat", chat_id), directory_id=new_directory_id)
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -1232,6 +1576,15 @@ class ChatTable:
 
                     connection.commit()
 
+                    # There's no record associated to the new chat_id yet (see ChatTable.fetch_chat)
+                    if cursor.rowcount == 0:
+                        return False
+
+                    cls.update_index_state(new_chat_id, old_chat_data["directory_id"], old_chat_data["hidden_by"])
+
+                    cls.update_search_index(new_chat_id, custom_title=old_chat_data["custom_title"], custom_link=old_chat_data["custom_link"],
+                                            directory_id=old_chat_data["directory_id"], hidden_by=old_chat_data["hidden_by"])
+
                     removed = ChatTable.remove_chat(old_chat_id)
 
                     if removed:
@@ -1288,6 +1641,8 @@ class ChatTable:
 
                         connection.commit()
 
+                        SearchIndex.update_document_data(("chat", chat_id), missing_permissions=True)
+
                         directory_id = result[1]
                         if directory_id is not None:
                             DirectoryTable.increment_chats_count(directory_id, -1)
@@ -1316,6 +1671,70 @@ class ChatTable:
 
             return False
 
+    @classmethod
+    def update_chat_admin(cls, chat_id: int, user_id: int, is_admin: bool, is_owner: bool = False) -> bool:
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            # The admins array is kept sorted, as fetch_chat stores it, so that
+            # refreshes don't detect changes where there aren't any
+            query = """
+                UPDATE chat
+                SET chat_admins = CASE
+                        WHEN %(is_admin)s THEN ARRAY(
+                            SELECT DISTINCT admin_id
+                            FROM unnest(array_append(chat_admins, %(user_id)s::BIGINT)) AS admin_id
+                            ORDER BY admin_id
+                        )
+                        ELSE array_remove(chat_admins, %(user_id)s::BIGINT)
+                    END,
+                    chat_owner_id = CASE
+                        WHEN %(is_owner)s THEN %(user_id)s::BIGINT
+                        WHEN chat_owner_id = %(user_id)s::BIGINT THEN NULL
+                        ELSE chat_owner_id
+                    END
+                WHERE chat_id = %(chat_id)s
+                RETURNING chat_admins
+            """
+
+            try:
+                connection = Database.connection
+                connection: psycopg2._psycopg.connection
+
+                cursor.execute(query, {"chat_id": chat_id, "user_id": user_id, "is_admin": is_admin, "is_owner": is_owner})
+
+                record = cursor.fetchone()
+
+                connection.commit()
+
+                TelegramLookups.invalidate_chat(chat_id, user_id)
+
+                # Chats which aren't indexed have no row to update
+                if record is None:
+                    return False
+
+                cls.chat_admins_updated_at.set(chat_id, time.monotonic())
+
+                cls.update_admins_index(chat_id, record[0])
+
+                return True
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "ChatTable.update_chat_admin",
+                           f"Couldn't update admin status of user having id '{user_id}'"
+                           f" in chat having id '{chat_id}'", ex)
+
+                Database.connection.rollback()
+
+                return False
+
+        else:
+            Logger.log("error", "ChatTable.update_chat_admin",
+                       f"Couldn't get cursor required to update admin status of user"
+                       f" having id '{user_id}' in chat having id '{chat_id}'")
+
+            return False
+
     @classmethod
     def remove_chat(cls, chat_id: int) -> bool:
         cursor, iscursor = Database.get_cursor()
@@ -1334,6 +1753,14 @@ class ChatTable:
 
                 connection.commit()
 
+                cls.remove_from_admins_index(chat_id)
+
+                SearchIndex.remove_document(("chat", chat_id))
+
+                cls.last_refresh_times.pop(chat_id, None)
+
+                TelegramLookups.invalidate_chat(chat_id)
+
                 return True
 
             except (Exception, psycopg2.DatabaseError) as ex:
@@ -1373,7 +1800,145 @@ class ChatTable:
         return chat_data, bool(record)
 
     @classmethod
-    async def fetch_chat(cls, bot_instance: telegram.Bot, chat_id: int, chat_data: dict = None, cursor: psycopg2._psycopg.cursor = None, migrating_from_chat_id: int = None) -> (dict, dict | None, bool):
+    def get_changed_columns(cls, saved_chat_data: dict, current_chat_data: dict) -> list:
+        def normalize(column: str, value):
+            if column == "chat_admins":
+                return sorted(value) if value else []
+
+            if column == "title" or column == "invite_link":
+                return value if value else None
+
+            if column == "missing_permissions":
+                return bool(value)
+
+            return value
+
+        return [column for column in cls.refreshed_columns
+                if normalize(column, saved_chat_data[column]) != normalize(column, current_chat_data[column])]
+
+    @classmethod
+    async def get_telegram_chat_info(cls, bot_instance: telegram.Bot, chat_id: int, refresh_status: dict = None) -> (telegram.ChatMember, telegram.Chat, tuple):
+        # The three requests are independent, so they are made concurrently; if more than one of them
+        # fails, a ChatMigrated error takes precedence (the other requests target the old chat_id too),
+        # followed by any other error but RetryAfter, which is only raised if it's the only kind of error
+        # (with the longest of the requested waits), as retrying wouldn't help otherwise
+        # Lookups made while refreshing are never answered from cache, but they update it for the
+        # other lookups of the same chat (e.g. the ones made by /reload right after refreshing)
+        if refresh_status is not None:
+            api_calls = refresh_status["api_calls"]
+
+            for method_name in ("get_chat_member", "get_chat", "get_chat_administrators"):
+                api_calls[method_name] = api_calls.get(method_name, 0) + 1
+
+        # Chats refreshed outside of refresh runs (e.g. by /reload) have a user waiting for them, so their
+        # requests take priority over the ones of the refresh workers instead of queuing behind them
+        priority = refresh_status is None
+
+        results = await asyncio.gather(
+            TelegramLookups.get_chat_member(bot_instance, chat_id, bot_instance.id, fresh=True, rate_limiter=cls.api_rate_limiter, priority=priority),
+            TelegramLookups.get_chat(bot_instance, chat_id, fresh=True, rate_limiter=cls.api_rate_limiter, priority=priority),
+            TelegramLookups.get_chat_administrators(bot_instance, chat_id, fresh=True, rate_limiter=cls.api_rate_limiter, priority=priority),
+            return_exceptions=True
+        )
+
+        exceptions = [result for result in results if isinstance(result, BaseException)]
+
+        if exceptions:
+            for exception in exceptions:
+                if isinstance(exception, telegram.error.ChatMigrated):
+                    raise exception
+
+            for exception in exceptions:
+                if not isinstance(exception, telegram.error.RetryAfter):
+                    raise exception
+
+            raise max(exceptions, key=lambda retry_after_exception: retry_after_exception.retry_after)
+
+        bot_member, chat, chat_admins = results
+
+        return bot_member, chat, chat_admins
+
+    @classmethod
+    def apply_chat_changes(cls, chat_data: dict, new_chat_data: dict) -> None:
+        # chat_data may still refer to the chat_id a group had before migrating to a supergroup
+        chat_id = new_chat_data["chat_id"]
+
+        changed_columns = new_chat_data["changed_columns"]
+
+        if "chat_admins" in changed_columns or chat_data["chat_id"] != chat_id:
+            cls.update_admins_index(chat_id, new_chat_data["chat_admins"])
+
+        cls.update_search_index(chat_id, title=new_chat_data["title"], invite_link=new_chat_data["invite_link"],
+                                missing_permissions=new_chat_data["missing_permissions"])
+
+        if chat_data["directory_id"] is not None and "missing_permissions" in changed_columns:
+            if new_chat_data["missing_permissions"]:
+                DirectoryTable.increment_chats_count(chat_data["directory_id"], -1)
+
+            else:
+                DirectoryTable.increment_chats_count(chat_data["directory_id"], +1)
+
+    @classmethod
+    def write_chat_updates(cls, chat_updates: list, cursor: psycopg2._psycopg.cursor) -> bool:
+        if not chat_updates:
+            return True
+
+        for _, new_chat_data in chat_updates:
+            chat_admins_updated_at = cls.chat_admins_updated_at.get(new_chat_data["chat_id"], count=False)
+
+            # Admins changed by chat_member updates received after the chat was fetched are more recent
+            if chat_admins_updated_at is not None and chat_admins_updated_at > new_chat_data["fetched_at"]:
+                new_chat_data["changed_columns"] = [column for column in new_chat_data["changed_columns"]
+                                                    if column not in ("chat_admins", "chat_owner_id")]
+
+        # Each row only overwrites its changed columns, as the other ones may have changed since it was fetched
+        query = """
+            UPDATE chat
+            SET
+                title = CASE WHEN 'title' = ANY(new_chat_data.changed_columns) THEN new_chat_data.title ELSE chat.title END,
+                invite_link = CASE WHEN 'invite_link' = ANY(new_chat_data.changed_columns) THEN new_chat_data.invite_link ELSE chat.invite_link END,
+                chat_admins = CASE WHEN 'chat_admins' = ANY(new_chat_data.changed_columns) THEN new_chat_data.chat_admins ELSE chat.chat_admins END,
+                chat_owner_id = CASE WHEN 'chat_owner_id' = ANY(new_chat_data.changed_columns) THEN new_chat_data.chat_owner_id ELSE chat.chat_owner_id END,
+                missing_permissions = CASE WHEN 'missing_permissions' = ANY(new_chat_data.changed_columns) THEN new_chat_data.missing_permissions ELSE chat.missing_permissions END
+            FROM (VALUES %s) AS new_chat_data (chat_id, title, invite_link, chat_admins, chat_owner_id, missing_permissions, changed_columns)
+            WHERE chat.chat_id = new_chat_data.chat_id
+            RETURNING chat.chat_id
+        """
+
+        values = [(new_chat_data["chat_id"], new_chat_data["title"], new_chat_data["invite_link"], new_chat_data["chat_admins"],
+                   new_chat_data["chat_owner_id"], new_chat_data["missing_permissions"], new_chat_data["changed_columns"])
+                  for _, new_chat_data in chat_updates if new_chat_data["changed_columns"]]
+
+        updated_chat_ids = set()
+
+        try:
+            connection = Database.connection
+            connection: psycopg2._psycopg.connection
+
+            if values:
+                records = psycopg2.extras.execute_values(cursor, query, values, page_size=len(values), fetch=True,
+                                                         template="(%s::BIGINT, %s::VARCHAR, %s::VARCHAR, %s::BIGINT[], %s::BIGINT, %s::BOOLEAN, %s::VARCHAR[])")
+
+                connection.commit()
+
+                updated_chat_ids = {record[0] for record in records}
+
+        except (Exception, psycopg2.DatabaseError) as ex:
+            Logger.log("exception", "ChatTable.write_chat_updates", f"Couldn't update a batch of {len(chat_updates)} chats", ex)
+
+            Database.connection.rollback()
+
+            return False
+
+        # Chats removed (or migrated) since they were fetched weren't updated, so their changes aren't applied
+        for chat_data, new_chat_data in chat_updates:
+            if new_chat_data["chat_id"] in updated_chat_ids:
+                cls.apply_chat_changes(chat_data, new_chat_data)
+
+        return True
+
+    @classmethod
+    async def fetch_chat(cls, bot_instance: telegram.Bot, chat_id: int, chat_data: dict = None, cursor: psycopg2._psycopg.cursor = None, migrating_from_chat_id: int = None, chat_updates_batch: list = None, refresh_status: dict = None) -> (dict, dict | None, bool):
         if cursor is None:
             cursor, iscursor = Database.get_cursor()
 
@@ -1394,21 +1959,22 @@ class ChatTable:
 
                     Database.connection.rollback()
 
+        fetched_at = time.monotonic()
+
         try:
             try:
-                bot_member = await bot_instance.get_chat_member(chat_id, bot_instance.id)
-
-                chat = await bot_instance.getChat(chat_id)
+                bot_member, chat, chat_admins = await cls.get_telegram_chat_info(bot_instance, chat_id, refresh_status)
 
             except telegram.error.RetryAfter as ex:
                 Logger.log("exception", "ChatTable.fetch_chat",
                            f"RetryAfter occurred while getting chat having id '{chat_id}'", ex)
 
-                time.sleep(ex.retry_after + random.uniform(1, 2))
+                if refresh_status is not None:
+                    refresh_status["retries"] += 1
 
-                bot_member = await bot_instance.get_chat_member(chat_id, bot_instance.id)
+                cls.api_rate_limiter.retry_after(ex.retry_after + random.uniform(1, 2))
 
-                chat = await bot_instance.getChat(chat_id)
+                bot_member, chat, chat_admins = await cls.get_telegram_chat_info(bot_instance, chat_id, refresh_status)
 
         except telegram.error.ChatMigrated as ex:
             new_chat_id = ex.new_chat_id
@@ -1419,6 +1985,9 @@ class ChatTable:
 
             migrated = ChatTable.migrate_chat_id(chat_id, new_chat_id)
 
+            if refresh_status is not None:
+                refresh_status["migrated"] += 1
+
             # If it was correctly migrated by the ChatTable.migrate_chat_id method a record associated to the
             # previous chat_id will no longer exists. The case in which it may not be migrated[*] correctly is
             # assumed to be the case where there is no record associated with the new chat_id. In that case,
@@ -1436,9 +2005,10 @@ class ChatTable:
             # [*] with the ChatTable.migrate_chat_id method
 
             if migrated:
-                return await cls.fetch_chat(bot_instance, new_chat_id, chat_data, cursor)
+                return await cls.fetch_chat(bot_instance, new_chat_id, chat_data, cursor, refresh_status=refresh_status)
             else:
-                return await cls.fetch_chat(bot_instance, new_chat_id, chat_data, cursor, migrating_from_chat_id=chat_id)
+                return await cls.fetch_chat(bot_instance, new_chat_id, None, cursor, migrating_from_chat_id=chat_id,
+                                            refresh_status=refresh_status)
 
         except telegram.error.Forbidden as ex:
             if "bot was kicked from the supergroup chat" in ex.message:
@@ -1451,6 +2021,9 @@ class ChatTable:
                 if migrating_from_chat_id:
                     ChatTable.remove_chat(migrating_from_chat_id)
 
+                if refresh_status is not None and (chat_data or migrating_from_chat_id):
+                    refresh_status["removed"] += 1
+
                 return chat_data, None, True
 
             else:
@@ -1484,19 +2057,6 @@ class ChatTable:
 
         current_chat_admins = []
 
-        chat_admins = None
-
-        try:
-            chat_admins = await bot_instance.get_chat_administrators(chat_id)
-
-        except telegram.error.RetryAfter as ex:
-            Logger.log("exception", "ChatTable.fetch_chat",
-                       f"RetryAfter occurred while getting chat administrators for chat having id '{chat_id}'", ex)
-
-            time.sleep(ex.retry_after + random.uniform(1, 2))
-
-            chat_admins = await bot_instance.get_chat_administrators(chat_id)
-
         current_chat_owner_id = None
 
         if chat_admins:
@@ -1509,46 +2069,40 @@ class ChatTable:
                     current_chat_owner_id = admin.user.id
 
         new_chat_data = {"chat_id": chat_id, "title": current_title, "invite_link": current_invite_link,
-                         "chat_admins": current_chat_admins, "missing_permissions": current_missing_permissions}
-
-        #
+                         "chat_admins": sorted(current_chat_admins), "chat_owner_id": current_chat_owner_id,
+                         "missing_permissions": current_missing_permissions}
 
         if chat_data:
-            saved_title = chat_data["title"]
+            changed_columns = cls.get_changed_columns(chat_data, new_chat_data)
+        else:
+            changed_columns = list(cls.refreshed_columns)
 
-            saved_invite_link = chat_data["invite_link"]
+        new_chat_data["changed_columns"] = changed_columns
 
-            saved_chat_admins = chat_data["chat_admins"]
+        if changed_columns and chat_data and chat_updates_batch is not None:
+            # Refresh runs collect the changed chats to write them in batches (see write_chat_updates)
+            new_chat_data["fetched_at"] = fetched_at
 
-            saved_chat_owner_id = chat_data["chat_owner_id"]
+            chat_updates_batch.append((chat_data, new_chat_data))
 
-            saved_missing_permissions = chat_data["missing_permissions"]
+        elif changed_columns:
+            if chat_data:
+                # Only the changed columns are written, and rows which didn't change aren't touched at all
+                # (so their updated_at value isn't bumped by the update_chat_timestamp trigger either)
+                query = "UPDATE chat SET " + ", ".join(f"{column} = %s" for column in changed_columns) + " WHERE chat_id = %s"
 
-        if not chat_data or ([current_chat_admins] != saved_chat_admins or current_chat_owner_id != saved_chat_owner_id or current_title != saved_title or current_invite_link != saved_invite_link or current_missing_permissions != saved_missing_permissions):
-            query_vars = (current_title, current_invite_link, current_chat_admins, current_chat_owner_id, current_missing_permissions, chat_id)
+                query_vars = tuple(new_chat_data[column] for column in changed_columns) + (chat_id,)
 
-            if chat_data:
-                query = """
-                    UPDATE chat
-                    SET 
-                        title = %s,
-                        invite_link = %s,
-                        chat_admins = %s,
-                        chat_owner_id = %s,
-                        missing_permissions = %s
-                    WHERE chat_id = %s;
-                """
-
-                saved_values = (saved_title, saved_invite_link, saved_chat_admins, saved_chat_owner_id, saved_missing_permissions, chat_id)
-
-                Logger.log("debug", "ChatTable.fetch_chat", f"Old (saved) values: {saved_values}")
-                Logger.log("debug", "ChatTable.fetch_chat", f"New (current) values: {query_vars}")
+                Logger.log("debug", "ChatTable.fetch_chat",
+                           f"Changed values: " + str({column: (chat_data[column], new_chat_data[column]) for column in changed_columns}))
             else:
                 query = """
                     INSERT INTO chat (title, invite_link, chat_admins, chat_owner_id, missing_permissions, chat_id)
                     VALUES (%s, %s, %s, %s, %s, %s)
                 """
 
+                query_vars = (current_title, current_invite_link, new_chat_data["chat_admins"], current_chat_owner_id, current_missing_permissions, chat_id)
+
             try:
                 connection = Database.connection
                 connection: psycopg2._psycopg.connection
@@ -1557,18 +2111,24 @@ class ChatTable:
 
                 connection.commit()
 
-                if chat_data:
-                    if chat_data["directory_id"] is not None and current_missing_permissions != saved_missing_permissions:
-                        directory_id = chat_data["directory_id"]
+                # The chat may have been removed in the meantime, in which case there's nothing to apply
+                if chat_data and cursor.rowcount == 0:
+                    Logger.log("debug", "ChatTable.fetch_chat", f"Chat '{chat_id}' was removed before being updated")
 
-                        if current_missing_permissions:
-                            DirectoryTable.increment_chats_count(directory_id, -1)
+                    return chat_data, None, True
 
-                        else:
-                            DirectoryTable.increment_chats_count(directory_id, +1)
+                if chat_data:
+                    cls.apply_chat_changes(chat_data, new_chat_data)
 
                     Logger.log("debug", "ChatTable.fetch_chat", f"Succesfully updated chat '{chat_id}' info")
                 else:
+                    cls.update_admins_index(chat_id, new_chat_data["chat_admins"])
+
+                    cls.update_search_index(chat_id, title=current_title, invite_link=current_invite_link,
+                                            missing_permissions=current_missing_permissions)
+
+                    cls.update_index_state(chat_id)
+
                     if migrating_from_chat_id:
                         ChatTable.migrate_chat_id(migrating_from_chat_id, chat_id)
 
@@ -1584,43 +2144,454 @@ class ChatTable:
 
                 return chat_data, new_chat_data, False
 
+        cls.last_refresh_times[chat_id] = time.time()
+
         return chat_data, new_chat_data, True
 
+    @classmethod
+    async def refresh_chats(cls, bot_instance: telegram.Bot, chat_ids: list, status: dict, log_author: str, on_chat_processed=None, on_updates_written=None) -> None:
+        cursor, iscursor = Database.get_cursor()
+
+        if not iscursor:
+            Logger.log("error", log_author, f"Couldn't get cursor required to refresh chats")
+
+            return
+
+        cursor: psycopg2._psycopg.cursor
+
+        chat_ids_queue = asyncio.Queue()
+
+        for chat_id in chat_ids:
+            chat_ids_queue.put_nowait(chat_id)
+
+        chat_updates_batch = []
+
+        def write_chat_updates_batch() -> None:
+            chat_updates = chat_updates_batch.copy()
+
+            chat_updates_batch.clear()
+
+            if not cls.write_chat_updates(chat_updates, cursor):
+                status["changed"] -= len(chat_updates)
+                status["failed"] += len(chat_updates)
+
+                if on_chat_processed is not None:
+                    for chat_data, _ in chat_updates:
+                        on_chat_processed(chat_data["chat_id"], "failed")
+
+            if on_updates_written is not None:
+                on_updates_written()
+
+        async def refresh_queued_chats() -> None:
+            while not chat_ids_queue.empty():
+                chat_id = chat_ids_queue.get_nowait()
+
+                # The refresh runs alongside user updates, so chats are re-read right before being
+                # refreshed (and skipped if they got removed in the meantime) instead of being taken
+                # from a snapshot which could have become stale
+                is_chat_data_read, outcome = True, None
+
+                try:
+                    chat_data, is_chat_data = cls.get_chat_data(chat_id, cursor)
+
+                except (Exception, psycopg2.DatabaseError) as ex:
+                    Logger.log("exception", log_author,
+                               f"Couldn't get data from database about chat having chat_id '{chat_id}'", ex)
+
+                    Database.connection.rollback()
+
+                    chat_data, is_chat_data, is_chat_data_read = None, False, False
+
+                    outcome = "failed"
+
+                if is_chat_data:
+                    try:
+                        _, new_chat_data, fetched = await cls.fetch_chat(bot_instance, chat_id, chat_data, cursor,
+                                                                         chat_updates_batch=chat_updates_batch,
+                                                                         refresh_status=status)
+
+                    except Exception as ex:
+                        Logger.log("exception", log_author, f"Couldn't refresh chat having chat_id '{chat_id}'", ex)
+
+                        new_chat_data, fetched = None, False
+
+                    if fetched and new_chat_data and new_chat_data["changed_columns"]:
+                        outcome = "changed"
+
+                    if not fetched:
+                        outcome = "failed"
+
+                        # Chats failing to be refreshed are postponed like the refreshed ones,
+                        # so that they don't keep being picked by refresh_stale_chats
+                        if chat_id in cls.last_refresh_times:
+                            cls.last_refresh_times[chat_id] = time.time()
+
+                elif is_chat_data_read:
+                    cls.last_refresh_times.pop(chat_id, None)
+
+                if outcome is not None:
+                    status[outcome] += 1
+
+                status["processed"] += 1
+
+                if on_chat_processed is not None:
+                    on_chat_processed(chat_id, outcome)
+
+                if len(chat_updates_batch) >= cls.chat_updates_batch_size or status["processed"] % cls.chat_updates_batch_size == 0:
+                    write_chat_updates_batch()
+
+                if status["processed"] % cls.fetch_chats_log_interval == 0:
+                    Logger.log("info", log_author,
+                               f"Refreshed {status['processed']}/{status['total']} chats"
+                               f" ({status['changed']} changed, {status['failed']} failed) in {int(time.time() - status['started_at'])}s")
+
+        wait_time = cls.api_rate_limiter.wait_time
+
+        try:
+            await asyncio.gather(*[refresh_queued_chats() for _ in range(max(1, cls.fetch_chats_workers))])
+
+        finally:
+            write_chat_updates_batch()
+
+            status["wait_time"] += cls.api_rate_limiter.wait_time - wait_time
+
+    @classmethod
+    def get_fetch_chats_checkpoint(cls) -> (dict | None):
+        checkpoint = PersistentVarsTable.get_value_by_key(cls.fetch_chats_checkpoint_key)
+
+        if checkpoint:
+            try:
+                return json.loads(checkpoint)
+
+            except ValueError as ex:
+                Logger.log("exception", "ChatTable.get_fetch_chats_checkpoint", f"Couldn't parse checkpoint '{checkpoint}'", ex)
+
+        return None
+
+    @classmethod
+    def save_fetch_chats_checkpoint(cls, finished: bool = False) -> None:
+        status = cls.fetch_chats_status
+
+        checkpoint = {"run_id": status["run_id"], "last_chat_id": status["last_chat_id"], "finished": finished,
+                      "started_at": status["started_at"], "total": status["total"], "processed": status["checkpoint_processed"],
+                      "failed": status["checkpoint_failed"], "changed": status["checkpoint_changed"]}
+
+        for key in cls.refresh_telemetry_keys:
+            checkpoint[key] = status[key]
+
+        PersistentVarsTable.set_value(cls.fetch_chats_checkpoint_key, json.dumps(checkpoint))
+
+    @classmethod
+    def get_fetch_chats_report(cls) -> (dict | None):
+        report = PersistentVarsTable.get_value_by_key(cls.fetch_chats_report_key)
+
+        if report:
+            try:
+                return json.loads(report)
+
+            except ValueError as ex:
+                Logger.log("exception", "ChatTable.get_fetch_chats_report", f"Couldn't parse report '{report}'", ex)
+
+        return None
+
+    @classmethod
+    def save_fetch_chats_report(cls) -> dict:
+        status = cls.fetch_chats_status
+
+        report = {"run_id": status["run_id"], "started_at": status["started_at"], "finished_at": status["finished_at"],
+                  "duration": round(status["finished_at"] - status["started_at"], 1), "workers": cls.fetch_chats_workers,
+                  "max_api_rate": cls.api_rate_limiter.max_rate, "total": status["total"], "processed": status["processed"],
+                  "changed": status["changed"], "failed": status["failed"]}
+
+        for key in cls.refresh_telemetry_keys:
+            report[key] = status[key]
+
+        report["wait_time"] = round(report["wait_time"], 1)
+
+        PersistentVarsTable.set_value(cls.fetch_chats_report_key, json.dumps(report))
+
+        return report
+
+    @classmethod
+    def get_fetch_chats_progress(cls) -> (float, float | None):
+        status = cls.fetch_chats_status
+
+        if not status["total"]:
+            return 100.0, None
+
+        percentage = 100 * status["processed"] / status["total"]
+
+        if not status["running"]:
+            return percentage, None
+
+        # The estimate is based on the speed of the current process only, as a resumed
+        # run could have been interrupted for any amount of time
+        processed_now = status["processed"] - status["resumed_processed"]
+
+        elapsed_time = time.time() - status["resumed_at"]
+
+        if processed_now <= 0 or elapsed_time <= 0:
+            return percentage, None
+
+        return percentage, (status["total"] - status["processed"]) * elapsed_time / processed_now
+
     @classmethod
     async def fetch_chats(cls, context: ContextTypes.DEFAULT_TYPE) -> None:
         bot_instance = context.job.data
         bot_instance: telegram.Bot
 
+        status = cls.fetch_chats_status
+
+        if status["running"]:
+            Logger.log("warning", "ChatTable.fetch_chats", f"Chats are already being refreshed")
+
+            return
+
         cursor, iscursor = Database.get_cursor()
 
         if iscursor:
             cursor: psycopg2._psycopg.cursor
 
-            cursor.execute("SELECT * FROM chat")
+            checkpoint = cls.get_fetch_chats_checkpoint()
 
-            column_names = [desc[0] for desc in cursor.description]
-            records = cursor.fetchall()
+            # Interrupted runs are resumed from the chat following the last one which got refreshed (chats
+            # are refreshed in chat_id order), unless they are so old that starting over makes more sense
+            resume = bool(checkpoint and not checkpoint["finished"] and checkpoint["last_chat_id"] is not None
+                          and time.time() - checkpoint["started_at"] < cls.stale_chats_refresh_sla)
 
-            chats = Database.records_to_dict(column_names, records)
+            try:
+                if resume:
+                    cursor.execute("SELECT chat_id FROM chat WHERE chat_id > %s ORDER BY chat_id", (checkpoint["last_chat_id"],))
+                else:
+                    cursor.execute("SELECT chat_id FROM chat ORDER BY chat_id")
+
+                chat_ids = [record[0] for record in cursor.fetchall()]
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "ChatTable.fetch_chats", f"Couldn't get the ids of the chats to refresh", ex)
+
+                Database.connection.rollback()
+
+                return
+
+            if resume:
+                status.update(run_id=checkpoint["run_id"], started_at=checkpoint["started_at"],
+                              last_chat_id=checkpoint["last_chat_id"], processed=checkpoint["processed"],
+                              failed=checkpoint["failed"], changed=checkpoint["changed"],
+                              api_calls=dict(checkpoint.get("api_calls", {})), retries=checkpoint.get("retries", 0),
+                              wait_time=checkpoint.get("wait_time", 0.0), removed=checkpoint.get("removed", 0),
+                              migrated=checkpoint.get("migrated", 0))
+            else:
+                status.update(run_id=uuid4().hex[:8], started_at=time.time(), last_chat_id=None,
+                              processed=0, failed=0, changed=0,
+                              api_calls={}, retries=0, wait_time=0.0, removed=0, migrated=0)
+
+            status.update(running=True, finished_at=None, total=status["processed"] + len(chat_ids),
+                          resumed_at=time.time(), resumed_processed=status["processed"],
+                          checkpoint_processed=status["processed"], checkpoint_failed=status["failed"],
+                          checkpoint_changed=status["changed"])
+
+            if resume:
+                Logger.log("info", "ChatTable.fetch_chats",
+                           f"Resumed refresh run '{status['run_id']}' after chat '{status['last_chat_id']}', "
+                           f"{len(chat_ids)} chats left ({status['processed']}/{status['total']} already refreshed)")
+            else:
+                Logger.log("info", "ChatTable.fetch_chats",
+                           f"Started refresh run '{status['run_id']}' of {status['total']} chats"
+                           f" with {cls.fetch_chats_workers} workers")
+
+            cls.save_fetch_chats_checkpoint()
+
+            # Workers complete chats out of order, so the checkpoint only moves past the chats
+            # preceded by already refreshed ones (and whose changes were written to the database),
+            # and its failed and changed counters only count the outcomes of those chats, as the
+            # ones following them are refreshed (and counted) again when the run is resumed
+            chat_ids_indexes = {chat_id: i for i, chat_id in enumerate(chat_ids)}
+
+            processed_chats = [False] * len(chat_ids)
+
+            chats_outcomes = [None] * len(chat_ids)
+
+            refreshed_chats_prefix_length = 0
+
+            prefix_outcomes_counts = {"failed": status["failed"], "changed": status["changed"]}
+
+            def on_chat_processed(chat_id: int, outcome: str) -> None:
+                nonlocal refreshed_chats_prefix_length
+
+                i = chat_ids_indexes[chat_id]
+
+                # Chats whose batch couldn't be written are reported again as failed
+                if i < refreshed_chats_prefix_length:
+                    if chats_outcomes[i] is not None:
+                        prefix_outcomes_counts[chats_outcomes[i]] -= 1
+
+                    if outcome is not None:
+                        prefix_outcomes_counts[outcome] += 1
+
+                processed_chats[i], chats_outcomes[i] = True, outcome
+
+                while refreshed_chats_prefix_length < len(chat_ids) and processed_chats[refreshed_chats_prefix_length]:
+                    if chats_outcomes[refreshed_chats_prefix_length] is not None:
+                        prefix_outcomes_counts[chats_outcomes[refreshed_chats_prefix_length]] += 1
+
+                    refreshed_chats_prefix_length += 1
 
-            for chat_id, chat_data in chats.items():
-                await cls.fetch_chat(bot_instance, chat_id, chat_data, cursor)
+            def on_updates_written() -> None:
+                if refreshed_chats_prefix_length > 0:
+                    status["last_chat_id"] = chat_ids[refreshed_chats_prefix_length - 1]
 
-                time.sleep(1)
+                    status["checkpoint_processed"] = status["resumed_processed"] + refreshed_chats_prefix_length
+
+                    status["checkpoint_failed"] = prefix_outcomes_counts["failed"]
+                    status["checkpoint_changed"] = prefix_outcomes_counts["changed"]
+
+                cls.save_fetch_chats_checkpoint()
+
+            try:
+                await cls.refresh_chats(bot_instance, chat_ids, status, "ChatTable.fetch_chats",
+                                        on_chat_processed, on_updates_written)
+
+            finally:
+                status.update(running=False, finished_at=time.time())
+
+            status.update(checkpoint_processed=status["processed"], checkpoint_failed=status["failed"],
+                          checkpoint_changed=status["changed"])
+
+            cls.save_fetch_chats_checkpoint(finished=True)
+
+            report = cls.save_fetch_chats_report()
+
+            Logger.log("info", "ChatTable.fetch_chats",
+                       f"Finished refresh run '{status['run_id']}' of {status['processed']}/{status['total']} chats"
+                       f" ({status['changed']} changed, {status['failed']} failed) in {int(status['finished_at'] - status['started_at'])}s"
+                       f", report: {json.dumps(report)}")
 
         else:
             Logger.log("error", "ChatTable.fetch_chats", f"Couldn't get cursor required to fetch chats")
 
+    @classmethod
+    def get_stale_chat_ids(cls) -> list:
+        total_chats = len(cls.last_refresh_times)
+
+        if total_chats == 0:
+            return []
+
+        # Refreshing this many of the least recently refreshed chats every tick makes every
+        # chat get refreshed at least once every stale_chats_refresh_sla seconds
+        budget = ceil(total_chats * cls.stale_chats_refresh_interval / cls.stale_chats_refresh_sla)
+
+        # Chats in which the bot lacks the permissions required to be listed are retried more often (taking
+        # precedence over the other ones within the same budget), as they usually get fixed by their admins
+        # shortly after being added to the index
+        min_refresh_time = time.time() - cls.missing_permissions_refresh_interval
+
+        missing_permissions_chat_ids = []
+
+        for chat_id, last_refresh_time in cls.last_refresh_times.items():
+            if last_refresh_time <= min_refresh_time:
+                chat_search_data = SearchIndex.get_document_data(("chat", chat_id))
+
+                if chat_search_data and chat_search_data["missing_permissions"]:
+                    missing_permissions_chat_ids.append(chat_id)
+
+        missing_permissions_chat_ids = heapq.nsmallest(budget, missing_permissions_chat_ids, key=cls.last_refresh_times.get)
+
+        # The least recently refreshed chats fill the rest of the budget
+        stale_chat_ids = heapq.nsmallest(budget, cls.last_refresh_times, key=cls.last_refresh_times.get)
+
+        return list(dict.fromkeys(missing_permissions_chat_ids + stale_chat_ids))[:budget]
+
+    @classmethod
+    async def refresh_stale_chats(cls, context: ContextTypes.DEFAULT_TYPE) -> None:
+        bot_instance = context.job.data
+        bot_instance: telegram.Bot
+
+        status = cls.stale_chats_refresh_status
+
+        # Full refreshes already refresh every chat, while a tick still running means that
+        # the API rate limit isn't enough to keep up with the SLA, so it's not slowed down more
+        if cls.fetch_chats_status["running"] or status["running"]:
+            return
+
+        stale_chat_ids = cls.get_stale_chat_ids()
+
+        if not stale_chat_ids:
+            return
+
+        status.update(running=True, started_at=time.time(), total=len(stale_chat_ids), processed=0, failed=0, changed=0,
+                      api_calls={}, retries=0, wait_time=0.0, removed=0, migrated=0)
+
+        try:
+            await cls.refresh_chats(bot_instance, stale_chat_ids, status, "ChatTable.refresh_stale_chats")
+
+        finally:
+            status.update(running=False, finished_at=time.time(), ticks=status["ticks"] + 1,
+                          refreshed=status["refreshed"] + status["processed"],
+                          total_failed=status["total_failed"] + status["failed"],
+                          total_changed=status["total_changed"] + status["changed"])
+
+        Logger.log("debug", "ChatTable.refresh_stale_chats",
+                   f"Refreshed {status['processed']} stale chats ({status['changed']} changed, {status['failed']} failed)"
+                   f" in {int(status['finished_at'] - status['started_at'])}s")
+
 
 class SessionTable:
-    active_chat_sessions = {}
+    # Sessions expire session_ttl seconds after their menu was last rendered (like the buttons kept by
+    # CallbackQueriesRegistry) or, when more than max_sessions are active, least recently used first
+    session_ttl = 3 * 24 * 60 * 60
+
+    max_sessions = 50000
+
+    expire_inactive_sessions_interval = 60
+
+    # Menus of expired sessions are replaced by expired_menus_workers tasks, rate limited separately from
+    # (and more strictly than) the groups refreshes, so that they leave room to the menus of live sessions
+    expired_menus_workers = 8
+
+    expired_menus_rate_limiter = TokenBucket(rate=10, capacity=10)
+
+    expire_old_sessions_batch_size = 500
+
+    # Menu message id of the sessions which expired since expire_inactive_sessions last ran, whose
+    # menus are then replaced by the expired session one
+    expired_sessions = {}
+
+    # Menu message id of the active session of each user, only set by the handlers of the user's updates, which
+    # ChatOrderedUpdateProcessor runs one at a time. Jobs run concurrently to them, so they only peek() at it and
+    # expire() its entries: evicting just queues them into expired_sessions without awaiting, and a session which
+    # is meanwhile started again is skipped by edit_expired_menus, so it's never taken from a handler mid-update
+    active_chat_sessions = TTLCache(maxsize=max_sessions, ttl=session_ttl, on_evict=expired_sessions.__setitem__)
+
+    # Id of the message showing the last menu rendered in each user's session and fingerprint of its text
+    # and keyboard, so that rendering the same menu again in the same message doesn't need to edit it
+    rendered_menus = TTLCache(maxsize=max_sessions, ttl=session_ttl)
 
     @classmethod
     def get_active_session_menu_message_id(cls, chat_id: int) -> int:
-        if chat_id in cls.active_chat_sessions:
-            return cls.active_chat_sessions[chat_id]
-        else:
-            return -1
+        return cls.active_chat_sessions.get(chat_id, -1, count=False)
+
+    @classmethod
+    def refresh_session(cls, chat_id: int, latest_menu_message_id: int) -> None:
+        cls.active_chat_sessions.set(chat_id, latest_menu_message_id)
+
+    @classmethod
+    def get_menu_fingerprint(cls, text: str, reply_markup: InlineKeyboardMarkup = None) -> str:
+        m = hashlib.md5()
+        m.update(text.encode())
+
+        if reply_markup:
+            m.update(json.dumps(reply_markup.to_dict(), sort_keys=True).encode())
+
+        return m.hexdigest()
+
+    @classmethod
+    def set_rendered_menu(cls, chat_id: int, message_id: int, text: str, reply_markup: InlineKeyboardMarkup = None) -> None:
+        cls.rendered_menus.set(chat_id, (message_id, cls.get_menu_fingerprint(text, reply_markup)))
+
+    @classmethod
+    def menu_is_rendered(cls, chat_id: int, message_id: int, text: str, reply_markup: InlineKeyboardMarkup = None) -> bool:
+        return cls.rendered_menus.get(chat_id, count=False) == (message_id, cls.get_menu_fingerprint(text, reply_markup))
 
     @classmethod
     def add_session(cls, chat_id: int, latest_menu_message_id: int) -> None:
@@ -1635,7 +2606,9 @@ class SessionTable:
                 connection = Database.connection
                 connection: psycopg2._psycopg.connection
 
-                cursor.execute("INSERT INTO session (chat_id, menu_message_id) VALUES (%s, %s)",
+                # The expired session of the user may not have been deleted yet by expire_inactive_sessions
+                cursor.execute("INSERT INTO session (chat_id, menu_message_id) VALUES (%s, %s) "
+                               "ON CONFLICT (chat_id) DO UPDATE SET created_at = now(), menu_message_id = EXCLUDED.menu_message_id",
                                (chat_id, latest_menu_message_id))
 
                 connection.commit()
@@ -1678,6 +2651,66 @@ class SessionTable:
         else:
             Logger.log("error", "SessionTable.update_session", f"Couldn't get cursor required to update session data")
 
+    @classmethod
+    async def edit_expired_menus(cls, bot_instance: telegram.Bot, sessions: list) -> list:
+        # The expired session menu is the same for everyone, so it's only built once
+        text, reply_markup = Menus.get_expired_session_menu()
+
+        sessions_queue = asyncio.Queue()
+
+        for session in sessions:
+            sessions_queue.put_nowait(session)
+
+        expired_sessions = []
+
+        async def edit_queued_menus() -> None:
+            while not sessions_queue.empty():
+                chat_id, menu_message_id = sessions_queue.get_nowait()
+
+                await cls.expired_menus_rate_limiter.acquire()
+
+                # The menu may have been used again since the session expired
+                if cls.active_chat_sessions.peek(chat_id) == menu_message_id:
+                    continue
+
+                try:
+                    await bot_instance.edit_message_text(chat_id=chat_id, message_id=menu_message_id,
+                                                         text=text, reply_markup=reply_markup)
+
+                except telegram.error.RetryAfter as ex:
+                    cls.expired_menus_rate_limiter.retry_after(ex.retry_after + random.uniform(1, 2))
+
+                    sessions_queue.put_nowait((chat_id, menu_message_id))
+
+                    continue
+
+                except Exception:
+                    pass
+
+                expired_sessions.append((chat_id, menu_message_id))
+
+        await asyncio.gather(*[edit_queued_menus() for _ in range(max(1, cls.expired_menus_workers))])
+
+        return expired_sessions
+
+    @classmethod
+    def delete_expired_sessions(cls, expired_sessions: list, cursor: psycopg2._psycopg.cursor) -> bool:
+        try:
+            # Sessions the users already started again in the meantime have a different menu message id
+            cursor.executemany("DELETE FROM session WHERE chat_id = %s AND menu_message_id = %s", expired_sessions)
+
+            Database.connection.commit()
+
+            return True
+
+        except (Exception, psycopg2.DatabaseError) as ex:
+            Logger.log("exception", "SessionTable.delete_expired_sessions",
+                       f"An exception occurred while trying to delete {len(expired_sessions)} expired sessions", ex)
+
+            Database.connection.rollback()
+
+            return False
+
     @classmethod
     async def expire_old_sessions(cls, context: ContextTypes.DEFAULT_TYPE) -> None:
         cursor, iscursor = Database.get_cursor()
@@ -1685,40 +2718,76 @@ class SessionTable:
         if iscursor:
             cursor: psycopg2._psycopg.cursor
 
-            try:
-                connection = Database.connection
-                connection: psycopg2._psycopg.connection
+            started_at, expired_count, last_chat_id = time.time(), 0, None
 
-                cursor.execute("SELECT chat_id, menu_message_id FROM session")
+            # Old sessions are only deleted once their menus have been replaced, a batch at a time, so that
+            # the ones left if the bot is stopped meanwhile are expired by the next run of this job
+            while True:
+                try:
+                    cursor.execute("SELECT chat_id, menu_message_id FROM session"
+                                   " WHERE NOT (chat_id = ANY(%s)) AND (%s IS NULL OR chat_id > %s)"
+                                   " ORDER BY chat_id LIMIT %s",
+                                   (cls.active_chat_sessions.keys(), last_chat_id, last_chat_id, cls.expire_old_sessions_batch_size))
 
-                records = cursor.fetchall()
+                    records = cursor.fetchall()
 
-                for record in records:
-                    chat_id, menu_message_id = record
+                except (Exception, psycopg2.DatabaseError) as ex:
+                    Logger.log("critical", "SessionTable.expire_old_sessions",
+                               f"An exception occurred while trying to expire old sessions", ex)
 
-                    text, reply_markup = Menus.get_expired_session_menu()
+                    Database.connection.rollback()
 
-                    from tgib.handlers.queries import Queries
-                    reply_markup = Queries.encode_queries(reply_markup)
+                    break
 
-                    try:
-                        await context.bot.edit_message_text(chat_id=chat_id, message_id=menu_message_id,
-                                                            text=text, reply_markup=reply_markup)
-                    except Exception:
-                        pass
+                if not records:
+                    break
 
-                cursor.execute("DELETE FROM session")
+                last_chat_id = records[-1][0]
 
-                connection.commit()
+                expired_sessions = await cls.edit_expired_menus(context.bot, records)
 
-            except (Exception, psycopg2.DatabaseError) as ex:
-                Logger.log("critical", "SessionTable.expire_old_sessions",
-                           f"An exception occurred while trying to expire old sessions", ex)
+                if expired_sessions and cls.delete_expired_sessions(expired_sessions, cursor):
+                    expired_count += len(expired_sessions)
+
+            if expired_count:
+                Logger.log("info", "SessionTable.expire_old_sessions",
+                           f"Expired {expired_count} old sessions in {int(time.time() - started_at)}s")
 
         else:
             Logger.log("error", "SessionTable.expire_old_sessions",
                        f"Couldn't get cursor required to expire old sessions")
 
+    @classmethod
+    async def expire_inactive_sessions(cls, context: ContextTypes.DEFAULT_TYPE) -> None:
+        cls.active_chat_sessions.expire()
+
+        cls.rendered_menus.expire()
+
+        if not cls.expired_sessions:
+            return
+
+        expired_sessions = list(cls.expired_sessions.items())
+
+        cls.expired_sessions.clear()
+
+        for chat_id, _ in expired_sessions:
+            if cls.active_chat_sessions.peek(chat_id) is None:
+                cls.rendered_menus.pop(chat_id)
+
+                await ChunkedMessages.delete_leading_messages(context.bot, chat_id)
+
+        expired_sessions = await cls.edit_expired_menus(context.bot, expired_sessions)
+
+        if expired_sessions:
+            cursor, iscursor = Database.get_cursor()
+
+            if iscursor:
+                cls.delete_expired_sessions(expired_sessions, cursor)
+
+            else:
+                Logger.log("error", "SessionTable.expire_inactive_sessions",
+                           f"Couldn't get cursor required to delete expired sessions")
+
 
 class PersistentVarsTable:
     @classmethod
@@ -1781,6 +2850,39 @@ class PersistentVarsTable:
 
         return updated
 
+    @classmethod
+    def set_value(cls, key: str, value: str) -> bool:
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            cursor: psycopg2._psycopg.cursor
+
+            connection = Database.connection
+            connection: psycopg2._psycopg.connection
+
+            try:
+                cursor.execute(
+                    "INSERT INTO persistent_vars (key, value, created_at, updated_at) "
+                    "VALUES (%s, %s, NOW() AT TIME ZONE 'Europe/Rome', NOW() AT TIME ZONE 'Europe/Rome') "
+                    "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at",
+                    (key, value)
+                )
+
+                connection.commit()
+
+                return True
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("critical", "PersistentVarsTable.set_value",
+                           f"An exception occurred while trying to set '{key}' value to '{value}'", ex)
+
+                connection.rollback()
+        else:
+            Logger.log("error", "PersistentVarsTable.set_value",
+                       f"Couldn't get cursor required to set '{key}' value to '{value}'")
+
+        return False
+
     @classmethod
     def get_value_by_key(cls, key: str) -> (str | None):
         cursor, iscursor = Database.get_cursor()
@@ -1800,3 +2902,104 @@ class PersistentVarsTable:
         else:
             Logger.log("error", "PersistentVarsTable.get_value_by_key",
                        f"Couldn't get cursor required to get '{key}' value")
+
+
+class CallbackQueryTable:
+    @classmethod
+    def save_queries(cls, queries: dict) -> bool:
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            cursor: psycopg2._psycopg.cursor
+
+            # Queries registered again are saved again too, so that saved_at tells when they were last used
+            query = """
+                INSERT INTO callback_query (hash, query_data)
+                VALUES %s
+                ON CONFLICT (hash) DO UPDATE SET saved_at = now()
+            """
+
+            try:
+                connection = Database.connection
+                connection: psycopg2._psycopg.connection
+
+                psycopg2.extras.execute_values(cursor, query, list(queries.items()))
+
+                connection.commit()
+
+                return True
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "CallbackQueryTable.save_queries",
+                           f"Couldn't save {len(queries)} callback queries", ex)
+
+                Database.connection.rollback()
+
+                return False
+
+        else:
+            Logger.log("error", "CallbackQueryTable.save_queries",
+                       f"Couldn't get cursor required to save {len(queries)} callback queries")
+
+            return False
+
+    @classmethod
+    def get_query_data(cls, hashed_query_data: str) -> (str | None):
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            cursor: psycopg2._psycopg.cursor
+
+            try:
+                cursor.execute("SELECT query_data FROM callback_query WHERE hash = %s", (hashed_query_data,))
+
+                record = cursor.fetchone()
+
+                return record[0] if record else None
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "CallbackQueryTable.get_query_data",
+                           f"Couldn't get callback query having hash '{hashed_query_data}'", ex)
+
+                Database.connection.rollback()
+
+                return None
+
+        else:
+            Logger.log("error", "CallbackQueryTable.get_query_data",
+                       f"Couldn't get cursor required to get callback query having hash '{hashed_query_data}'")
+
+            return None
+
+    @classmethod
+    def delete_old_queries(cls, max_age: float) -> int:
+        cursor, iscursor = Database.get_cursor()
+
+        if iscursor:
+            cursor: psycopg2._psycopg.cursor
+
+            try:
+                connection = Database.connection
+                connection: psycopg2._psycopg.connection
+
+                cursor.execute("DELETE FROM callback_query WHERE saved_at < now() - %s * INTERVAL '1 second'", (max_age,))
+
+                deleted_queries_count = cursor.rowcount
+
+                connection.commit()
+
+                return deleted_queries_count
+
+            except (Exception, psycopg2.DatabaseError) as ex:
+                Logger.log("exception", "CallbackQueryTable.delete_old_queries",
+                           f"Couldn't delete callback queries older than {max_age} seconds", ex)
+
+                Database.connection.rollback()
+
+                return 0
+
+        else:
+            Logger.log("error", "CallbackQueryTable.delete_old_queries",
+                       f"Couldn't get cursor required to delete old callback queries")
+
+            return 0
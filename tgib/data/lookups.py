@@ -0,0 +1,127 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+import telegram
+
+from tgib.data.caches import TTLCache
+
+
+class TelegramLookups:
+    # Seconds for which the results of each Bot API method are reused (chat members are kept the
+    # shortest as they're also used to check whether users are allowed to manage their groups)
+    ttls = {"get_chat": 300, "get_chat_member": 30, "get_chat_administrators": 120}
+
+    # Errors describing the looked up chat or user (rather than the request) are cached too,
+    # for a shorter time, so that e.g. deleted accounts aren't looked up again on every render
+    negative_ttl = 30
+
+    cached_errors = (telegram.error.BadRequest, telegram.error.Forbidden, telegram.error.ChatMigrated)
+
+    caches = {method_name: TTLCache(maxsize=4096, ttl=ttl) for method_name, ttl in ttls.items()}
+
+    in_flight_requests = {}
+
+    coalesced_requests = 0
+
+    @classmethod
+    async def request(cls, method_name: str, bot_instance: telegram.Bot, args: tuple, rate_limiter=None, priority: bool = False):
+        cache = cls.caches[method_name]
+
+        if rate_limiter is not None:
+            await rate_limiter.acquire(priority=priority)
+
+        try:
+            result = await getattr(bot_instance, method_name)(*args)
+
+        except cls.cached_errors as ex:
+            cache.set(args, (True, ex), ttl=cls.negative_ttl)
+
+            raise
+
+        cache.set(args, (False, result))
+
+        return result
+
+    @classmethod
+    async def lookup(cls, method_name: str, bot_instance: telegram.Bot, args: tuple, fresh: bool = False, rate_limiter=None, priority: bool = False):
+        if not fresh:
+            cached_result = cls.caches[method_name].get(args)
+
+            if cached_result is not None:
+                is_error, result = cached_result
+
+                if is_error:
+                    raise result
+
+                return result
+
+        # Concurrent identical lookups share the same request, which is shielded so that it
+        # isn't cancelled together with any of the handlers waiting for it
+        request_key = (method_name, args)
+
+        request_task = cls.in_flight_requests.get(request_key)
+
+        if request_task is not None:
+            cls.coalesced_requests += 1
+
+        else:
+            request_task = asyncio.ensure_future(cls.request(method_name, bot_instance, args, rate_limiter, priority))
+
+            cls.in_flight_requests[request_key] = request_task
+
+            request_task.add_done_callback(lambda _: cls.in_flight_requests.pop(request_key, None))
+
+        return await asyncio.shield(request_task)
+
+    @classmethod
+    async def get_chat(cls, bot_instance: telegram.Bot, chat_id: int, fresh: bool = False, rate_limiter=None, priority: bool = False) -> telegram.Chat:
+        return await cls.lookup("get_chat", bot_instance, (chat_id,), fresh, rate_limiter, priority)
+
+    @classmethod
+    async def get_chat_member(cls, bot_instance: telegram.Bot, chat_id: int, user_id: int, fresh: bool = False, rate_limiter=None, priority: bool = False) -> telegram.ChatMember:
+        return await cls.lookup("get_chat_member", bot_instance, (chat_id, user_id), fresh, rate_limiter, priority)
+
+    @classmethod
+    async def get_chat_administrators(cls, bot_instance: telegram.Bot, chat_id: int, fresh: bool = False, rate_limiter=None, priority: bool = False) -> tuple:
+        return await cls.lookup("get_chat_administrators", bot_instance, (chat_id,), fresh, rate_limiter, priority)
+
+    @classmethod
+    def invalidate_chat(cls, chat_id: int, user_id: int = None) -> None:
+        if user_id is not None:
+            cls.caches["get_chat_member"].pop((chat_id, user_id))
+
+        else:
+            for args in cls.caches["get_chat_member"].keys():
+                if args[0] == chat_id:
+                    cls.caches["get_chat_member"].pop(args)
+
+            cls.caches["get_chat"].pop((chat_id,))
+
+        cls.caches["get_chat_administrators"].pop((chat_id,))
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        stats = {method_name: cache.get_stats() for method_name, cache in cls.caches.items()}
+
+        stats["coalesced_requests"] = cls.coalesced_requests
+
+        return stats
@@ -0,0 +1,171 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import unicodedata
+from collections import Counter
+from math import ceil
+
+
+class SearchIndex:
+    # Minimum trigram similarity (same default as PostgreSQL's pg_trgm) a
+    # document must have with the query to be returned
+    similarity_threshold = 0.3
+
+    # Documents are identified by (kind, id) keys, e.g. ("chat", chat_id)
+    # and ("directory", directory_id), and store their normalized texts,
+    # their trigrams and any data the callers want to attach to them
+    documents = {}
+
+    trigrams_index = {}
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        text = unicodedata.normalize("NFKD", text.lower())
+
+        text = "".join(char for char in text if not unicodedata.combining(char))
+
+        return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+    @classmethod
+    def get_trigrams(cls, normalized_text: str) -> set:
+        trigrams = set()
+
+        for word in normalized_text.split():
+            padded_word = f"  {word} "
+
+            for i in range(len(padded_word) - 2):
+                trigrams.add(padded_word[i:i + 3])
+
+        return trigrams
+
+    @classmethod
+    def add_document(cls, key: tuple, texts: list, data: dict = None) -> None:
+        if key in cls.documents:
+            cls.remove_document(key)
+
+        normalized_texts = [cls.normalize(text) for text in texts if text]
+
+        trigrams = set()
+
+        for normalized_text in normalized_texts:
+            trigrams |= cls.get_trigrams(normalized_text)
+
+        cls.documents[key] = {"texts": normalized_texts if normalized_texts else [""], "trigrams": trigrams,
+                              "trigrams_count": len(trigrams), "data": data if data else {}}
+
+        for trigram in trigrams:
+            cls.trigrams_index.setdefault(trigram, set()).add(key)
+
+    @classmethod
+    def update_document_data(cls, key: tuple, **changes) -> None:
+        if key in cls.documents:
+            cls.documents[key]["data"].update(changes)
+
+    @classmethod
+    def get_document_data(cls, key: tuple) -> (dict | None):
+        if key in cls.documents:
+            return cls.documents[key]["data"]
+
+        return None
+
+    @classmethod
+    def remove_document(cls, key: tuple) -> None:
+        document = cls.documents.pop(key, None)
+
+        if document:
+            for trigram in document["trigrams"]:
+                keys = cls.trigrams_index.get(trigram)
+
+                if keys is not None:
+                    keys.discard(key)
+
+                    if not keys:
+                        cls.trigrams_index.pop(trigram)
+
+    @classmethod
+    def search(cls, query: str, kind: str = None, limit: int = 10, accept=None) -> list:
+        normalized_query = cls.normalize(query)
+
+        query_trigrams = cls.get_trigrams(normalized_query)
+
+        if not query_trigrams:
+            return []
+
+        shared_trigrams_counts = Counter()
+
+        for trigram in query_trigrams:
+            keys = cls.trigrams_index.get(trigram)
+
+            if keys:
+                shared_trigrams_counts.update(keys)
+
+        query_trigrams_count = len(query_trigrams)
+
+        query_words = normalized_query.split()
+
+        # Since a document can't have fewer trigrams than the ones it shares with the query, documents
+        # sharing less than this many trigrams can't reach the similarity threshold, while documents
+        # having a word starting with each of the query words share all of its trigrams except for, at
+        # most, the ones ending with the padding (one per word)
+        min_prefix_shared_trigrams_count = query_trigrams_count - len(query_words)
+
+        min_shared_trigrams_count = min(ceil(cls.similarity_threshold * query_trigrams_count), min_prefix_shared_trigrams_count)
+
+        scored_keys = []
+
+        for key, shared_trigrams_count in shared_trigrams_counts.items():
+            if shared_trigrams_count < min_shared_trigrams_count or (kind is not None and key[0] != kind):
+                continue
+
+            document = cls.documents[key]
+
+            score = shared_trigrams_count / (query_trigrams_count + document["trigrams_count"] - shared_trigrams_count)
+
+            # Documents starting with the query (or having words starting with each of the query words)
+            # rank above the ones that are merely similar to it
+            if shared_trigrams_count >= min_prefix_shared_trigrams_count:
+                for normalized_text in document["texts"]:
+                    if normalized_text.startswith(normalized_query):
+                        score += 2
+                        break
+
+                    words = normalized_text.split()
+
+                    if all(any(word.startswith(query_word) for word in words) for query_word in query_words):
+                        score += 1
+                        break
+
+            if score >= cls.similarity_threshold:
+                scored_keys.append((-score, document["texts"][0], key))
+
+        scored_keys.sort()
+
+        results = []
+
+        for _, _, key in scored_keys:
+            data = cls.documents[key]["data"]
+
+            if accept is None or accept(key, data):
+                results.append((key, data))
+
+                if len(results) >= limit:
+                    break
+
+        return results
@@ -20,33 +20,50 @@
 import time
 
 import telegram.error
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMemberAdministrator, ChatMemberOwner
+from telegram import Update, ChatMemberAdministrator, ChatMemberOwner
 from telegram.ext import ContextTypes
 
 from tgib.data.database import SessionTable, DirectoryTable, AccountTable, ChatTable
+from tgib.data.lookups import TelegramLookups
 from tgib.global_vars import GlobalVariables
 from tgib.handlers.queries import Queries
 from tgib.i18n.locales import Locale
 from tgib.logs import Logger
+from tgib.ui.callbacks import CallbackQueriesRegistry, KeyboardBuilder
 from tgib.ui.menus import Menus
+from tgib.ui.texts import TextBuffer, ChunkedMessages
 
 
 class Commands:
     command_cooldowns = {"dont": 15, "reload": 15, "userstatus": 60}
+    # Keyed by user id, so that the updates of different users (which can be handled concurrently) never share an entry
     user_last_command_use_dates = {"dont": {}, "reload": {}, "userstatus": {}}
-    registered_commands = ["start", "groups", "dont", "userstatus", "reload", "id",
+    registered_commands = ["start", "groups", "search", "dont", "userstatus", "reload", "id",
                            "hide", "unhide", "move", "unindex",
-                           "addadmin", "rmadmin", "listadmins",
+                           "addadmin", "rmadmin", "listadmins", "refreshstatus",
                            "restrict", "unrestrict"]
     private_specific_commands = ("addadmin", "rmadmin", "restrict", "unrestrict")
     group_specific_commands = ("reload",)
     group_admin_commands = ("reload",)
     bot_admin_commands = ("hide", "unhide", "move", "unindex", "restrict", "unrestrict")
-    bot_owner_commands = ("addadmin", "rmadmin", "listadmins")
+    bot_owner_commands = ("addadmin", "rmadmin", "listadmins", "refreshstatus")
     alias_commands = {"removeadmin": "rmadmin", "bangroup": "hide", "unbangroup": "unhide",
-                      "deindex": "unindex", "index": "move", "dontasktoask": "dont",
+                      "deindex": "unindex", "index": "move", "dontasktoask": "dont", "find": "search", "cerca": "search",
                       "setadmin": "addadmin", "unsetadmin": "rmadmin", "unadmin": "rmadmin"}
 
+    @classmethod
+    def format_duration(cls, seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+
+        if hours:
+            return f"{hours}h {minutes:02d}m {seconds:02d}s"
+
+        if minutes:
+            return f"{minutes}m {seconds:02d}s"
+
+        return f"{seconds}s"
+
     @classmethod
     async def commands_handler(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         bot_instance  = context.bot
@@ -79,12 +96,12 @@ class Commands:
                                  f'<a href="tg://user?id={user_id}">' + update.effective_user.first_name + '</a>') \
                         .replace("[command]", f'<code>/' + command_name + "</code>")
 
-                    keyboard = [
-                        [InlineKeyboardButton(text=locale.get_string("commands.command_not_found.contact_us_btn"),
-                                              url="tg://resolve?domain=" + GlobalVariables.contact_username)],
-                    ]
+                    keyboard = KeyboardBuilder()
 
-                    reply_markup = InlineKeyboardMarkup(keyboard)
+                    keyboard.add_button(locale.get_string("commands.command_not_found.contact_us_btn"),
+                                        url="tg://resolve?domain=" + GlobalVariables.contact_username)
+
+                    reply_markup = keyboard.build()
 
                     try:
                         new_message = await bot_instance.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
@@ -139,6 +156,9 @@ class Commands:
                     elif command_name == "groups":
                         text, reply_markup = Queries.explore_category(locale, DirectoryTable.CATEGORIES_ROOT_DIR_ID, user_data)
 
+                    elif command_name == "search":
+                        text, reply_markup = Queries.search_menu(locale, " ".join(command_args), user_data)
+
                     else:
                         if command_name in cls.group_specific_commands and query_message.chat.type == "private":
                             text = locale.get_string("commands.groups.group_specific_command") \
@@ -216,7 +236,7 @@ class Commands:
                                         target_user_id = int(command_args[0])
 
                                         try:
-                                            target_user = await bot_instance.get_chat(chat_id=target_user_id)
+                                            target_user = await TelegramLookups.get_chat(bot_instance, target_user_id)
 
                                         except:
                                             target_user = None
@@ -333,7 +353,7 @@ class Commands:
                                 old_chat_data, new_chat_data, is_new_chat_data = await ChatTable.fetch_chat(bot_instance, chat_id)
 
                                 if is_new_chat_data:
-                                    bot_member = await bot_instance.get_chat_member(chat_id, bot_instance.id)
+                                    bot_member = await TelegramLookups.get_chat_member(bot_instance, chat_id, bot_instance.id)
 
                                     text = locale.get_string("commands.reload.successful")
 
@@ -347,7 +367,7 @@ class Commands:
 
                                         if not bot_member.can_invite_users:
                                             try:
-                                                chat = await bot_instance.get_chat(chat_id)
+                                                chat = await TelegramLookups.get_chat(bot_instance, chat_id)
 
                                                 chat_permissions = chat.permissions
 
@@ -656,7 +676,7 @@ class Commands:
 
                                                             if updated:
                                                                 try:
-                                                                    target_user = await bot_instance.get_chat(chat_id=target_user_id)
+                                                                    target_user = await TelegramLookups.get_chat(bot_instance, target_user_id)
 
                                                                 except:
                                                                     target_user = None
@@ -721,7 +741,7 @@ class Commands:
                                     if records_dict:
                                         date_str, time_str, offset_str = Queries.get_current_italian_datetime()
 
-                                        text = locale.get_string("commands.admins.list.first_line")
+                                        admins_list = TextBuffer(locale.get_string("commands.admins.list.first_line"))
 
                                         for bot_admin_chat_id, bot_admin_data in records_dict.items():
                                             bot_admin_name = bot_admin_chat_id
@@ -729,7 +749,7 @@ class Commands:
                                             chat = None
 
                                             try:
-                                                chat = await bot_instance.get_chat(bot_admin_chat_id)
+                                                chat = await TelegramLookups.get_chat(bot_instance, bot_admin_chat_id)
                                                 chat: telegram.Chat
 
                                                 bot_admin_name = chat.full_name
@@ -737,17 +757,19 @@ class Commands:
                                             except Exception as ex:
                                                 pass
 
-                                            text += f'\n\n• <a href="tg://user?id={bot_admin_chat_id}">{bot_admin_name}</a>'
+                                            admins_list += f'\n\n• <a href="tg://user?id={bot_admin_chat_id}">{bot_admin_name}</a>'
 
                                             if chat and chat.username is not None:
-                                                text += f" (@{chat.username})"
+                                                admins_list += f" (@{chat.username})"
 
-                                            text += f" [<code>{bot_admin_chat_id}</code>]"
+                                            admins_list += f" [<code>{bot_admin_chat_id}</code>]"
 
-                                        text += "\n\n" + locale.get_string("commands.admins.list.generation_date_line") \
+                                        admins_list += "\n\n" + locale.get_string("commands.admins.list.generation_date_line") \
                                             .replace("[date]", date_str) \
                                             .replace("[time]", time_str) \
                                             .replace("[offset]", offset_str[1:3]) + "\n"
+
+                                        texts = admins_list.split()
                                     else:
                                         text = locale.get_string("commands.admins.list.empty")
 
@@ -756,6 +778,103 @@ class Commands:
 
                                     text = locale.get_string("commands.admins.database_error")
 
+                            elif command_name == "refreshstatus":
+                                text = locale.get_string("commands.refreshstatus.first_line")
+
+                                fetch_chats_status = ChatTable.fetch_chats_status
+
+                                percentage, eta = ChatTable.get_fetch_chats_progress()
+
+                                if fetch_chats_status["running"]:
+                                    text += "\n\n" + locale.get_string("commands.refreshstatus.full_refresh.running") \
+                                        .replace("[percentage]", f"{percentage:.1f}")
+
+                                    if eta is not None:
+                                        text += "\n" + locale.get_string("commands.refreshstatus.full_refresh.eta") \
+                                            .replace("[eta]", cls.format_duration(eta))
+
+                                elif fetch_chats_status["run_id"] is not None:
+                                    text += "\n\n" + locale.get_string("commands.refreshstatus.full_refresh.finished") \
+                                        .replace("[duration]", cls.format_duration(fetch_chats_status["finished_at"] - fetch_chats_status["started_at"]))
+
+                                else:
+                                    text += "\n\n" + locale.get_string("commands.refreshstatus.full_refresh.never_run")
+
+                                for key in ("run_id", "processed", "total", "changed", "failed"):
+                                    text = text.replace(f"[{key}]", str(fetch_chats_status[key]))
+
+                                if not fetch_chats_status["running"]:
+                                    fetch_chats_report = ChatTable.get_fetch_chats_report()
+
+                                    if fetch_chats_report:
+                                        api_calls = fetch_chats_report["api_calls"]
+
+                                        text += "\n\n" + locale.get_string("commands.refreshstatus.report") \
+                                            .replace("[age]", cls.format_duration(time.time() - fetch_chats_report["finished_at"])) \
+                                            .replace("[duration]", cls.format_duration(fetch_chats_report["duration"]))
+
+                                        text += "\n" + locale.get_string("commands.refreshstatus.report.api_calls") \
+                                            .replace("[api_calls_count]", str(sum(api_calls.values()))) \
+                                            .replace("[api_calls]", ", ".join(f"{method_name}: {count}" for method_name, count in api_calls.items())) \
+                                            .replace("[wait_time]", cls.format_duration(fetch_chats_report["wait_time"]))
+
+                                        for key in ("run_id", "processed", "total", "workers", "changed", "removed", "migrated", "failed", "retries"):
+                                            text = text.replace(f"[{key}]", str(fetch_chats_report[key]))
+
+                                stale_chats_refresh_status = ChatTable.stale_chats_refresh_status
+
+                                text += "\n\n" + locale.get_string("commands.refreshstatus.stale_refresh") \
+                                    .replace("[refreshed]", str(stale_chats_refresh_status["refreshed"])) \
+                                    .replace("[ticks]", str(stale_chats_refresh_status["ticks"])) \
+                                    .replace("[changed]", str(stale_chats_refresh_status["total_changed"])) \
+                                    .replace("[failed]", str(stale_chats_refresh_status["total_failed"]))
+
+                                api_rate_limiter_stats = ChatTable.api_rate_limiter.get_stats()
+
+                                text += "\n\n" + locale.get_string("commands.refreshstatus.api_rate") \
+                                    .replace("[rate]", f"{api_rate_limiter_stats['rate']:.1f}") \
+                                    .replace("[max_rate]", f"{api_rate_limiter_stats['max_rate']:.1f}") \
+                                    .replace("[retry_after_count]", str(api_rate_limiter_stats["retry_after_count"]))
+
+                                lookups_hits, lookups_misses = 0, 0
+
+                                for method_cache in TelegramLookups.caches.values():
+                                    lookups_hits += method_cache.hits
+                                    lookups_misses += method_cache.misses
+
+                                lookups_count = lookups_hits + lookups_misses
+
+                                text += "\n" + locale.get_string("commands.refreshstatus.lookups_cache") \
+                                    .replace("[hit_ratio]", f"{(100 * lookups_hits / lookups_count) if lookups_count else 0:.1f}") \
+                                    .replace("[hits]", str(lookups_hits)) \
+                                    .replace("[lookups]", str(lookups_count)) \
+                                    .replace("[coalesced]", str(TelegramLookups.coalesced_requests))
+
+                                registered_queries_stats = CallbackQueriesRegistry.get_stats()
+
+                                text += "\n" + locale.get_string("commands.refreshstatus.registered_queries") \
+                                    .replace("[size]", str(registered_queries_stats["size"])) \
+                                    .replace("[maxsize]", str(registered_queries_stats["maxsize"])) \
+                                    .replace("[evictions]", str(registered_queries_stats["evictions"])) \
+                                    .replace("[unsaved]", str(registered_queries_stats["unsaved"]))
+
+                                ack_latencies, edit_latencies = Queries.click_latencies["ack"], Queries.click_latencies["edit"]
+
+                                text += "\n" + locale.get_string("commands.refreshstatus.click_latencies") \
+                                    .replace("[acks]", str(ack_latencies["count"])) \
+                                    .replace("[ack_avg]", str(int(1000 * ack_latencies["total"] / ack_latencies["count"]) if ack_latencies["count"] else 0)) \
+                                    .replace("[ack_max]", str(int(1000 * ack_latencies["max"]))) \
+                                    .replace("[edits]", str(edit_latencies["count"])) \
+                                    .replace("[edit_avg]", str(int(1000 * edit_latencies["total"] / edit_latencies["count"]) if edit_latencies["count"] else 0)) \
+                                    .replace("[edit_max]", str(int(1000 * edit_latencies["max"])))
+
+                                date_str, time_str, offset_str = Queries.get_current_italian_datetime()
+
+                                text += "\n\n" + locale.get_string("commands.refreshstatus.generation_date_line") \
+                                    .replace("[date]", date_str) \
+                                    .replace("[time]", time_str) \
+                                    .replace("[offset]", offset_str[1:3])
+
                             elif command_name == "id":
                                 text = locale.get_string("commands.id").replace("[chat_id]", str(chat_id))
 
@@ -785,14 +904,11 @@ class Commands:
 
                     private_chat_priority = True
 
-            if reply_markup:
-                reply_markup = Queries.encode_queries(reply_markup)
-
-            if command_name in ("start", "groups"):
+            if command_name in ("start", "groups", "search"):
                 new_message, error_message = None, None
 
                 try:
-                    new_message = await bot_instance.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
+                    new_message = await ChunkedMessages.send(bot_instance, user_id, text, reply_markup)
 
                     if not is_user_data and query_message.chat.type != "private":
                         user_data, is_user_data = AccountTable.get_account_record(user_id, create_if_not_existing=True)
@@ -815,14 +931,8 @@ class Commands:
                                  f'<a href="tg://user?id={user_id}">' + update.effective_user.first_name + '</a>') \
                         .replace("[command]", f'/<a href="/{command}">' + command_name + "</a>")
 
-                    reply_markup = InlineKeyboardMarkup([
-                        [
-                            InlineKeyboardButton(
-                                text=locale.get_string("commands.groups.goto_bot_btn"),
-                                url=f'tg://resolve?domain=' + bot_username_lower
-                            )
-                        ]
-                    ])
+                    reply_markup = KeyboardBuilder().add_button(locale.get_string("commands.groups.goto_bot_btn"),
+                                                                url=f'tg://resolve?domain=' + bot_username_lower).build()
 
                     try:
                         new_message = await bot_instance.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
@@ -920,7 +1030,7 @@ class Commands:
 
                     if delete_answer is None:
                         delete_answer = new_message and (cooldown or command_name not in ("dont",)) and \
-                            (command_name not in ("hide", "unhide", "move", "addadmin", "rmadmin", "listadmins", "restrict", "unrestrict", "userstatus")
+                            (command_name not in ("hide", "unhide", "move", "addadmin", "rmadmin", "listadmins", "refreshstatus", "restrict", "unrestrict", "userstatus")
                              or invalid_request is True or update.effective_chat.type in ("group", "supergroup"))
 
                     if delete_answer:
@@ -933,7 +1043,7 @@ class Commands:
                         GlobalVariables.job_queue.run_once(callback=delete_message, when=delete_answer_delay)
 
             if not delete_query_message:
-                delete_query_message = (command_name in ("hide", "unhide", "move", "listadmins")
+                delete_query_message = (command_name in ("hide", "unhide", "move", "listadmins", "refreshstatus")
                      and update.effective_chat.type in ("group", "supergroup"))
 
             if delete_query_message:
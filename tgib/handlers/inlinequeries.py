@@ -0,0 +1,133 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+
+import html
+from uuid import uuid4
+
+import telegram.error
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent, InlineKeyboardMarkup, \
+    InlineKeyboardButton
+from telegram.ext import ContextTypes
+
+from tgib.data.caches import TTLCache
+from tgib.data.database import DirectoryTable
+from tgib.data.search import SearchIndex
+from tgib.handlers.queries import Queries
+from tgib.i18n.locales import Locale
+from tgib.logs import Logger
+
+
+class InlineQueries:
+    max_results = 20
+
+    # Results are the same for every user speaking the same language, so they are built once
+    # per (lang_code, normalized query) and then served from memory for results_cache_ttl seconds
+    results_cache_ttl = 60
+
+    results_cache = TTLCache(maxsize=2048, ttl=results_cache_ttl)
+
+    # Seconds Telegram may serve the answer to the same user typing the same query again
+    # without asking the bot (answers are personal as their text is localized)
+    answer_cache_time = 120
+
+    @classmethod
+    def get_results(cls, locale: Locale, normalized_query: str, bot_username: str) -> list:
+        results = []
+
+        lang_code = locale.lang_code
+
+        for (_, chat_id), chat_data in Queries.search_chats(normalized_query, False, cls.max_results):
+            if chat_data["custom_title"]:
+                chat_title = chat_data["custom_title"]
+            else:
+                chat_title = chat_data["title"]
+
+            if chat_data["custom_link"]:
+                chat_join_url = chat_data["custom_link"]
+            else:
+                chat_join_url = chat_data["invite_link"]
+
+            full_category_name = DirectoryTable.get_full_category_name(lang_code, chat_data["directory_id"])
+
+            # Titles and category names are sent as HTML, where a single unescaped '<' or '&' would make
+            # Telegram reject the whole answer
+            message_text = f"👥 <b>{html.escape(chat_title)}</b>"
+
+            if full_category_name:
+                message_text += f"\n📂 <i>{html.escape(full_category_name)}</i>"
+
+            results.append(InlineQueryResultArticle(
+                id=str(chat_id),
+                title=chat_title,
+                description=full_category_name if full_category_name else None,
+                input_message_content=InputTextMessageContent(message_text),
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton(
+                        text=locale.get_string("inline.join_btn"),
+                        url=chat_join_url
+                    )]
+                ])
+            ))
+
+        if not results:
+            results.append(InlineQueryResultArticle(
+                id=uuid4().hex,
+                title=locale.get_string("inline.no_results.title"),
+                description=locale.get_string("inline.no_results.description"),
+                input_message_content=InputTextMessageContent(
+                    locale.get_string("inline.no_results.message").replace("[bot_username]", bot_username)
+                )
+            ))
+
+        return results
+
+    @classmethod
+    async def inline_queries_handler(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        inline_query = update.inline_query
+
+        if not inline_query:
+            return None
+
+        normalized_query = SearchIndex.normalize(inline_query.query)
+
+        if not normalized_query:
+            results = []
+
+        else:
+            locale = Locale(inline_query.from_user.language_code)
+
+            cache_key = (locale.lang_code, normalized_query)
+
+            results = cls.results_cache.get(cache_key)
+
+            if results is None:
+                results = cls.get_results(locale, normalized_query, context.bot.username)
+
+                cls.results_cache.set(cache_key, results)
+
+        try:
+            await inline_query.answer(results, cache_time=cls.answer_cache_time, is_personal=True)
+
+        except telegram.error.BadRequest as ex:
+            # Under heavy load the answer may arrive after Telegram stopped waiting for
+            # it (or after the user typed something else), in which case it's just dropped
+
+            Logger.log("debug", "InlineQueries.inline_queries_handler",
+                       f"Couldn't answer inline query '{inline_query.query}'", ex)
@@ -17,13 +17,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
 
-from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, Bot
 from telegram.ext import CallbackContext
 
 from tgib.data.database import AccountTable, DirectoryTable, SessionTable
 from tgib.handlers.queries import Queries
 from tgib.i18n.locales import Locale
 from tgib.logs import Logger
+from tgib.ui.callbacks import KeyboardBuilder
 from tgib.ui.menus import Menus
 
 
@@ -80,16 +81,14 @@ class Messages:
 
             new_message_text = None
 
-            new_keyboard = []
+            new_keyboard = KeyboardBuilder()
 
             editing = ("id" in Queries.user_input_subdirectories_data[chat_id])
 
             if not editing:
-                back_callback_data = f"cd{Queries.fd}" + str(adding_categories_data["parent_id"])
+                back_query = ("cd", adding_categories_data["parent_id"])
             else:
-                back_callback_data = f"manage_directory{Queries.fd}" + str(adding_categories_data["id"])
-
-            Queries.register_query(back_callback_data)
+                back_query = ("manage_directory", adding_categories_data["id"])
 
             updated = False
 
@@ -106,20 +105,10 @@ class Messages:
                         .replace(f"[current_value]", adding_categories_data[f"old_{key_name}"])
 
                 if not editing:
-                    new_keyboard.append([
-                        InlineKeyboardButton(
-                            text=locale.get_string("create_subdirectory.undo_btn"),
-                            callback_data=back_callback_data
-                        )
-                    ])
+                    new_keyboard.add_button(locale.get_string("create_subdirectory.undo_btn"), *back_query)
 
                 else:
-                    new_keyboard.append([
-                        InlineKeyboardButton(
-                            text=locale.get_string("edit_directory_names.undo_btn"),
-                            callback_data=back_callback_data
-                        )
-                    ])
+                    new_keyboard.add_button(locale.get_string("edit_directory_names.undo_btn"), *back_query)
 
             else:
                 no_changes_made = False
@@ -196,15 +185,10 @@ class Messages:
 
                             new_message_text += f"\n\n{parent_directory_name_symbol} {parent_directory_name} [<code>{parent_directory_id}</code>]"
 
-                    new_keyboard = []
+                    new_keyboard = KeyboardBuilder()
 
                     if not editing:
-                        new_keyboard.append([
-                            InlineKeyboardButton(
-                                text=locale.get_string("create_subdirectory.successful_menu.back_btn"),
-                                callback_data=back_callback_data
-                            )
-                        ])
+                        new_keyboard.add_button(locale.get_string("create_subdirectory.successful_menu.back_btn"), *back_query)
 
                         await Logger.log_directory_action(
                             action="create directory",
@@ -217,12 +201,7 @@ class Messages:
                         )
 
                     else:
-                        new_keyboard.append([
-                            InlineKeyboardButton(
-                                text=locale.get_string("edit_directory_names.successful_menu.back_btn"),
-                                callback_data=back_callback_data
-                            )
-                        ])
+                        new_keyboard.add_button(locale.get_string("edit_directory_names.successful_menu.back_btn"), *back_query)
 
                         if not no_changes_made:
                             await Logger.log_directory_action(
@@ -241,7 +220,7 @@ class Messages:
 
                     Queries.user_input_subdirectories_data.pop(chat_id)
 
-            new_reply_markup = InlineKeyboardMarkup(new_keyboard)
+            new_reply_markup = new_keyboard.build()
 
         else:
             new_message_text, new_reply_markup = Menus.get_error_menu(locale, "unauthorized")
@@ -252,13 +231,15 @@ class Messages:
 
         bot_instance: Bot = context.bot
 
-        new_reply_markup = Queries.encode_queries(new_reply_markup)
-
         new_message_id = SessionTable.get_active_session_menu_message_id(chat_id)
 
         try:
             await bot_instance.edit_message_text(text=new_message_text, chat_id=chat_id, message_id=new_message_id, reply_markup=new_reply_markup)
 
+            SessionTable.refresh_session(chat_id, new_message_id)
+
+            SessionTable.set_rendered_menu(chat_id, new_message_id, new_message_text, new_reply_markup)
+
         except Exception:
             try:
                 new_message = await bot_instance.send_message(chat_id=chat_id, text=new_message_text, reply_markup=new_reply_markup)
@@ -270,6 +251,8 @@ class Messages:
                 else:
                     SessionTable.add_session(chat_id, new_message_id)
 
+                SessionTable.set_rendered_menu(chat_id, new_message_id, new_message_text, new_reply_markup)
+
             except Exception as ex:
                 Logger.log("exception", "Messages.text_messages",
                            f"An exception occurred while sending message to '{chat_id}'", ex)
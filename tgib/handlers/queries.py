@@ -17,97 +17,134 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
 
-import hashlib
+import html
 from datetime import datetime
+from time import monotonic
+from typing import Awaitable
 
 import pytz
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember, Bot, ChatMemberAdministrator, ChatMemberOwner, User
+from telegram import Update, InlineKeyboardMarkup, ChatMember, Bot, ChatMemberAdministrator, ChatMemberOwner, User, \
+    CallbackQuery
 from telegram.ext import CallbackContext, ContextTypes
 
-from tgib.data.database import DirectoryTable, AccountTable, ChatTable, SessionTable
+from tgib.data.caches import TTLCache
+from tgib.data.database import DirectoryTable, AccountTable, ChatTable, SessionTable, CallbackQueryTable
+from tgib.data.lookups import TelegramLookups
+from tgib.data.search import SearchIndex
 from tgib.i18n.locales import Locale
 from tgib.global_vars import GlobalVariables
 from tgib.logs import Logger
+from tgib.ui.callbacks import CallbackDataCodec, CallbackQueriesRegistry, KeyboardBuilder
 from tgib.ui.menus import Menus
+from tgib.ui.texts import TextBuffer, ChunkedMessages
 
 
 class Queries:
-    fixed_queries = [
-        "refresh_session",
-        "explore_categories",
-        "main_menu",
-        "add_group_menu",
-        "about_menu",
-        "wip_alert",
-        "expired_session_about_alert"
-    ]
+    save_registered_queries_interval = 60
+
+    fd = CallbackQueriesRegistry.fd
+
+    # Handler, account permission required (if any) and arguments of each query action
+    query_routes = {
+        "refresh_session": ("main_menu_query", None, ()),
+        "main_menu": ("main_menu_query", None, ()),
+        "add_group_menu": ("add_group_menu_query", "can_add_groups", ()),
+        "about_menu": ("about_menu_query", None, ()),
+        "wip_alert": ("alert_query", None, ()),
+        "expired_session_about_alert": ("alert_query", None, ()),
+        "explore_categories": ("explore_categories_query", "can_view_groups", ()),
+        "cd": ("cd_query", "can_view_groups", ("directory_id",)),
+        "manage_directory": ("directory_query", "is_admin", ("directory_id",)),
+        "hide_directory": ("directory_query", "is_admin", ("directory_id",)),
+        "unhide_directory": ("directory_query", "is_admin", ("directory_id",)),
+        "delete_directory": ("directory_query", "is_admin", ("directory_id",)),
+        "delete_directory_confirm_menu": ("directory_query", "is_admin", ("directory_id",)),
+        "delete_root_directory": ("directory_query", "is_admin", ("directory_id",)),
+        "delete_nonempty_directory": ("directory_query", "is_admin", ("directory_id",)),
+        "index_group_in": ("index_group_in_query", None, ("directory_id", "offset", "anchor_chat_id")),
+        "create_subdirectory_in": ("create_subdirectory_in_query", "is_admin", ("parent_directory_id",)),
+        "edit_directory_names": ("edit_directory_names_query", "is_admin", ("directory_id",)),
+        "missing_permissions_menu": ("chat_query", "can_add_groups", ("chat_id", "directory_id", "offset", "anchor_chat_id")),
+        "hidden_chat_menu": ("chat_query", "can_add_groups", ("chat_id", "directory_id", "offset", "anchor_chat_id")),
+        "index_confirm_menu": ("chat_query", None, ("chat_id", "directory_id", "offset", "anchor_chat_id")),
+        "index": ("chat_query", None, ("chat_id", "directory_id", "offset", "anchor_chat_id")),
+        "unindex_confirm_menu": ("chat_query", None, ("chat_id", "directory_id", "offset", "anchor_chat_id")),
+        "unindex": ("chat_query", None, ("chat_id", "directory_id", "offset", "anchor_chat_id"))
+    }
+
+    command_permissions = {"/groups": "can_view_groups", "/search": "can_view_groups", "/reload": "can_modify_groups"}
+
+    # Repeated clicks (same user, message and button) received while the previous one is still being handled
+    # or within duplicate_clicks_window seconds from it are only answered, without being handled again
+    duplicate_clicks_window = 2
+
+    # Last click received from each user, as a dict with the id, the message id and the data of its query,
+    # when it was received, when it was last repeated or handled and whether it has been handled yet
+    last_clicks = TTLCache(maxsize=10000, ttl=60)
+
+    # Seconds from the reception of the clicks to their acknowledgement and to the edit of their menus
+    # (number of clicks measured, total and maximum), shown by /refreshstatus
+    click_latencies = {"ack": {"count": 0, "total": 0.0, "max": 0.0}, "edit": {"count": 0, "total": 0.0, "max": 0.0}}
+
+    # Keyed by user id, like the other per-user state of the handlers, which ChatOrderedUpdateProcessor
+    # never lets two updates of the same user touch at once (jobs must not modify it). Directories
+    # creations and renamings abandoned for user_input_ttl seconds are dropped
+    user_input_ttl = 60 * 60
+
+    user_input_subdirectories_data = TTLCache(maxsize=1000, ttl=user_input_ttl)
 
-    registered_queries = {}
-    registered_hashes  = {}
+    @classmethod
+    def decode_query_data(cls, hashed_query_data: str) -> str:
+        query_data = CallbackQueriesRegistry.get_query_data(hashed_query_data)
 
-    fd = "  "
+        if query_data is None and CallbackQueriesRegistry.persist_registered_queries:
+            query_data = CallbackQueryTable.get_query_data(hashed_query_data)
 
-    user_input_subdirectories_data: dict = {}
+            if query_data is not None:
+                CallbackQueriesRegistry.registered_hashes.set(hashed_query_data, query_data)
+
+        if query_data is not None:
+            return query_data
+        else:
+            return "unrecognized query"
 
     @classmethod
-    def register_query(cls, query_data: str) -> None:
-        def md5sum(data: str) -> str:
-            m = hashlib.md5()
-            m.update(data.encode())
-            return m.hexdigest()
+    def parse_query_data(cls, hashed_query_data: str) -> (str, list):
+        if hashed_query_data.startswith(CallbackDataCodec.prefix):
+            unpacked_query_data = CallbackDataCodec.decode(hashed_query_data)
 
-        hashed_query_data = md5sum(query_data)
+            return unpacked_query_data if unpacked_query_data is not None else ("unrecognized query", [])
 
-        cls.registered_hashes[hashed_query_data] = query_data
-        cls.registered_queries[query_data] = hashed_query_data
+        action, *args = cls.decode_query_data(hashed_query_data).split(cls.fd)
 
-    @classmethod
-    def register_fixed_queries(cls) -> None:
-        for query_data in cls.fixed_queries:
-            cls.register_query(query_data)
+        try:
+            return action, [int(arg) for arg in args]
 
-    @classmethod
-    def encode_query_data(cls, query_data: str) -> str:
-        if query_data in cls.registered_queries:
-            return cls.registered_queries[query_data]
-        else:
-            return "unregistered query"
+        except ValueError:
+            return "unrecognized query", []
 
     @classmethod
-    def decode_query_data(cls, hashed_query_data: str) -> str:
-        if hashed_query_data in cls.registered_hashes:
-            return cls.registered_hashes[hashed_query_data]
-        else:
-            return "unrecognized query"
+    async def save_registered_queries(cls, context: ContextTypes.DEFAULT_TYPE) -> None:
+        CallbackQueriesRegistry.registered_hashes.expire()
 
-    @classmethod
-    def encode_queries(cls, inline_keyboard_markup) -> InlineKeyboardMarkup:
-        encoded_inline_keyboard = []
-
-        for row in inline_keyboard_markup.inline_keyboard:
-            encoded_inline_keyboard_row = []
-
-            for button in row:
-                if isinstance(button, InlineKeyboardButton):
-                    if button.callback_data:
-                        encoded_inline_keyboard_row.append(
-                            InlineKeyboardButton(
-                                text=button.text,
-                                callback_data=cls.encode_query_data(button.callback_data)
-                            )
-                        )
-                    else:
-                        encoded_inline_keyboard_row.append(button)
+        if not CallbackQueriesRegistry.persist_registered_queries:
+            return
+
+        if CallbackQueriesRegistry.unsaved_hashes:
+            unsaved_hashes = CallbackQueriesRegistry.unsaved_hashes
 
-            if encoded_inline_keyboard_row:
-                encoded_inline_keyboard.append(encoded_inline_keyboard_row)
+            CallbackQueriesRegistry.unsaved_hashes = {}
 
-        return InlineKeyboardMarkup(encoded_inline_keyboard)
+            if not CallbackQueryTable.save_queries(unsaved_hashes):
+                for hashed_query_data, query_data in unsaved_hashes.items():
+                    CallbackQueriesRegistry.unsaved_hashes.setdefault(hashed_query_data, query_data)
+
+        CallbackQueryTable.delete_old_queries(CallbackQueriesRegistry.registered_queries_ttl)
 
     @classmethod
     async def is_chat_admin(cls, bot, chat_id, user_id) -> (bool | None):
         try:
-            chat_member = await bot.get_chat_member(chat_id, user_id)
+            chat_member = await TelegramLookups.get_chat_member(bot, chat_id, user_id)
             return chat_member.status in (ChatMember.OWNER, ChatMember.ADMINISTRATOR)
         except Exception:
             return None
@@ -124,40 +161,32 @@ class Queries:
 
     @classmethod
     def user_can_perform_action(cls, user_data: dict, action: str):
-        is_admin          = user_data["is_admin"]
-        can_view_groups   = user_data["can_view_groups"]
-        can_add_groups    = user_data["can_add_groups"]
-        can_modify_groups = user_data["can_modify_groups"]
+        # N.B.: checking for bot admin permissions for bot admin commands
+        #       is handled by Commands.commands_handler itself
 
-        if not can_view_groups and action in ("explore_categories", "/groups", "cd"):
-            return False
+        if action in cls.command_permissions:
+            required_permission = cls.command_permissions[action]
 
-        elif not can_add_groups and (action in ("add_group_menu",)
-                                     or action.startswith("hidden_chat_menu")
-                                     or action.startswith("missing_permissions_menu")):
-            return False
+        elif action in cls.query_routes:
+            _, required_permission, _ = cls.query_routes[action]
 
-        elif not can_modify_groups and (action in ("/reload",)):
-            return False
+        else:
+            required_permission = None
 
-        # N.B.: checking for bot admin permissions for bot admin commands
-        #       is handled by Commands.commands_handler itself
+        return required_permission is None or bool(user_data[required_permission])
 
-        elif not is_admin:
-            admin_required_queries = (
-                "create_subdirectory_in", "edit_directory_names",
-                "manage_directory", "hide_directory", "unhide_directory",
-                "delete_directory", "delete_root_directory", "delete_nonempty_directory"
-            )
+    @classmethod
+    def user_can_access_directory(cls, user_data: dict, directory_id: int) -> bool:
+        # Directory ids come from the callback data, so they're checked against the ones the user can browse
+        directory_data, is_directory_data = DirectoryTable.get_directory_data(directory_id)
 
-            for admin_required_query in admin_required_queries:
-                if action.startswith(admin_required_query):
-                    return False
+        if not is_directory_data:
+            return False
 
-        return True
+        return bool(user_data["is_admin"]) or DirectoryTable.is_directory_visible(directory_id)
 
     @classmethod
-    async def hidden_chat_menu(cls, locale: Locale, chat_id: int, directory_id: int, offset: int) -> (str, InlineKeyboardMarkup):
+    async def hidden_chat_menu(cls, locale: Locale, chat_id: int, directory_id: int, offset: int, anchor_chat_id: int = 0) -> (str, InlineKeyboardMarkup):
         chat_data, is_chat_data = ChatTable.get_chat_data(chat_id)
 
         if is_chat_data:
@@ -172,29 +201,23 @@ class Queries:
         else:
             return Menus.get_error_menu(locale, "database")
 
-        back_button_callback_data = f"index_group_in{cls.fd}{directory_id}{cls.fd}{offset}"
-        Queries.register_query(back_button_callback_data)
+        keyboard = KeyboardBuilder()
 
-        keyboard = [
-            [InlineKeyboardButton(
-                text=locale.get_string("missing_permissions_menu.contact_us_btn"),
-                url="tg://resolve?domain=" + GlobalVariables.contact_username
-            )],
+        keyboard.add_button(locale.get_string("missing_permissions_menu.contact_us_btn"),
+                            url="tg://resolve?domain=" + GlobalVariables.contact_username)
 
-            [InlineKeyboardButton(
-                text=locale.get_string("missing_permissions_menu.back_btn"),
-                callback_data=back_button_callback_data
-            )]
-        ]
+        keyboard.add_button(locale.get_string("missing_permissions_menu.back_btn"),
+                            "index_group_in", directory_id, offset, anchor_chat_id)
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
-    async def missing_permissions_menu(cls, locale: Locale, bot: Bot, chat_id: int, directory_id: int, offset: int) -> (str, InlineKeyboardMarkup):
+    async def missing_permissions_menu(cls, locale: Locale, bot: Bot, chat_id: int, directory_id: int, offset: int, anchor_chat_id: int = 0) -> (str, InlineKeyboardMarkup):
         try:
-            chat = await bot.get_chat(chat_id)
+            chat = await TelegramLookups.get_chat(bot, chat_id)
 
-            bot_member = await bot.get_chat_member(chat_id, bot.id)
+            # The bot's own permissions are what the user may have just fixed, so they're always looked up again
+            bot_member = await TelegramLookups.get_chat_member(bot, chat_id, bot.id, fresh=True)
 
             text = locale.get_string("missing_permissions_menu.text").replace("[title]", chat.title)
 
@@ -232,137 +255,99 @@ class Queries:
         except Exception:
             text = locale.get_string("missing_permissions_menu.cant_get_group_info")
 
-        back_button_callback_data = f"index_group_in{cls.fd}{directory_id}{cls.fd}{offset}"
-        Queries.register_query(back_button_callback_data)
+        keyboard = KeyboardBuilder()
 
-        keyboard = [
-            [InlineKeyboardButton(
-                text=locale.get_string("missing_permissions_menu.contact_us_btn"),
-                url="tg://resolve?domain=" + GlobalVariables.contact_username
-            )],
+        keyboard.add_button(locale.get_string("missing_permissions_menu.contact_us_btn"),
+                            url="tg://resolve?domain=" + GlobalVariables.contact_username)
 
-            [InlineKeyboardButton(
-                text=locale.get_string("missing_permissions_menu.back_btn"),
-                callback_data=back_button_callback_data
-            )]
-        ]
+        keyboard.add_button(locale.get_string("missing_permissions_menu.back_btn"),
+                            "index_group_in", directory_id, offset, anchor_chat_id)
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
-    def index_group_in_directory_menu(cls, locale: Locale, directory_id: int, offset: int, user_data: dict) -> (str, InlineKeyboardMarkup):
+    def index_group_in_directory_menu(cls, locale: Locale, directory_id: int, offset: int, anchor_chat_id: int, user_data: dict) -> (str, InlineKeyboardMarkup):
         chats_per_page = 8
 
         user_id = user_data["chat_id"]
 
-        number_of_chats_user_is_admin_of, is_number_of_chats_user_is_admin_of = ChatTable.get_total_chats_user_is_admin_of(user_id)
-
-        if is_number_of_chats_user_is_admin_of:
-            chats_user_is_admin_of, is_chats_user_is_admin_of = ChatTable.get_chats_user_is_admin_of(user_id, offset, chats_per_page)
-            chats_user_is_admin_of: dict
+        chats_user_is_admin_of, previous_anchor_chat_id, next_anchor_chat_id, is_chats_user_is_admin_of = \
+            ChatTable.get_chats_user_is_admin_of(user_id, anchor_chat_id, chats_per_page)
+        chats_user_is_admin_of: dict
 
-            if is_chats_user_is_admin_of:
-                text = locale.get_string("index_group_menu.text")
+        if is_chats_user_is_admin_of:
+            text = locale.get_string("index_group_menu.text")
 
-                keyboard = []
+            keyboard = KeyboardBuilder()
 
-                pages_keyboard = []
+            pages_keyboard = []
 
-                pn = offset + 1
+            pn = offset + 1
 
-                if offset > 0:
-                    previous_page_callback_data = f"index_group_in{cls.fd}{directory_id}{cls.fd}{offset-1}"
-                    Queries.register_query(previous_page_callback_data)
-
-                    pages_keyboard.append(
-                        InlineKeyboardButton(
-                            text="⬅️ " + locale.get_string("index_group_menu.page_btn").replace("[n]", str(pn - 1)),
-                            callback_data=previous_page_callback_data
-                        )
-                    )
-
-                if number_of_chats_user_is_admin_of > (pn * chats_per_page):
-                    next_page_callback_data = f"index_group_in{cls.fd}{directory_id}{cls.fd}{offset+1}"
-                    Queries.register_query(next_page_callback_data)
-
-                    pages_keyboard.append(
-                        InlineKeyboardButton(
-                            text=locale.get_string("index_group_menu.page_btn").replace("[n]", str(pn + 1)) + " ➡️",
-                            callback_data=next_page_callback_data
-                        )
-                    )
+            if previous_anchor_chat_id is not None:
+                pages_keyboard.append(
+                    KeyboardBuilder.button("⬅️ " + locale.get_string("index_group_menu.page_btn").replace("[n]", str(max(pn - 1, 1))),
+                                           "index_group_in", directory_id, max(offset - 1, 0), previous_anchor_chat_id)
+                )
 
-                if pages_keyboard:
-                    keyboard.append(pages_keyboard)
+            if next_anchor_chat_id is not None:
+                pages_keyboard.append(
+                    KeyboardBuilder.button(locale.get_string("index_group_menu.page_btn").replace("[n]", str(pn + 1)) + " ➡️",
+                                           "index_group_in", directory_id, offset + 1, next_anchor_chat_id)
+                )
 
-                if len(chats_user_is_admin_of) > 0:
-                    for curr_chat_id, curr_chat_data in chats_user_is_admin_of.items():
-                        curr_chat_btn_text = curr_chat_data["title"]
+            keyboard.add_row(*pages_keyboard)
 
-                        if curr_chat_data["hidden_by"] is not None:
-                            curr_chat_btn_text += " 🚫"
+            if len(chats_user_is_admin_of) > 0:
+                # Sub-menus return to the page starting from its current first chat
+                anchor_chat_id = next(iter(chats_user_is_admin_of))
 
-                            curr_chat_callback_data = f"hidden_chat_menu{cls.fd}{curr_chat_id}{cls.fd}{directory_id}{cls.fd}{offset}"
+                for curr_chat_id, curr_chat_data in chats_user_is_admin_of.items():
+                    curr_chat_btn_text = curr_chat_data["title"]
 
-                        elif curr_chat_data["missing_permissions"] is True:
-                            curr_chat_btn_text += " ⛔️"
+                    if curr_chat_data["hidden_by"] is not None:
+                        curr_chat_btn_text += " 🚫"
 
-                            curr_chat_callback_data = f"missing_permissions_menu{cls.fd}{curr_chat_id}{cls.fd}{directory_id}{cls.fd}{offset}"
+                        curr_chat_action = "hidden_chat_menu"
 
-                        elif curr_chat_data["directory_id"] == directory_id:
-                            curr_chat_btn_text += " ☑️"
+                    elif curr_chat_data["missing_permissions"] is True:
+                        curr_chat_btn_text += " ⛔️"
 
-                            curr_chat_callback_data = f"unindex_confirm_menu{cls.fd}{curr_chat_id}{cls.fd}{directory_id}{cls.fd}{offset}"
+                        curr_chat_action = "missing_permissions_menu"
 
-                        else:
-                            curr_chat_callback_data = f"index_confirm_menu{cls.fd}{curr_chat_id}{cls.fd}{directory_id}{cls.fd}{offset}"
+                    elif curr_chat_data["directory_id"] == directory_id:
+                        curr_chat_btn_text += " ☑️"
 
-                        Queries.register_query(curr_chat_callback_data)
+                        curr_chat_action = "unindex_confirm_menu"
 
-                        keyboard.append(
-                            [InlineKeyboardButton(text=curr_chat_btn_text,
-                                                  callback_data=curr_chat_callback_data)]
-                        )
+                    else:
+                        curr_chat_action = "index_confirm_menu"
 
-                    date_str, time_str, offset_str = cls.get_current_italian_datetime()
+                    keyboard.add_button(curr_chat_btn_text, curr_chat_action, curr_chat_id, directory_id, offset, anchor_chat_id)
 
-                    text += "\n\n" + locale.get_string("index_group_menu.generation_date_line") \
-                        .replace("[date]", date_str) \
-                        .replace("[time]", time_str) \
-                        .replace("[offset]", offset_str[1:3]) + "\n"
-                else:
-                    text += "\n\n" + locale.get_string("index_group_menu.no_groups_available")
+                date_str, time_str, offset_str = cls.get_current_italian_datetime()
 
+                text += "\n\n" + locale.get_string("index_group_menu.generation_date_line") \
+                    .replace("[date]", date_str) \
+                    .replace("[time]", time_str) \
+                    .replace("[offset]", offset_str[1:3]) + "\n"
+            else:
+                text += "\n\n" + locale.get_string("index_group_menu.no_groups_available")
 
-                back_button_callback_data = f"cd{cls.fd}{directory_id}"
-                Queries.register_query(back_button_callback_data)
 
-                keyboard += [
-                    [InlineKeyboardButton(
-                        text=locale.get_string("index_group_menu.refresh_btn"),
-                        callback_data=f"index_group_in{cls.fd}{directory_id}{cls.fd}{offset}")
-                    ],
+            keyboard.add_button(locale.get_string("index_group_menu.refresh_btn"),
+                                "index_group_in", directory_id, offset, anchor_chat_id)
 
-                    [InlineKeyboardButton(
-                        text=locale.get_string("index_group_menu.add_bot_to_group_btn"),
-                        url="https://t.me/" + GlobalVariables.bot_instance.username + "?startgroup=start")
-                    ],
+            keyboard.add_button(locale.get_string("index_group_menu.add_bot_to_group_btn"),
+                                url="https://t.me/" + GlobalVariables.bot_instance.username + "?startgroup=start")
 
-                    [InlineKeyboardButton(
-                        text=locale.get_string("index_group_menu.contact_us_btn"),
-                        url="tg://resolve?domain=" + GlobalVariables.contact_username
-                    )],
+            keyboard.add_button(locale.get_string("index_group_menu.contact_us_btn"),
+                                url="tg://resolve?domain=" + GlobalVariables.contact_username)
 
-                    [InlineKeyboardButton(
-                        text=locale.get_string("index_group_menu.back_btn"),
-                        callback_data=back_button_callback_data
-                    )]
-                ]
+            keyboard.add_button(locale.get_string("index_group_menu.back_btn"), "cd", directory_id)
 
-                return text, InlineKeyboardMarkup(keyboard)
+            return text, keyboard.build()
 
-            else:
-                return Menus.get_error_menu(locale, "database")
         else:
             return Menus.get_error_menu(locale, "database")
 
@@ -372,20 +357,13 @@ class Queries:
 
         text = locale.get_string("create_subdirectory.ask_for_i18n_en_name")
 
-        back_callback_data = f"cd{cls.fd}" + str(input_subdirectory_data["parent_id"])
+        keyboard = KeyboardBuilder()
 
-        Queries.register_query(back_callback_data)
-
-        keyboard = [[
-            InlineKeyboardButton(
-                text=locale.get_string("create_subdirectory.undo_btn"),
-                callback_data=back_callback_data
-            )
-        ]]
+        keyboard.add_button(locale.get_string("create_subdirectory.undo_btn"), "cd", input_subdirectory_data["parent_id"])
 
         cls.user_input_subdirectories_data[chat_id] = input_subdirectory_data
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
     def edit_directory_names_menu(cls, locale: Locale, chat_id: int, directory_id: int):
@@ -410,21 +388,14 @@ class Queries:
         else:
             text = locale.get_string("edit_directory_names.cant_get_directory_info")
 
-        back_callback_data = f"cd{cls.fd}" + str(input_subdirectory_data["parent_id"])
-
-        Queries.register_query(back_callback_data)
+        keyboard = KeyboardBuilder()
 
-        keyboard = [[
-            InlineKeyboardButton(
-                text=locale.get_string("edit_directory_names.undo_btn"),
-                callback_data=back_callback_data
-            )
-        ]]
+        keyboard.add_button(locale.get_string("edit_directory_names.undo_btn"), "cd", input_subdirectory_data["parent_id"])
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
-    async def index_group_menu(cls, locale: Locale, bot: Bot, user: User, chat_id: int, new_directory_id: int = None, offset: int = 0, requires_confirmation: bool = True, unindex_directory_id: int = None, user_can_add_groups: bool = True, user_can_modify_groups: bool = True) -> (str, InlineKeyboardMarkup):
+    async def index_group_menu(cls, locale: Locale, bot: Bot, user: User, chat_id: int, new_directory_id: int = None, offset: int = 0, anchor_chat_id: int = 0, requires_confirmation: bool = True, unindex_directory_id: int = None, user_can_add_groups: bool = True, user_can_modify_groups: bool = True) -> (str, InlineKeyboardMarkup):
         user_id = user.id
 
         if new_directory_id is None and unindex_directory_id is None:
@@ -437,12 +408,12 @@ class Queries:
 
         text = ""
 
-        keyboard = []
+        keyboard = KeyboardBuilder()
 
         undo_btn = False
 
         try:
-            chat_member = await bot.get_chat_member(chat_id, user_id)
+            chat_member = await TelegramLookups.get_chat_member(bot, chat_id, user_id)
 
             if chat_member.status in (ChatMember.OWNER, ChatMember.ADMINISTRATOR):
                 chat_member: ChatMemberOwner
@@ -480,22 +451,22 @@ class Queries:
                                 valid_request = False
 
                         if chat_data["hidden_by"] is not None:
-                            return await cls.hidden_chat_menu(locale, chat_id, back_directory_id, offset)
+                            return await cls.hidden_chat_menu(locale, chat_id, back_directory_id, offset, anchor_chat_id)
 
                         if valid_request:
                             if old_directory_id is None or old_directory_id != new_directory_id:
                                 if requires_confirmation:
-                                    chat = await bot.get_chat(chat_id)
+                                    chat = await TelegramLookups.get_chat(bot, chat_id)
 
                                     if new_directory_id is not None:
                                         text = locale.get_string("index_group_confirm_menu.text")
 
-                                        confirm_button_callback_data = f"index{cls.fd}{chat_id}{cls.fd}{new_directory_id}{cls.fd}{offset}"
+                                        confirm_button_query = ("index", chat_id, new_directory_id, offset, anchor_chat_id)
 
                                     else:
                                         text = locale.get_string("unindex_group_confirm_menu.text")
 
-                                        confirm_button_callback_data = f"unindex{cls.fd}{chat_id}{cls.fd}{unindex_directory_id}{cls.fd}{offset}"
+                                        confirm_button_query = ("unindex", chat_id, unindex_directory_id, offset, anchor_chat_id)
 
                                     text = text.replace("[title]", chat.title).replace("[category]", str(full_category_name))
 
@@ -508,14 +479,7 @@ class Queries:
                                     if chat_member.status != ChatMember.OWNER:
                                         text += "\n\n" + locale.get_string("index_group_confirm_menu.owner_will_be_alerted")
 
-                                    Queries.register_query(confirm_button_callback_data)
-
-                                    keyboard.append(
-                                        [InlineKeyboardButton(
-                                            text=locale.get_string("index_group_confirm_menu.confirm_btn"),
-                                            callback_data=confirm_button_callback_data
-                                        )]
-                                    )
+                                    keyboard.add_button(locale.get_string("index_group_confirm_menu.confirm_btn"), *confirm_button_query)
 
                                     undo_btn = True
 
@@ -626,26 +590,14 @@ class Queries:
 
             text = locale.get_string("index_group.error.cant_get_group_info")
 
-        back_button_callback_data = f"index_group_in{cls.fd}{back_directory_id}{cls.fd}{offset}"
-        Queries.register_query(back_button_callback_data)
-
         if undo_btn:
-            keyboard.append(
-                [InlineKeyboardButton(
-                    text=locale.get_string("index_group_confirm_menu.undo_btn"),
-                    callback_data=back_button_callback_data
-                )]
-            )
-
+            back_btn_text = locale.get_string("index_group_confirm_menu.undo_btn")
         else:
-            keyboard.append(
-                [InlineKeyboardButton(
-                    text=locale.get_string("index_group_confirm_menu.back_btn"),
-                    callback_data=back_button_callback_data
-                )]
-            )
+            back_btn_text = locale.get_string("index_group_confirm_menu.back_btn")
+
+        keyboard.add_button(back_btn_text, "index_group_in", back_directory_id, offset, anchor_chat_id)
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
     def explore_category(cls, locale: Locale, directory_id: int, user_data: dict) -> (str, InlineKeyboardMarkup):
@@ -684,7 +636,7 @@ class Queries:
                 if is_groups_dict:
                     groups_dict: dict
 
-                    keyboard = []
+                    keyboard = KeyboardBuilder()
 
                     sub_directories_data, is_sub_directories_data = DirectoryTable.get_sub_directories(directory_id)
 
@@ -705,9 +657,6 @@ class Queries:
                                 else:
                                     curr_sub_directory_name = curr_sub_directory_id
 
-                                curr_sub_directory_callback_data = f"cd{cls.fd}{curr_sub_directory_id}"
-                                Queries.register_query(curr_sub_directory_callback_data)
-
                                 curr_sub_directory_btn_text = curr_sub_directory_name
 
                                 if not curr_sub_directory_data["hidden_by"]:
@@ -717,36 +666,23 @@ class Queries:
                                 else:
                                     curr_sub_directory_btn_text = "🥷 " + curr_sub_directory_btn_text
 
-                                keyboard.append([InlineKeyboardButton(text=curr_sub_directory_btn_text,
-                                                                      callback_data=curr_sub_directory_callback_data)])
+                                keyboard.add_button(curr_sub_directory_btn_text, "cd", curr_sub_directory_id)
                     else:
                         return Menus.get_error_menu(locale)
 
                     if user_can_add_groups or user_can_modify_groups:
                         index_group_here_button_text = locale.get_string("explore_directories.index_group_here_btn")
 
-                        index_group_here_callback_data = f"index_group_in{cls.fd}{directory_id}{cls.fd}0"
-                        Queries.register_query(index_group_here_callback_data)
-
-                        keyboard.append([InlineKeyboardButton(text=index_group_here_button_text,
-                                                              callback_data=index_group_here_callback_data)])
+                        keyboard.add_button(index_group_here_button_text, "index_group_in", directory_id, 0, 0)
 
                     if user_is_bot_admin:
                         create_subdirectory_button_text = locale.get_string("explore_directories.create_subdirectory_here_btn")
-                        create_subdirectory_button_callback_data = f"create_subdirectory_in{cls.fd}{directory_id}"
-
-                        Queries.register_query(create_subdirectory_button_callback_data)
 
-                        keyboard.append([InlineKeyboardButton(text=create_subdirectory_button_text,
-                                                              callback_data=create_subdirectory_button_callback_data)])
+                        keyboard.add_button(create_subdirectory_button_text, "create_subdirectory_in", directory_id)
 
                         manage_directory_menu_button_text = locale.get_string("explore_directories.manage_directory_btn")
-                        manage_directory_menu_button_callback_data = f"manage_directory{cls.fd}{directory_id}"
 
-                        Queries.register_query(manage_directory_menu_button_callback_data)
-
-                        keyboard.append([InlineKeyboardButton(text=manage_directory_menu_button_text,
-                                                              callback_data=manage_directory_menu_button_callback_data)])
+                        keyboard.add_button(manage_directory_menu_button_text, "manage_directory", directory_id)
 
                     category_description = None
 
@@ -754,24 +690,17 @@ class Queries:
                         category_description = DirectoryTable.get_full_category_name(lang_code, directory_id)
 
                     if category_description:
-                        text = f"📂 <b>" + category_description + "</b>\n"
+                        text = TextBuffer(f"📂 <b>" + category_description + "</b>\n")
 
                     else:
-                        text = f"📁 <b>" + directory_name + "</b>\n"
+                        text = TextBuffer(f"📁 <b>" + directory_name + "</b>\n")
 
 
                     if parent_directory_id != -1:
-                        back_button_text = locale.get_string("explore_directories.sub_directory.back_btn")
-                        back_button_callback_data = f"cd{cls.fd}{parent_directory_id}"
+                        keyboard.add_button(locale.get_string("explore_directories.sub_directory.back_btn"), "cd", parent_directory_id)
 
                     else:
-                        back_button_text = locale.get_string("explore_directories.back_to_menu_btn")
-                        back_button_callback_data = f"main_menu"
-
-                    Queries.register_query(back_button_callback_data)
-
-                    keyboard.append([InlineKeyboardButton(text=back_button_text,
-                                                          callback_data=back_button_callback_data)])
+                        keyboard.add_button(locale.get_string("explore_directories.back_to_menu_btn"), "main_menu")
 
                     if user_is_bot_admin:
                         text += f"\n🆔 <code>{directory_id}</code>"
@@ -831,7 +760,7 @@ class Queries:
 
                         text += locale.get_string("explore_groups.category.sub_categories_line")
 
-                    return text, InlineKeyboardMarkup(keyboard)
+                    return text.get_text(), keyboard.build()
 
         text, reply_markup = Menus.get_error_menu(locale, "database")
 
@@ -839,99 +768,128 @@ class Queries:
 
         return text, reply_markup
 
+    @classmethod
+    def search_chats(cls, search_query: str, user_is_bot_admin: bool = False, limit: int = 10) -> list:
+        def accept_chat(key: tuple, chat_data: dict) -> bool:
+            if chat_data["directory_id"] is None or not (chat_data["custom_link"] or chat_data["invite_link"]):
+                return False
+
+            if user_is_bot_admin:
+                return True
+
+            return chat_data["hidden_by"] is None and chat_data["missing_permissions"] is False \
+                and DirectoryTable.is_directory_visible(chat_data["directory_id"])
+
+        return SearchIndex.search(search_query, "chat", limit, accept_chat)
+
+    @classmethod
+    def search_menu(cls, locale: Locale, search_query: str, user_data: dict | None) -> (str, InlineKeyboardMarkup):
+        user_is_bot_admin = bool(user_data and user_data["is_admin"])
+
+        lang_code = locale.lang_code
+
+        keyboard = KeyboardBuilder()
+
+        search_query = search_query.strip()
+
+        if not search_query:
+            text = locale.get_string("search.usage")
+
+        else:
+            def accept_directory(key: tuple, directory_data: dict) -> bool:
+                if directory_data["parent_id"] is None:
+                    return False
+
+                return user_is_bot_admin or DirectoryTable.is_directory_visible(directory_data["id"])
+
+            found_chats = cls.search_chats(search_query, user_is_bot_admin)
+
+            found_directories = SearchIndex.search(search_query, "directory", 5, accept_directory)
+
+            escaped_search_query = html.escape(search_query)
+
+            if found_chats or found_directories:
+                text = locale.get_string("search.results_first_line").replace("[query]", escaped_search_query) + "\n"
+
+                for _, chat_data in found_chats:
+                    if chat_data["custom_title"]:
+                        chat_title = chat_data["custom_title"]
+                    else:
+                        chat_title = chat_data["title"]
+
+                    if chat_data["custom_link"]:
+                        chat_join_url = chat_data["custom_link"]
+                    else:
+                        chat_join_url = chat_data["invite_link"]
+
+                    text += f"\n• {html.escape(chat_title)} <a href='{html.escape(chat_join_url)}'>" + locale.get_string("explore_groups.join_href_text") + "</a>"
+
+                    full_category_name = DirectoryTable.get_full_category_name(lang_code, chat_data["directory_id"])
+
+                    if full_category_name:
+                        text += f"\n      📂 <i>{html.escape(full_category_name)}</i>"
+
+                for _, directory_data in found_directories:
+                    directory_id = directory_data["id"]
+
+                    keyboard.add_button("📂 " + str(DirectoryTable.get_full_category_name(lang_code, directory_id)), "cd", directory_id)
+
+                if found_directories:
+                    if found_chats:
+                        text += "\n"
+
+                    text += locale.get_string("search.categories_line")
+
+            else:
+                text = locale.get_string("search.no_results").replace("[query]", escaped_search_query)
+
+        keyboard.add_button(locale.get_string("search.explore_groups_btn"), "explore_categories")
+
+        keyboard.add_button(locale.get_string("search.back_btn"), "main_menu")
+
+        return text, keyboard.build()
+
     @classmethod
     async def manage_directory_menu(cls, locale: Locale, directory_data: dict) -> (str, InlineKeyboardMarkup):
         directory_id = directory_data["id"]
 
         text = await DirectoryTable.get_directory_data_summary(directory_data, locale)
 
-        edit_callback_data = f"edit_directory_names{cls.fd}{directory_id}"
-        Queries.register_query(edit_callback_data)
+        keyboard = KeyboardBuilder()
 
-        keyboard = [
-            [InlineKeyboardButton(
-                text=locale.get_string("manage_directory.edit_directory_names_btn"),
-                callback_data=edit_callback_data
-            )]
-        ]
+        keyboard.add_button(locale.get_string("manage_directory.edit_directory_names_btn"), "edit_directory_names", directory_id)
 
         if directory_data["hidden_by"]:
-            unhide_callback_data = f"unhide_directory{cls.fd}{directory_id}"
-            Queries.register_query(unhide_callback_data)
-
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        text=locale.get_string("manage_directory.unhide_directory_btn"),
-                        callback_data=unhide_callback_data
-                    )
-                ]
-            )
+            keyboard.add_button(locale.get_string("manage_directory.unhide_directory_btn"), "unhide_directory", directory_id)
 
         else:
-            hide_callback_data = f"hide_directory{cls.fd}{directory_id}"
-            Queries.register_query(hide_callback_data)
-
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        text=locale.get_string("manage_directory.hide_directory_btn"),
-                        callback_data=hide_callback_data
-                    )
-                ]
-            )
+            keyboard.add_button(locale.get_string("manage_directory.hide_directory_btn"), "hide_directory", directory_id)
 
         if directory_data["parent_id"] is None:
             delete_btn_text = locale.get_string("manage_directory.delete_root_directory_btn")
-            delete_btn_callback_data = f"delete_root_directory{cls.fd}{directory_id}"
-            Queries.register_query(delete_btn_callback_data)
+            delete_btn_action = "delete_root_directory"
 
         elif DirectoryTable.directory_is_empty(directory_id):
             delete_btn_text = locale.get_string("manage_directory.delete_directory_btn")
-            delete_btn_callback_data = f"delete_directory_confirm_menu{cls.fd}{directory_id}"
-            Queries.register_query(delete_btn_callback_data)
+            delete_btn_action = "delete_directory_confirm_menu"
 
         else:
             delete_btn_text = locale.get_string("manage_directory.delete_nonempty_directory_btn")
-            delete_btn_callback_data = f"delete_nonempty_directory{cls.fd}{directory_id}"
-            Queries.register_query(delete_btn_callback_data)
-
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    text=delete_btn_text,
-                    callback_data=delete_btn_callback_data
-                )
-            ]
-        )
+            delete_btn_action = "delete_nonempty_directory"
 
-        back_callback_data = f"cd{cls.fd}{directory_id}"
-        Queries.register_query(back_callback_data)
+        keyboard.add_button(delete_btn_text, delete_btn_action, directory_id)
 
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    text=locale.get_string("manage_directory.back_btn"),
-                    callback_data=back_callback_data
-                )
-            ]
-        )
+        keyboard.add_button(locale.get_string("manage_directory.back_btn"), "cd", directory_id)
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
     def back_to_manage_directory_menu(cls, locale: Locale, directory_id: int, text: str) -> (str, InlineKeyboardMarkup):
-        back_callback_data = f"manage_directory{cls.fd}{directory_id}"
-        Queries.register_query(back_callback_data)
+        keyboard = KeyboardBuilder()
 
-        keyboard = [
-            [InlineKeyboardButton(
-                text=locale.get_string("manage_directory.back_btn"),
-                callback_data=back_callback_data
-            )]
-        ]
+        keyboard.add_button(locale.get_string("manage_directory.back_btn"), "manage_directory", directory_id)
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
     def cd_queries_handler(cls, directory_id: int, locale: Locale, user_data: dict) -> (str, InlineKeyboardMarkup):
@@ -963,279 +921,318 @@ class Queries:
                 pass
 
     @classmethod
-    async def callback_queries_handler(cls, update: Update, context: CallbackContext):
-        bot           = context.bot
-        query         = update.callback_query
-        user          = update.effective_user
-        user_id       = user.id
-        query_message = query.message
+    async def main_menu_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str) -> (str, InlineKeyboardMarkup):
+        return Menus.get_main_menu(locale)
 
-        locale = Locale(user.language_code)
+    @classmethod
+    async def add_group_menu_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str) -> (str, InlineKeyboardMarkup):
+        return Menus.get_add_group_menu(locale, query.get_bot().username)
 
-        if query_message.chat.type == "private":
-            hashed_query_data = query.data
-            query_data = cls.decode_query_data(hashed_query_data)
+    @classmethod
+    async def about_menu_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str) -> (str, InlineKeyboardMarkup):
+        return Menus.get_about_menu(locale)
 
-            query_args = query_data.split(cls.fd)[1:]
+    @classmethod
+    async def alert_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str) -> (str, None):
+        if action == "wip_alert":
+            await query.answer(text=locale.get_string("wip_alert"), show_alert=True)
 
-            text, reply_markup = "", None
+        elif action == "expired_session_about_alert":
+            await query.answer(text=locale.get_string("expired_session_menu.about_alert"), show_alert=True)
 
-            user_data, is_user_data = AccountTable.get_account_record(user_id)
+        return "", None
 
-            if is_user_data:
-                if Queries.user_can_perform_action(user_data, query_data):
-                    try:
-                        if user_id in cls.user_input_subdirectories_data:
-                            await cls.cancel_categories_operation(locale, bot, user_id)
+    @classmethod
+    async def explore_categories_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str) -> (str, InlineKeyboardMarkup):
+        return cls.cd_queries_handler(DirectoryTable.CATEGORIES_ROOT_DIR_ID, locale, user_data)
 
-                        if query_data in ("refresh_session", "unrecognized query"):
-                            query_data = "main_menu"
+    @classmethod
+    async def cd_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str, directory_id: int) -> (str, InlineKeyboardMarkup):
+        return cls.cd_queries_handler(directory_id, locale, user_data)
 
-                        if query_data == "explore_categories":
-                            text, reply_markup = cls.cd_queries_handler(DirectoryTable.CATEGORIES_ROOT_DIR_ID, locale, user_data)
+    @classmethod
+    async def directory_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str, target_directory_id: int) -> (str, InlineKeyboardMarkup):
+        user = query.from_user
 
-                        elif query_data.startswith(f"cd{cls.fd}"):
-                            target_directory_id = int(query_args[0])
+        text, reply_markup = "", None
 
-                            text, reply_markup = cls.cd_queries_handler(target_directory_id, locale, user_data)
+        target_directory_data, is_target_directory_data = DirectoryTable.get_directory_data(target_directory_id)
 
-                        elif query_data.startswith(f"manage_directory{cls.fd}") \
-                                or query_data.startswith(f"hide_directory{cls.fd}") \
-                                or query_data.startswith(f"unhide_directory{cls.fd}") \
-                                or query_data.startswith(f"delete_directory{cls.fd}") \
-                                or query_data.startswith(f"delete_directory_confirm_menu{cls.fd}") \
-                                or query_data.startswith(f"delete_root_directory{cls.fd}") \
-                                or query_data.startswith(f"delete_nonempty_directory{cls.fd}"):
+        if not is_target_directory_data:
+            _, reply_markup = Menus.get_error_menu(locale, "database")
 
-                            target_directory_id = int(query_args[0])
+            return locale.get_string("manage_directory.database_error"), reply_markup
 
-                            target_directory_data, is_target_directory_data = DirectoryTable.get_directory_data(target_directory_id)
+        old_target_directory_data = dict(target_directory_data)
 
-                            if is_target_directory_data:
-                                old_target_directory_data = dict(target_directory_data)
+        parent_target_directory_id = target_directory_data["parent_id"]
 
-                                parent_target_directory_id = target_directory_data["parent_id"]
+        updated = None
 
-                                updated = None
+        if action == "manage_directory":
+            text, reply_markup = await cls.manage_directory_menu(locale, target_directory_data)
 
-                                if query_data.startswith(f"manage_directory{cls.fd}"):
-                                    text, reply_markup = await cls.manage_directory_menu(locale, target_directory_data)
+        elif action in ("hide_directory", "unhide_directory"):
+            if target_directory_data["hidden_by"]:
+                if action == "unhide_directory":
+                    updated = DirectoryTable.update_directory_visibility(target_directory_id, None)
 
-                                elif query_data.startswith(f"hide_directory{cls.fd}") or query_data.startswith(f"unhide_directory{cls.fd}"):
-                                    if target_directory_data["hidden_by"]:
-                                        if query_data.startswith(f"unhide_directory{cls.fd}"):
-                                            updated = DirectoryTable.update_directory_visibility(target_directory_id, None)
+                else:
+                    text = locale.get_string("hide_directory.already_hidden")
 
-                                        else:
-                                            text = locale.get_string("hide_directory.already_hidden")
+            else:
+                if action == "hide_directory":
+                    updated = DirectoryTable.update_directory_visibility(target_directory_id, user.id)
 
-                                    else:
-                                        if query_data.startswith(f"hide_directory{cls.fd}"):
-                                            updated = DirectoryTable.update_directory_visibility(target_directory_id, user_id)
+                else:
+                    text = locale.get_string("unhide_directory.already_visible")
 
-                                        else:
-                                            text = locale.get_string("unhide_directory.already_visible")
+            if updated:
+                chats_count, is_chats_count = DirectoryTable.get_chats_count(target_directory_id, False, True)
 
-                                    if updated:
-                                        chats_count, is_chats_count = DirectoryTable.get_chats_count(target_directory_id, False, True)
-
-                                        if is_chats_count and chats_count > 0:
-                                            if query_data.startswith(f"hide_directory{cls.fd}"):
-                                                DirectoryTable.increment_chats_count(target_directory_id, -chats_count)
-                                            elif parent_target_directory_id is not None:
-                                                DirectoryTable.increment_chats_count(parent_target_directory_id, chats_count)
-
-                                        text, reply_markup = await cls.manage_directory_menu(locale, target_directory_data)
-
-                                        await Logger.log_directory_visibility_action(
-                                            action=query_data[:query_data.rfind(cls.fd)].replace("_", " "),
-                                            admin=user,
-                                            directory_data_summary=await DirectoryTable.get_directory_data_summary(
-                                                old_target_directory_data, locale
-                                            )
-                                        )
-
-                                elif query_data.startswith(f"delete_directory{cls.fd}") \
-                                        or query_data.startswith(f"delete_directory_confirm_menu{cls.fd}") \
-                                        or query_data.startswith(f"delete_root_directory{cls.fd}") \
-                                        or query_data.startswith(f"delete_nonempty_directory{cls.fd}"):
-
-                                    if parent_target_directory_id:
-                                        if not query_data.startswith(f"delete_root_directory{cls.fd}"):
-                                            if DirectoryTable.directory_is_empty(target_directory_id):
-                                                if not query_data.startswith(f"delete_nonempty_directory{cls.fd}"):
-                                                    if not query_data.startswith(f"delete_directory_confirm_menu{cls.fd}"):
-                                                        updated = DirectoryTable.delete_directory(target_directory_id)
-
-                                                        if updated:
-                                                            old_directory_data_summary = await DirectoryTable.get_directory_data_summary(
-                                                                old_target_directory_data,
-                                                                locale
-                                                            )
-
-                                                            text = locale.get_string("delete_directory.deleted_first_line")
-
-                                                            text += "\n\n" + old_directory_data_summary
-
-                                                            back_callback_data = f"cd{cls.fd}{parent_target_directory_id}"
-                                                            Queries.register_query(back_callback_data)
-
-                                                            keyboard = [
-                                                                [InlineKeyboardButton(
-                                                                    text=locale.get_string("delete_directory.back_btn"),
-                                                                    callback_data=back_callback_data
-                                                                )]
-                                                            ]
-
-                                                            reply_markup = InlineKeyboardMarkup(keyboard)
-
-                                                            await Logger.log_directory_visibility_action(
-                                                                action="DELETE DIRECTORY",
-                                                                admin=user,
-                                                                directory_data_summary=old_directory_data_summary
-                                                            )
-                                                    else:
-                                                        old_directory_data_summary = await DirectoryTable.get_directory_data_summary(
-                                                            old_target_directory_data,
-                                                            locale
-                                                        )
-
-                                                        text = locale.get_string("delete_directory.confirm_menu.text")
-
-                                                        text += "\n\n" + old_directory_data_summary
-
-                                                        confirm_button_callback_data = f"delete_directory{cls.fd}{target_directory_id}"
-                                                        Queries.register_query(confirm_button_callback_data)
-
-                                                        back_button_callback_data = f"manage_directory{cls.fd}{target_directory_id}"
-                                                        Queries.register_query(back_button_callback_data)
-
-                                                        keyboard = [
-                                                            [
-                                                                InlineKeyboardButton(
-                                                                    text=locale.get_string("delete_directory.confirm_menu.confirm_btn"),
-                                                                    callback_data=confirm_button_callback_data
-                                                                )
-                                                            ],
-
-                                                            [
-                                                                InlineKeyboardButton(
-                                                                    text=locale.get_string("delete_directory.confirm_menu.undo_btn"),
-                                                                    callback_data=back_button_callback_data
-                                                                )
-                                                            ]
-                                                        ]
-
-                                                        reply_markup = InlineKeyboardMarkup(keyboard)
-                                                else:
-                                                    text = locale.get_string("delete_directory.cant_delete_nonempty_directory") \
-                                                           + "\n\n" + locale.get_string("delete_directory.no_longer_nonempty_directory")
+                if is_chats_count and chats_count > 0:
+                    if action == "hide_directory":
+                        DirectoryTable.increment_chats_count(target_directory_id, -chats_count)
+                    elif parent_target_directory_id is not None:
+                        DirectoryTable.increment_chats_count(parent_target_directory_id, chats_count)
 
-                                            else:
-                                                text = locale.get_string("delete_directory.cant_delete_nonempty_directory")
-                                        else:
-                                            text = locale.get_string("delete_directory.cant_delete_root_directory") \
-                                                   + "\n\n" + locale.get_string("delete_directory.no_longer_root_directory")
-                                    else:
-                                        text = locale.get_string("delete_directory.cant_delete_root_directory")
+                text, reply_markup = await cls.manage_directory_menu(locale, target_directory_data)
+
+                await Logger.log_directory_visibility_action(
+                    action=action.replace("_", " "),
+                    admin=user,
+                    directory_data_summary=await DirectoryTable.get_directory_data_summary(
+                        old_target_directory_data, locale
+                    )
+                )
 
-                                if not text:
-                                    text, reply_markup = Menus.get_error_menu(locale, "database")
+        elif parent_target_directory_id:
+            if action != "delete_root_directory":
+                if DirectoryTable.directory_is_empty(target_directory_id):
+                    if action != "delete_nonempty_directory":
+                        if action != "delete_directory_confirm_menu":
+                            updated = DirectoryTable.delete_directory(target_directory_id)
 
-                                elif not reply_markup:
-                                    text, reply_markup = cls.back_to_manage_directory_menu(locale, target_directory_id, text)
+                            if updated:
+                                old_directory_data_summary = await DirectoryTable.get_directory_data_summary(
+                                    old_target_directory_data,
+                                    locale
+                                )
 
-                            else:
-                                text, reply_markup = Menus.get_error_menu(locale, "database")
+                                text = locale.get_string("delete_directory.deleted_first_line")
+
+                                text += "\n\n" + old_directory_data_summary
+
+                                keyboard = KeyboardBuilder()
+
+                                keyboard.add_button(locale.get_string("delete_directory.back_btn"), "cd", parent_target_directory_id)
+
+                                reply_markup = keyboard.build()
+
+                                await Logger.log_directory_visibility_action(
+                                    action="DELETE DIRECTORY",
+                                    admin=user,
+                                    directory_data_summary=old_directory_data_summary
+                                )
+                        else:
+                            old_directory_data_summary = await DirectoryTable.get_directory_data_summary(
+                                old_target_directory_data,
+                                locale
+                            )
+
+                            text = locale.get_string("delete_directory.confirm_menu.text")
+
+                            text += "\n\n" + old_directory_data_summary
+
+                            keyboard = KeyboardBuilder()
+
+                            keyboard.add_button(locale.get_string("delete_directory.confirm_menu.confirm_btn"),
+                                                "delete_directory", target_directory_id)
+
+                            keyboard.add_button(locale.get_string("delete_directory.confirm_menu.undo_btn"),
+                                                "manage_directory", target_directory_id)
+
+                            reply_markup = keyboard.build()
+                    else:
+                        text = locale.get_string("delete_directory.cant_delete_nonempty_directory") \
+                               + "\n\n" + locale.get_string("delete_directory.no_longer_nonempty_directory")
+
+                else:
+                    text = locale.get_string("delete_directory.cant_delete_nonempty_directory")
+            else:
+                text = locale.get_string("delete_directory.cant_delete_root_directory") \
+                       + "\n\n" + locale.get_string("delete_directory.no_longer_root_directory")
+        else:
+            text = locale.get_string("delete_directory.cant_delete_root_directory")
+
+        if not text:
+            text, reply_markup = Menus.get_error_menu(locale, "database")
+
+        elif not reply_markup:
+            text, reply_markup = cls.back_to_manage_directory_menu(locale, target_directory_id, text)
+
+        return text, reply_markup
+
+    @classmethod
+    async def index_group_in_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str, directory_id: int, offset: int, anchor_chat_id: int) -> (str, InlineKeyboardMarkup):
+        if not cls.user_can_access_directory(user_data, directory_id):
+            return Menus.get_error_menu(locale, "query")
+
+        return cls.index_group_in_directory_menu(locale, directory_id, offset, anchor_chat_id, user_data)
+
+    @classmethod
+    async def create_subdirectory_in_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str, parent_directory_id: int) -> (str, InlineKeyboardMarkup):
+        return cls.create_subdirectory_menu(locale, query.from_user.id, parent_directory_id)
+
+    @classmethod
+    async def edit_directory_names_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str, directory_id: int) -> (str, InlineKeyboardMarkup):
+        return cls.edit_directory_names_menu(locale, query.from_user.id, directory_id)
+
+    @classmethod
+    async def chat_query(cls, query: CallbackQuery, locale: Locale, user_data: dict, action: str, target_chat_id: int, target_directory_id: int, offset: int, anchor_chat_id: int) -> (str, InlineKeyboardMarkup):
+        bot = query.get_bot()
+
+        if not cls.user_can_access_directory(user_data, target_directory_id):
+            return Menus.get_error_menu(locale, "query")
+
+        if action == "missing_permissions_menu":
+            return await cls.missing_permissions_menu(locale, bot, target_chat_id, target_directory_id, offset, anchor_chat_id)
+
+        if action == "hidden_chat_menu":
+            return await cls.hidden_chat_menu(locale, target_chat_id, target_directory_id, offset, anchor_chat_id)
+
+        # index_confirm_menu, index, unindex_confirm_menu and unindex
+        if action.startswith("unindex"):
+            new_directory_id, unindex_directory_id = None, target_directory_id
+        else:
+            new_directory_id, unindex_directory_id = target_directory_id, None
 
-                                text = locale.get_string("manage_directory.database_error")
+        return await cls.index_group_menu(locale, bot,
+                                          query.from_user, target_chat_id, new_directory_id, offset, anchor_chat_id,
+                                          requires_confirmation=action.endswith("_confirm_menu"),
+                                          unindex_directory_id=unindex_directory_id,
+                                          user_can_add_groups=user_data["can_add_groups"],
+                                          user_can_modify_groups=user_data["can_modify_groups"])
 
-                        elif query_data == "main_menu":
-                            text, reply_markup = Menus.get_main_menu(locale)
+    @classmethod
+    def filter_duplicate_clicks(cls, update: object) -> (Awaitable | None):
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+
+        query = update.callback_query
+
+        message_id = query.message.message_id if query.message else query.inline_message_id
+
+        now = monotonic()
+
+        last_click = cls.last_clicks.get(query.from_user.id, count=False)
+
+        if last_click and last_click["message_id"] == message_id and last_click["data"] == query.data \
+                and (not last_click["handled"] or now - last_click["last_seen_at"] < cls.duplicate_clicks_window):
+            last_click["last_seen_at"] = now
 
-                        elif query_data == "add_group_menu":
-                            text, reply_markup = Menus.get_add_group_menu(locale, bot.username)
+            return cls.answer_query(query)
 
-                        elif query_data == "about_menu":
-                            text, reply_markup = Menus.get_about_menu(locale)
+        # Any other click supersedes the previous one, which won't render its menu if it hasn't yet
+        cls.last_clicks.set(query.from_user.id, {"query_id": query.id, "message_id": message_id, "data": query.data,
+                                                 "received_at": now, "last_seen_at": now, "handled": False})
 
-                        elif query_data.startswith(f"index_group_in{cls.fd}"):
-                            target_directory_id = int(query_args[0])
+        return None
 
-                            offset = int(query_args[1])
+    @classmethod
+    def click_is_superseded(cls, query: CallbackQuery) -> bool:
+        last_click = cls.last_clicks.get(query.from_user.id, count=False)
+
+        return last_click is not None and last_click["query_id"] != query.id
+
+    @classmethod
+    def get_click_received_at(cls, query: CallbackQuery) -> float:
+        last_click = cls.last_clicks.get(query.from_user.id, count=False)
 
-                            text, reply_markup = cls.index_group_in_directory_menu(locale, target_directory_id, offset, user_data)
+        if last_click and last_click["query_id"] == query.id:
+            return last_click["received_at"]
+
+        return monotonic()
+
+    @classmethod
+    def add_click_latency(cls, kind: str, received_at: float) -> None:
+        latency = monotonic() - received_at
 
-                        elif query_data.startswith(f"create_subdirectory_in{cls.fd}"):
-                            parent_directory_id = int(query_args[0])
+        latencies = cls.click_latencies[kind]
 
-                            text, reply_markup = cls.create_subdirectory_menu(locale, user_id, parent_directory_id)
+        latencies["count"] += 1
+        latencies["total"] += latency
+        latencies["max"] = max(latencies["max"], latency)
 
-                        elif query_data.startswith(f"edit_directory_names{cls.fd}"):
-                            directory_id = int(query_args[0])
+    @classmethod
+    async def answer_query(cls, query: CallbackQuery) -> None:
+        try:
+            await query.answer()
+        except Exception:
+            pass
 
-                            text, reply_markup = cls.edit_directory_names_menu(locale, user_id, directory_id)
+    @classmethod
+    async def callback_queries_handler(cls, update: Update, context: CallbackContext):
+        try:
+            await cls.handle_callback_query(update, context)
 
-                        elif query_data.startswith(f"missing_permissions_menu{cls.fd}") \
-                                or query_data.startswith(f"hidden_chat_menu{cls.fd}") \
-                                or query_data.startswith(f"index_confirm_menu{cls.fd}") \
-                                or query_data.startswith(f"index{cls.fd}") \
-                                or query_data.startswith(f"unindex_confirm_menu{cls.fd}") \
-                                or query_data.startswith(f"unindex{cls.fd}"):
+        finally:
+            last_click = cls.last_clicks.get(update.callback_query.from_user.id, count=False)
 
-                            target_chat_id = int(query_args[0])
+            if last_click and last_click["query_id"] == update.callback_query.id:
+                last_click["handled"] = True
 
-                            target_directory_id = int(query_args[1])
+                last_click["last_seen_at"] = monotonic()
 
-                            offset = int(query_args[2])
+    @classmethod
+    async def handle_callback_query(cls, update: Update, context: CallbackContext):
+        bot           = context.bot
+        query         = update.callback_query
+        user          = update.effective_user
+        user_id       = user.id
+        query_message = query.message
 
-                            user_can_add_groups = user_data["can_add_groups"]
-                            user_can_modify_groups = user_data["can_modify_groups"]
+        received_at = cls.get_click_received_at(query)
 
-                            if query_data.startswith(f"missing_permissions_menu{cls.fd}"):
-                                text, reply_markup = await cls.missing_permissions_menu(locale, bot,
-                                                                                        target_chat_id, target_directory_id, offset)
+        locale = Locale(user.language_code)
 
-                            elif query_data.startswith(f"hidden_chat_menu{cls.fd}"):
-                                text, reply_markup = await cls.hidden_chat_menu(locale, target_chat_id, target_directory_id, offset)
+        if query_message.chat.type == "private":
+            action, query_args = cls.parse_query_data(query.data)
 
-                            elif query_data.startswith(f"index_confirm_menu{cls.fd}"):
-                                text, reply_markup = await cls.index_group_menu(locale, bot,
-                                                                                user, target_chat_id, target_directory_id, offset,
-                                                                                requires_confirmation=True,
-                                                                                user_can_add_groups=user_can_add_groups,
-                                                                                user_can_modify_groups=user_can_modify_groups)
+            query_route = cls.query_routes.get(action)
 
-                            elif query_data.startswith(f"index{cls.fd}"):
-                                text, reply_markup = await cls.index_group_menu(locale, bot,
-                                                                                user, target_chat_id, target_directory_id, offset,
-                                                                                requires_confirmation=False,
-                                                                                user_can_add_groups=user_can_add_groups,
-                                                                                user_can_modify_groups=user_can_modify_groups)
+            # Unrecognized (e.g. expired) or malformed queries lead back to the main menu
+            if query_route is None or len(query_args) != len(query_route[2]):
+                action, query_args = "main_menu", []
 
-                            elif query_data.startswith(f"unindex_confirm_menu{cls.fd}"):
-                                text, reply_markup = await cls.index_group_menu(locale, bot,
-                                                                                user, target_chat_id, None, offset,
-                                                                                requires_confirmation=True,
-                                                                                unindex_directory_id=target_directory_id,
-                                                                                user_can_add_groups=user_can_add_groups,
-                                                                                user_can_modify_groups=user_can_modify_groups)
+                query_route = cls.query_routes[action]
 
-                            elif query_data.startswith(f"unindex{cls.fd}"):
-                                text, reply_markup = await cls.index_group_menu(locale, bot,
-                                                                                user, target_chat_id, None, offset,
-                                                                                requires_confirmation=False,
-                                                                                unindex_directory_id=target_directory_id,
-                                                                                user_can_add_groups=user_can_add_groups,
-                                                                                user_can_modify_groups=user_can_modify_groups)
+            handler_name, _, _ = query_route
 
-                        elif query_data == "wip_alert":
-                            await query.answer(text=locale.get_string("wip_alert"), show_alert=True)
+            # Clicks are acknowledged (stopping the spinner of their button) before their menus are rendered,
+            # except for the ones the handler answers with an alert
+            acknowledged = handler_name != "alert_query"
 
-                        elif query_data == "expired_session_about_alert":
-                            await query.answer(text=locale.get_string("expired_session_menu.about_alert"), show_alert=True)
+            if acknowledged:
+                await cls.answer_query(query)
+
+                cls.add_click_latency("ack", received_at)
+
+            text, reply_markup = "", None
+
+            user_data, is_user_data = AccountTable.get_account_record(user_id)
+
+            if is_user_data:
+                if Queries.user_can_perform_action(user_data, action):
+                    try:
+                        if user_id in cls.user_input_subdirectories_data:
+                            await cls.cancel_categories_operation(locale, bot, user_id)
+
+                        text, reply_markup = await getattr(cls, handler_name)(query, locale, user_data, action, *query_args)
 
                     except Exception as ex:
+                        query_data = cls.fd.join([action] + [str(query_arg) for query_arg in query_args])
+
                         Logger.log("exception", "Queries.callback_queries_handler",
                                    f"An exception occurred while handling query '{query_data}' from '{user_id}'", ex)
 
@@ -1245,11 +1242,17 @@ class Queries:
             else:
                 text, reply_markup = Menus.get_error_menu(locale)
 
+            # A newer click from the same user is going to render its own menu in place of this one
+            if (text or reply_markup) and cls.click_is_superseded(query):
+                text, reply_markup = "", None
+
             if text or reply_markup:
                 edit_message_id = query_message.message_id
 
-                if user_id in SessionTable.active_chat_sessions and SessionTable.active_chat_sessions[user_id] != query_message.id:
-                    edit_message_id = SessionTable.active_chat_sessions[user_id]
+                active_session_menu_message_id = SessionTable.get_active_session_menu_message_id(user_id)
+
+                if active_session_menu_message_id != -1 and active_session_menu_message_id != query_message.id:
+                    edit_message_id = active_session_menu_message_id
 
                     try:
                         await bot.delete_message(chat_id=user_id, message_id=query_message.message_id)
@@ -1257,38 +1260,54 @@ class Queries:
                     except Exception:
                         pass
 
-                reply_markup = Queries.encode_queries(reply_markup)
-
-                try:
-                    await query.answer()
-                except Exception:
-                    pass
+                if not acknowledged:
+                    await cls.answer_query(query)
 
                 edited = False
 
                 new_message_id = edit_message_id
 
-                try:
-                    await bot.edit_message_text(text=text, chat_id=user_id, message_id=edit_message_id, reply_markup=reply_markup)
-
-                    edited = True
+                # Rendering the same menu shown in the message again (e.g. refreshing it) doesn't need to edit it
+                if not SessionTable.menu_is_rendered(user_id, edit_message_id, text, reply_markup):
+                    try:
+                        new_message = await ChunkedMessages.send(bot, user_id, text, reply_markup, edit_message_id)
 
-                except Exception:
-                    new_message = await bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
+                        new_message_id = new_message.message_id
 
-                    new_message_id = new_message.message_id
+                        edited = True
 
-                    if user_id in SessionTable.active_chat_sessions:
-                        SessionTable.update_session(chat_id=user_id, new_latest_menu_message_id=new_message_id)
+                        # Texts too long for a single message leave the menu in the last of the sent ones
+                        if new_message_id != edit_message_id and user_id in SessionTable.active_chat_sessions:
+                            SessionTable.update_session(chat_id=user_id, new_latest_menu_message_id=new_message_id)
 
-                    try:
-                        await bot.delete_message(chat_id=user_id, message_id=edit_message_id)
                     except Exception:
-                        pass
+                        # Only the chunks which weren't delivered are sent again, so the message is kept
+                        # if its first chunk was already edited into it
+                        first_chunk_delivered = ChunkedMessages.has_leading_messages(user_id)
+
+                        new_message = await ChunkedMessages.send(bot, user_id, text, reply_markup, resume=True)
+
+                        new_message_id = new_message.message_id
+
+                        if user_id in SessionTable.active_chat_sessions:
+                            SessionTable.update_session(chat_id=user_id, new_latest_menu_message_id=new_message_id)
+
+                        if not first_chunk_delivered:
+                            try:
+                                await bot.delete_message(chat_id=user_id, message_id=edit_message_id)
+                            except Exception:
+                                pass
+
+                    SessionTable.set_rendered_menu(user_id, new_message_id, text, reply_markup)
+
+                    cls.add_click_latency("edit", received_at)
 
                 if user_id not in SessionTable.active_chat_sessions:
                     SessionTable.add_session(chat_id=user_id, latest_menu_message_id=new_message_id)
 
+                else:
+                    SessionTable.refresh_session(chat_id=user_id, latest_menu_message_id=new_message_id)
+
         else:
             try:
                 await bot.delete_message(chat_id=user_id, message_id=query_message.message_id)
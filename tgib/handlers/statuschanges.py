@@ -90,3 +90,35 @@ class StatusChanges:
                            f"The bot was removed administrator from the group with chat_id = '{chat_id}'")
 
                 ChatTable.set_missing_permissions(chat_id)
+
+    @classmethod
+    async def chat_member_handler(cls, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat = update.effective_chat
+
+        if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+            return None
+
+        chat_member_update = update.chat_member
+
+        status_change = chat_member_update.difference().get("status")
+
+        if status_change is None:
+            return None
+
+        old_status, new_status = status_change
+
+        was_admin = old_status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]
+
+        is_admin = new_status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]
+
+        if was_admin == is_admin and ChatMember.OWNER not in status_change:
+            return None
+
+        chat_id = chat.id
+
+        user_id = chat_member_update.new_chat_member.user.id
+
+        if ChatTable.update_chat_admin(chat_id, user_id, is_admin, new_status == ChatMember.OWNER):
+            Logger.log("debug", "StatusChanges.chat_member_handler",
+                       f"The status of the user having user_id = '{user_id}' in the group"
+                       f" with chat_id = '{chat_id}' changed from '{old_status}' to '{new_status}'")
@@ -0,0 +1,105 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+from time import monotonic
+
+
+class TokenBucket:
+    # Each request to be rate limited takes a token from the bucket, which gets refilled at rate
+    # tokens per second up to capacity tokens. When Telegram answers with a RetryAfter error the
+    # bucket is paused for the requested time and its rate is halved, to then recover linearly
+    # back to max_rate over recovery_time seconds, so every task sharing it slows down at once
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = 1, recovery_time: float = 60):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.recovery_time = recovery_time
+
+        self.capacity = capacity if capacity else rate
+
+        self.tokens = self.capacity
+
+        self.last_refill = monotonic()
+
+        self.paused_until = 0
+
+        self.acquired_tokens = 0
+        self.retry_after_count = 0
+
+        # Total seconds spent by the acquiring tasks waiting for tokens (or for a pause to end)
+        self.wait_time = 0.0
+
+    def refill(self) -> None:
+        now = monotonic()
+
+        elapsed_time = now - self.last_refill
+
+        self.last_refill = now
+
+        if now < self.paused_until:
+            return
+
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + elapsed_time * self.max_rate / self.recovery_time)
+
+        self.tokens = min(self.capacity, self.tokens + elapsed_time * self.rate)
+
+    async def acquire(self, tokens: float = 1, priority: bool = False) -> None:
+        # Priority requests (e.g. the ones a user is waiting for) don't wait for tokens, but only for pauses:
+        # they can take the bucket below zero, making the other requests wait for the tokens they borrowed
+        started_at = monotonic()
+
+        while True:
+            self.refill()
+
+            now = monotonic()
+
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+
+            elif self.tokens >= tokens or priority:
+                self.tokens -= tokens
+
+                self.acquired_tokens += tokens
+
+                self.wait_time += now - started_at
+
+                return
+
+            else:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def retry_after(self, seconds: float) -> None:
+        self.retry_after_count += 1
+
+        self.refill()
+
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+        self.rate = max(self.min_rate, self.rate / 2)
+
+        self.tokens = 0
+
+    def get_stats(self) -> dict:
+        return {"rate": self.rate, "max_rate": self.max_rate, "tokens": self.tokens,
+                "acquired_tokens": self.acquired_tokens, "retry_after_count": self.retry_after_count, "wait_time": self.wait_time,
+                "paused_for": max(0.0, self.paused_until - monotonic())}
@@ -0,0 +1,239 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import binascii
+import hashlib
+import hmac
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import InlineKeyboardButtonLimit
+
+from tgib.data.caches import TTLCache
+
+
+class CallbackDataCodec:
+    # Actions are encoded as their index in this list, so new actions must only ever be appended to it
+    # (and removed ones replaced by None) for the buttons sent by previous versions to keep working
+    actions = [
+        "refresh_session", "explore_categories", "main_menu", "add_group_menu", "about_menu",
+        "wip_alert", "expired_session_about_alert", "cd", "manage_directory", "hide_directory",
+        "unhide_directory", "delete_directory", "delete_directory_confirm_menu", "delete_root_directory",
+        "delete_nonempty_directory", "index_group_in", "create_subdirectory_in", "edit_directory_names",
+        "missing_permissions_menu", "hidden_chat_menu", "index_confirm_menu", "index",
+        "unindex_confirm_menu", "unindex"
+    ]
+
+    opcodes = {action: opcode for opcode, action in enumerate(actions) if action is not None}
+
+    # Encoded callback data starts with a character which is neither hexadecimal (like the hashes
+    # of the queries registry) nor part of the base64url alphabet, so the two can't be mistaken
+    prefix = "~"
+
+    # Encoded callback data is signed with this key, so that it can't be forged by clients: until it's set
+    # (by main.py, from CALLBACK_DATA_SECRET or else derived from TOKEN) nothing is packed nor unpacked
+    secret = None
+
+    signature_length = 4
+
+    @classmethod
+    def get_signature(cls, payload: bytes) -> bytes:
+        return hmac.new(cls.secret, payload, hashlib.sha256).digest()[:cls.signature_length]
+
+    @classmethod
+    def derive_secret(cls, token: str) -> bytes:
+        return hmac.new(token.encode(), b"tgib-callback-data", hashlib.sha256).digest()
+
+    @classmethod
+    def encode(cls, action: str, args: list) -> (str | None):
+        opcode = cls.opcodes.get(action)
+
+        if not cls.secret or opcode is None or not all(isinstance(arg, int) for arg in args):
+            return None
+
+        payload = bytearray()
+
+        # The opcode and the arguments are stored as varints, with the arguments zigzag-encoded first,
+        # as they include negative chat ids (e.g. -1001234567890 takes 6 bytes instead of 13 digits)
+        for value in [opcode] + [arg * 2 if arg >= 0 else -arg * 2 - 1 for arg in args]:
+            while value > 0x7F:
+                payload.append((value & 0x7F) | 0x80)
+
+                value >>= 7
+
+            payload.append(value)
+
+        payload += cls.get_signature(bytes(payload))
+
+        encoded_data = cls.prefix + base64.urlsafe_b64encode(payload).rstrip(b"=").decode()
+
+        if len(encoded_data) > InlineKeyboardButtonLimit.MAX_CALLBACK_DATA:
+            return None
+
+        return encoded_data
+
+    @classmethod
+    def decode(cls, encoded_data: str) -> (tuple | None):
+        if not cls.secret or not encoded_data.startswith(cls.prefix):
+            return None
+
+        encoded_payload = encoded_data[len(cls.prefix):]
+
+        try:
+            payload = base64.urlsafe_b64decode(encoded_payload + "=" * (-len(encoded_payload) % 4))
+
+        except (binascii.Error, ValueError):
+            return None
+
+        payload, signature = payload[:-cls.signature_length], payload[-cls.signature_length:]
+
+        if not payload or not hmac.compare_digest(signature, cls.get_signature(payload)):
+            return None
+
+        values, value, shift = [], 0, 0
+
+        for byte in payload:
+            value |= (byte & 0x7F) << shift
+
+            if byte & 0x80:
+                shift += 7
+
+            else:
+                values.append(value)
+
+                value, shift = 0, 0
+
+        if shift or not values or values[0] >= len(cls.actions) or cls.actions[values[0]] is None:
+            return None
+
+        args = [value >> 1 if not value & 1 else -(value >> 1) - 1 for value in values[1:]]
+
+        return cls.actions[values[0]], args
+
+
+class CallbackQueriesRegistry:
+    # Queries are made of an action and its arguments, separated by fd
+    fd = "  "
+
+    fixed_queries = [
+        "refresh_session",
+        "explore_categories",
+        "main_menu",
+        "add_group_menu",
+        "about_menu",
+        "wip_alert",
+        "expired_session_about_alert"
+    ]
+
+    fixed_hashes = {}
+
+    # Hashes of the queries of the rendered buttons which couldn't be packed by CallbackDataCodec, dropped once they
+    # haven't been rendered for registered_queries_ttl seconds or when more than registered_queries_maxsize are kept
+    registered_queries_ttl = 3 * 24 * 60 * 60
+
+    registered_queries_maxsize = 50000
+
+    registered_hashes = TTLCache(maxsize=registered_queries_maxsize, ttl=registered_queries_ttl)
+
+    # When enabled, registered queries are also saved to the database (in batches, by Queries.save_registered_queries),
+    # so that the buttons of the menus sent before a restart can still be recognized after it
+    persist_registered_queries = False
+
+    unsaved_hashes = {}
+
+    @classmethod
+    def md5sum(cls, data: str) -> str:
+        m = hashlib.md5()
+        m.update(data.encode())
+        return m.hexdigest()
+
+    @classmethod
+    def register_fixed_queries(cls) -> None:
+        for query_data in cls.fixed_queries:
+            cls.fixed_hashes[cls.md5sum(query_data)] = query_data
+
+    @classmethod
+    def register_query(cls, query_data: str) -> str:
+        hashed_query_data = cls.md5sum(query_data)
+
+        if hashed_query_data not in cls.fixed_hashes:
+            cls.registered_hashes.set(hashed_query_data, query_data)
+
+            if cls.persist_registered_queries:
+                cls.unsaved_hashes[hashed_query_data] = query_data
+
+        return hashed_query_data
+
+    @classmethod
+    def get_query_data(cls, hashed_query_data: str) -> (str | None):
+        if hashed_query_data in cls.fixed_hashes:
+            return cls.fixed_hashes[hashed_query_data]
+
+        query_data = cls.registered_hashes.get(hashed_query_data)
+
+        if query_data is None:
+            query_data = cls.unsaved_hashes.get(hashed_query_data)
+
+        return query_data
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        stats = cls.registered_hashes.get_stats()
+
+        stats["unsaved"] = len(cls.unsaved_hashes)
+
+        return stats
+
+
+class KeyboardBuilder:
+    # Callback buttons get their final callback data as soon as they're created (packed by CallbackDataCodec
+    # or, failing that, registered in CallbackQueriesRegistry), so keyboards are built in a single pass
+
+    def __init__(self):
+        self.keyboard = []
+
+    @classmethod
+    def encode(cls, action: str, *args: int) -> str:
+        callback_data = CallbackDataCodec.encode(action, list(args))
+
+        if callback_data is None:
+            fd = CallbackQueriesRegistry.fd
+
+            callback_data = CallbackQueriesRegistry.register_query(fd.join([action] + [str(arg) for arg in args]))
+
+        return callback_data
+
+    @classmethod
+    def button(cls, text: str, action: str = None, *args: int, url: str = None) -> InlineKeyboardButton:
+        if url is not None:
+            return InlineKeyboardButton(text=text, url=url)
+
+        return InlineKeyboardButton(text=text, callback_data=cls.encode(action, *args))
+
+    def add_row(self, *buttons: InlineKeyboardButton):
+        if buttons:
+            self.keyboard.append(list(buttons))
+
+        return self
+
+    def add_button(self, text: str, action: str = None, *args: int, url: str = None):
+        return self.add_row(self.button(text, action, *args, url=url))
+
+    def build(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(self.keyboard)
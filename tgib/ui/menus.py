@@ -17,10 +17,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
 
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import InlineKeyboardMarkup
 
 from tgib.global_vars import GlobalVariables
 from tgib.i18n.locales import Locale
+from tgib.ui.callbacks import KeyboardBuilder
 
 
 class Menus:
@@ -28,16 +29,13 @@ class Menus:
     def get_main_menu(cls, locale: Locale) -> (str, InlineKeyboardMarkup):
         text = locale.get_string("main_menu.text")
 
-        keyboard = [
-            [InlineKeyboardButton(text=locale.get_string("main_menu.explore_groups_btn"),
-                                  callback_data="explore_categories")],
-            [InlineKeyboardButton(text=locale.get_string("main_menu.add_bot_to_group_btn"),
-                                  callback_data="add_group_menu")],
-            [InlineKeyboardButton(text=locale.get_string("main_menu.about_message_btn"),
-                                  callback_data="about_menu")]
-        ]
+        keyboard = KeyboardBuilder()
 
-        return text, InlineKeyboardMarkup(keyboard)
+        keyboard.add_button(locale.get_string("main_menu.explore_groups_btn"), "explore_categories")
+        keyboard.add_button(locale.get_string("main_menu.add_bot_to_group_btn"), "add_group_menu")
+        keyboard.add_button(locale.get_string("main_menu.about_message_btn"), "about_menu")
+
+        return text, keyboard.build()
 
     @classmethod
     def get_add_group_menu(cls, locale: Locale, bot_username: str) -> (str, InlineKeyboardMarkup):
@@ -45,18 +43,16 @@ class Menus:
 
         text = text.replace("[bot_username]", "@" + bot_username)
 
-        keyboard = [
-            [InlineKeyboardButton(text=locale.get_string("add_group_menu.1_btn"),
-                                  url="https://t.me/" + bot_username + "?startgroup=start")],
-            [InlineKeyboardButton(text=locale.get_string("add_group_menu.2_btn"),
-                                  callback_data="explore_categories")],
-            [InlineKeyboardButton(text=locale.get_string("add_group_menu.contact_us_btn"),
-                                  url="tg://resolve?domain=" + GlobalVariables.contact_username)],
-            [InlineKeyboardButton(text=locale.get_string("add_group_menu.back_btn"),
-                                  callback_data="main_menu")]
-        ]
+        keyboard = KeyboardBuilder()
+
+        keyboard.add_button(locale.get_string("add_group_menu.1_btn"),
+                            url="https://t.me/" + bot_username + "?startgroup=start")
+        keyboard.add_button(locale.get_string("add_group_menu.2_btn"), "explore_categories")
+        keyboard.add_button(locale.get_string("add_group_menu.contact_us_btn"),
+                            url="tg://resolve?domain=" + GlobalVariables.contact_username)
+        keyboard.add_button(locale.get_string("add_group_menu.back_btn"), "main_menu")
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
 
     @classmethod
     def get_about_menu(cls, locale: Locale) -> (str, InlineKeyboardMarkup):
@@ -77,48 +73,45 @@ class Menus:
 
         text = text.replace("[accounts_count]", str(GlobalVariables.stats_accounts_count))
 
-        keyboard = []
+        keyboard = KeyboardBuilder()
 
         if sapienzastudentsbot:
-            keyboard += [
-                [
-                 InlineKeyboardButton(text=locale.get_string("about_menu.github_repo_btn"),
-                                      url=f'https://github.com/sapienzastudentsnetwork/tgroupsindexerbot'),
-                 InlineKeyboardButton(text=locale.get_string("about_menu.git_channel_btn"),
-                                      url=f'tg://resolve?domain=tgroupsindexerbotgit')
-                ],
-                [
-                 InlineKeyboardButton(text=locale.get_string("about_menu.feature_request_btn"),
-                                     url=f'https://github.com/sapienzastudentsnetwork/tgroupsindexerbot/issues/new?'
-                                         f'title=[FEATURE REQUEST]%20Please%20choose%20a%20title%20for%20this%20feature%20request'
-                                         f'&body=Please%20describe%20the%20request%20in%20detail%20here.%20Thanks%20in%20advance%20:)'),
-                 InlineKeyboardButton(text=locale.get_string("about_menu.report_issue_btn"),
-                                      url=f'https://github.com/sapienzastudentsnetwork/tgroupsindexerbot/issues/new?'
-                                          f'title=[ISSUE]%20Please%20choose%20a%20title%20for%20this%20issue'
-                                          f'&body=Please%20describe%20the%20issue%20in%20detail%20here.%20Thanks%20in%20advance%20:)')
-                ],
-                [
-                    InlineKeyboardButton(text=locale.get_string("about_menu.contact_us_btn"),
-                                         url=f'tg://resolve?domain=' + GlobalVariables.contact_username),
-                ],
-            ]
-
-        keyboard.append([InlineKeyboardButton(text=locale.get_string("about_menu.back_btn"), callback_data="main_menu")])
-
-        return text, InlineKeyboardMarkup(keyboard)
+            keyboard.add_row(
+                KeyboardBuilder.button(locale.get_string("about_menu.github_repo_btn"),
+                                       url=f'https://github.com/sapienzastudentsnetwork/tgroupsindexerbot'),
+                KeyboardBuilder.button(locale.get_string("about_menu.git_channel_btn"),
+                                       url=f'tg://resolve?domain=tgroupsindexerbotgit')
+            )
+
+            keyboard.add_row(
+                KeyboardBuilder.button(locale.get_string("about_menu.feature_request_btn"),
+                                       url=f'https://github.com/sapienzastudentsnetwork/tgroupsindexerbot/issues/new?'
+                                           f'title=[FEATURE REQUEST]%20Please%20choose%20a%20title%20for%20this%20feature%20request'
+                                           f'&body=Please%20describe%20the%20request%20in%20detail%20here.%20Thanks%20in%20advance%20:)'),
+                KeyboardBuilder.button(locale.get_string("about_menu.report_issue_btn"),
+                                       url=f'https://github.com/sapienzastudentsnetwork/tgroupsindexerbot/issues/new?'
+                                           f'title=[ISSUE]%20Please%20choose%20a%20title%20for%20this%20issue'
+                                           f'&body=Please%20describe%20the%20issue%20in%20detail%20here.%20Thanks%20in%20advance%20:)')
+            )
+
+            keyboard.add_button(locale.get_string("about_menu.contact_us_btn"),
+                                url=f'tg://resolve?domain=' + GlobalVariables.contact_username)
+
+        keyboard.add_button(locale.get_string("about_menu.back_btn"), "main_menu")
+
+        return text, keyboard.build()
 
     @classmethod
     def get_error_menu(cls, locale: Locale, source: str = "database") -> (str, InlineKeyboardMarkup):
         text = locale.get_string(f"{source}_error_menu.text")
 
-        keyboard = [
-            [InlineKeyboardButton(text=locale.get_string(f"{source}_error_menu.contact_us_btn"),
-                                  url=f'tg://resolve?domain=' + GlobalVariables.contact_username)],
-            [InlineKeyboardButton(text=locale.get_string(f"{source}_error_menu.back_btn"),
-                                  callback_data="main_menu")]
-        ]
+        keyboard = KeyboardBuilder()
 
-        return text, InlineKeyboardMarkup(keyboard)
+        keyboard.add_button(locale.get_string(f"{source}_error_menu.contact_us_btn"),
+                            url=f'tg://resolve?domain=' + GlobalVariables.contact_username)
+        keyboard.add_button(locale.get_string(f"{source}_error_menu.back_btn"), "main_menu")
+
+        return text, keyboard.build()
 
     @classmethod
     def get_expired_session_menu(cls) -> (str, InlineKeyboardMarkup):
@@ -126,11 +119,9 @@ class Menus:
 
         text = locale.get_string("expired_session_menu.text")
 
-        keyboard = [
-            [InlineKeyboardButton(text=locale.get_string("expired_session_menu.refresh_session_btn"),
-                                  callback_data="refresh_session")],
-            [InlineKeyboardButton(text=locale.get_string("expired_session_menu.about_btn"),
-                                  callback_data="expired_session_about_alert")]
-        ]
+        keyboard = KeyboardBuilder()
+
+        keyboard.add_button(locale.get_string("expired_session_menu.refresh_session_btn"), "refresh_session")
+        keyboard.add_button(locale.get_string("expired_session_menu.about_btn"), "expired_session_about_alert")
 
-        return text, InlineKeyboardMarkup(keyboard)
+        return text, keyboard.build()
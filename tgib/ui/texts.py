@@ -0,0 +1,146 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+
+import telegram
+from telegram import InlineKeyboardMarkup
+from telegram.constants import MessageLimit
+
+from tgib.data.caches import TTLCache
+
+
+class TextBuffer:
+    # Texts are collected as a list of parts and only joined once, when they are read or
+    # split, so building them takes linear time however long they get
+
+    def __init__(self, text: str = ""):
+        self.parts = [text] if text else []
+
+    def __iadd__(self, text: str):
+        self.parts.append(text)
+
+        return self
+
+    def __str__(self) -> str:
+        return self.get_text()
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self.parts)
+
+    def get_text(self) -> str:
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+
+        return self.parts[0] if self.parts else ""
+
+    def split(self, max_length: int = MessageLimit.MAX_TEXT_LENGTH) -> list:
+        return TextBuffer.split_text(self.get_text(), max_length)
+
+    @classmethod
+    def split_text(cls, text: str, max_length: int = MessageLimit.MAX_TEXT_LENGTH) -> list:
+        if len(text) <= max_length:
+            return [text]
+
+        chunks = []
+
+        chunk_lines, chunk_length = [], 0
+
+        def flush_chunk_lines():
+            chunk = "\n".join(chunk_lines).strip("\n")
+
+            if chunk.strip():
+                chunks.append(chunk)
+
+            chunk_lines.clear()
+
+        # Chunks are split on line boundaries (so that HTML tags, which never span multiple
+        # lines in the bot's texts, aren't broken), unless a single line exceeds max_length
+        for line in text.split("\n"):
+            if chunk_lines and chunk_length + 1 + len(line) > max_length:
+                flush_chunk_lines()
+
+            while len(line) > max_length:
+                chunks.append(line[:max_length])
+
+                line = line[max_length:]
+
+            if not chunk_lines:
+                chunk_length = len(line)
+            else:
+                chunk_length += 1 + len(line)
+
+            chunk_lines.append(line)
+
+        flush_chunk_lines()
+
+        return chunks if chunks else [text[:max_length]]
+
+
+class ChunkedMessages:
+    # Messages sent before the latest menu message of each chat to hold the beginning of texts
+    # too long to fit in a single message, which are deleted as soon as the menu changes (or its
+    # session expires), and otherwise forgotten after as long as a session lasts
+    leading_message_ids = TTLCache(maxsize=50000, ttl=3 * 24 * 60 * 60)
+
+    @classmethod
+    def has_leading_messages(cls, chat_id: int) -> bool:
+        return bool(cls.leading_message_ids.peek(chat_id))
+
+    @classmethod
+    async def delete_leading_messages(cls, bot: telegram.Bot, chat_id: int) -> None:
+        for message_id in cls.leading_message_ids.pop(chat_id, []):
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except Exception:
+                pass
+
+    @classmethod
+    async def send(cls, bot: telegram.Bot, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None, edit_message_id: int = None, resume: bool = False) -> telegram.Message:
+        chunks = TextBuffer.split_text(text)
+
+        # Resuming the send of the same text after it failed midway only sends the chunks which
+        # weren't delivered, which follow the leading messages it already sent
+        if resume:
+            leading_message_ids = cls.leading_message_ids.pop(chat_id, [])[:len(chunks) - 1]
+
+        else:
+            await cls.delete_leading_messages(bot, chat_id)
+
+            leading_message_ids = []
+
+        new_message = None
+
+        for i, chunk in enumerate(chunks):
+            if i < len(leading_message_ids):
+                continue
+
+            chunk_reply_markup = reply_markup if i == len(chunks) - 1 else None
+
+            if i == 0 and edit_message_id is not None:
+                new_message = await bot.edit_message_text(text=chunk, chat_id=chat_id, message_id=edit_message_id,
+                                                          reply_markup=chunk_reply_markup)
+            else:
+                new_message = await bot.send_message(chat_id=chat_id, text=chunk, reply_markup=chunk_reply_markup)
+
+            if i < len(chunks) - 1:
+                leading_message_ids.append(new_message.message_id)
+
+                cls.leading_message_ids.set(chat_id, leading_message_ids)
+
+        return new_message
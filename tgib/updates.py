@@ -0,0 +1,104 @@
+# Copyright (C) 2022-2023, Matteo Collica (Matypist)
+#
+# This file is part of the "Telegram Groups Indexer Bot" (TGroupsIndexerBot)
+# project, the original source of which is the following GitHub repository:
+# <https://github.com/sapienzastudentsnetwork/tgroupsindexerbot>.
+#
+# TGroupsIndexerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TGroupsIndexerBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TGroupsIndexerBot. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Updates are processed concurrently (up to workers at a time), except for the ones sharing a chat or a
+    # user, which are processed one at a time in the order they arrived: this way the per-user state kept by
+    # the handlers (sessions, pending inputs, cooldowns) is never touched by two of them at once, and a slow
+    # command only delays the updates of the chat it was sent in and of the user who sent it
+
+    default_workers = 16
+
+    def __init__(self, workers: int, max_pending_updates: int = 1024):
+        # The semaphore of BaseUpdateProcessor only limits the updates being held by the processor,
+        # including the ones waiting for the previous updates of their chats and users to be processed
+        super().__init__(max(workers, max_pending_updates))
+
+        self.workers = workers
+
+        self.workers_semaphore = asyncio.BoundedSemaphore(workers)
+
+        # For each chat or user, the future set once the last update received from it has been processed
+        self.last_updates = {}
+
+        # Functions called with each update as soon as it's received: when one of them returns an awaitable,
+        # it's processed right away in place of the update (e.g. to only answer a repeated click)
+        self.update_filters = []
+
+    @staticmethod
+    def get_ordering_keys(update: object) -> list:
+        keys = set()
+
+        if isinstance(update, Update):
+            if update.effective_chat:
+                keys.add(update.effective_chat.id)
+
+            if update.effective_user:
+                keys.add(update.effective_user.id)
+
+        return list(keys)
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        for update_filter in self.update_filters:
+            replacement = update_filter(update)
+
+            if replacement is not None:
+                coroutine.close()
+
+                await replacement
+
+                return
+
+        keys = self.get_ordering_keys(update)
+
+        # The update is queued behind the previous ones of all of its chats and users before any await,
+        # so that updates sharing a chat or a user can't overtake each other
+        processed = asyncio.get_running_loop().create_future()
+
+        previous_updates = [self.last_updates[key] for key in keys if key in self.last_updates]
+
+        for key in keys:
+            self.last_updates[key] = processed
+
+        try:
+            if previous_updates:
+                await asyncio.wait(previous_updates)
+
+            async with self.workers_semaphore:
+                await coroutine
+
+        finally:
+            processed.set_result(None)
+
+            for key in keys:
+                if self.last_updates.get(key) is processed:
+                    self.last_updates.pop(key)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass